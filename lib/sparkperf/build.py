@@ -1,6 +1,12 @@
+import errno
+import json
 import os
+import re
+import shutil
 from subprocess import Popen, PIPE
-from sparkperf.commands import run_cmd, cd
+import threading
+import time
+from sparkperf.commands import run_cmd, map_in_pool
 from sparkperf.cluster import Cluster
 import logging
 
@@ -20,55 +26,6 @@ def clone_spark(target_dir, spark_git_repo):
                  "'+refs/tags/*:refs/remotes/origin/tag/*'") % target_dir)
 
 
-def checkout_version(repo_dir, commit_id, merge_commit_into_master=False):
-    with cd(repo_dir):
-        # Fetch updates
-        logger.info("Updating Spark repo...")
-        run_cmd("git fetch")
-
-        # Check out the requested commit / branch / PR
-        logger.info("Cleaning Spark and checking out commit_id %s." % commit_id)
-        run_cmd("git clean -f -d -x")
-
-        if merge_commit_into_master:
-            run_cmd("git reset --hard master")
-            run_cmd("git merge %s -m ='Merging %s into master.'" %
-                    (commit_id, commit_id))
-        else:
-            run_cmd("git reset --hard %s" % commit_id)
-
-
-def make_spark_distribution(
-        commit_id, target_dir, spark_git_repo,
-        merge_commit_into_master=False, is_yarn_mode=False,
-        additional_make_distribution_args=""):
-    """
-    Download Spark, check out a specific version, and create a binary distribution.
-
-    :param commit_id: the version to build.  Can specify any of the following:
-        1. A git commit hash         e.g. "4af93ff3"
-        2. A branch name             e.g. "origin/branch-0.7"
-        3. A tag name                e.g. "origin/tag/v0.8.0-incubating"
-        4. A pull request            e.g. "origin/pr/675"
-    :param target_dir: the directory to clone Spark into.
-    :param merge_commit_into_master: if True, this commit_id will be merged into `master`; this can
-                                     be useful for testing un-merged pull requests.
-    :param spark_git_repo: the repo to clone from.  By default, this is the Spark GitHub mirror.
-    """
-    clone_spark(target_dir, spark_git_repo)
-    checkout_version(target_dir, commit_id, merge_commit_into_master)
-    with cd(target_dir):
-        logger.info("Building spark at version %s; This may take a while...\n" % commit_id)
-        # According to the SPARK-1520 JIRA, building with Java 7+ will only cause problems when
-        # running PySpark on YARN or when running on Java 6.  Since we'll be building and running
-        # Spark on the same machines and using standalone mode, it should be safe to
-        # disable this warning:
-        if is_yarn_mode:
-            run_cmd("./make-distribution.sh --skip-java-test -Pyarn " + additional_make_distribution_args)
-        else:
-            run_cmd("./make-distribution.sh --skip-java-test " + additional_make_distribution_args)
-
-
 def copy_configuration(conf_dir, target_dir):
     # Copy Spark configuration files to new directory.
     logger.info("Copying all files from %s to %s/conf/" % (conf_dir, target_dir))
@@ -79,40 +36,266 @@ def copy_configuration(conf_dir, target_dir):
     run_cmd("cp %s/* %s/conf/" % (conf_dir, target_dir))
 
 
+def directory_size(path):
+    """
+    Return the total size in bytes of the files under `path`, not following symlinks.
+    """
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def process_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
 class SparkBuildManager(object):
     """
     Manages a collection of Spark builds, using cached builds (if available) or by
     fetching and building Spark.
+
+    Every build is made in its own git worktree of a shared clone (`master`), so several commits
+    can be built at the same time (see L{build_all}). A finished build is published atomically:
+    the distribution is moved to a temporary directory, marked complete, and then renamed to a
+    directory named after its SHA. Cached builds without the completion marker are half-written
+    and are rebuilt. When the cache holds more than `max_cached_builds` builds or more than
+    `max_cache_bytes` bytes, the least recently used builds are deleted.
     """
-    def __init__(self, root_dir, spark_git_repo="https://github.com/apache/spark.git"):
+
+    # Directories in the cache named like this hold published builds.
+    BUILD_DIR_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+    # File written into a build directory once the build is complete.
+    COMPLETE_MARKER = ".sparkperf-build-complete"
+    # Prefix of the directories builds are published from, followed by "<sha>-<pid>".
+    PARTIAL_PREFIX = ".partial-"
+
+    def __init__(self, root_dir, spark_git_repo="https://github.com/apache/spark.git",
+                 max_cached_builds=None, max_cache_bytes=None):
         self.root_dir = root_dir
         self.spark_git_repo = spark_git_repo
+        self.max_cached_builds = max_cached_builds
+        self.max_cache_bytes = max_cache_bytes
         self._master_spark = os.path.join(self.root_dir, "master")
+        self._worktrees_dir = os.path.join(self.root_dir, "worktrees")
+        # Serializes operations on the shared clone, whose refs and worktree list are not safe
+        # to update concurrently.
+        self._git_lock = threading.Lock()
+        self._fetched = False
         if not os.path.isdir(root_dir):
             os.makedirs(root_dir)
+        self._remove_stale_partial_builds()
+
+    def _build_dir(self, sha):
+        return os.path.join(self.root_dir, sha)
+
+    def _marker_path(self, sha):
+        return os.path.join(self._build_dir(sha), self.COMPLETE_MARKER)
+
+    def _write_marker(self, build_dir, sha, commit_id):
+        with open(os.path.join(build_dir, self.COMPLETE_MARKER), "w") as marker:
+            json.dump({"sha": sha, "commit_id": commit_id, "built_at": time.time()}, marker)
+
+    def _remove_stale_partial_builds(self):
+        for name in os.listdir(self.root_dir):
+            if name.startswith(self.PARTIAL_PREFIX):
+                pid = name.rsplit("-", 1)[-1]
+                if not (pid.isdigit() and process_is_alive(int(pid))):
+                    logger.info("Removing partially published build %s" % name)
+                    shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
 
-    def get_cluster(self, commit_id, conf_dir, merge_commit_into_master=False, is_yarn_mode=False, additional_make_distribution_args=""):
-        if not os.path.isdir(self._master_spark):
-            clone_spark(self._master_spark, self.spark_git_repo)
-        # Get the SHA corresponding to the commit and check if we've already built this version:
-        checkout_version(self._master_spark, commit_id, merge_commit_into_master)
-        sha = Popen("cd %s; git rev-parse --verify HEAD" % self._master_spark, shell=True,
-                     stdout=PIPE).communicate()[0]
-        sha = sha.strip()
+    def is_built(self, sha):
+        """
+        :return: True if a complete build of `sha` is in the cache. Builds made before
+                 completion markers were introduced are marked complete if they look like
+                 finished distributions.
+        """
+        build_dir = self._build_dir(sha)
+        if os.path.isfile(self._marker_path(sha)):
+            return True
+        if (os.path.isfile(os.path.join(build_dir, "RELEASE")) and
+                os.path.isfile(os.path.join(build_dir, "bin", "spark-submit"))):
+            self._write_marker(build_dir, sha, None)
+            return True
+        return False
+
+    def _git(self, args):
+        return Popen("cd %s; git %s" % (self._master_spark, args), shell=True,
+                     stdout=PIPE).communicate()[0].strip()
+
+    def _fetch(self):
+        """
+        Clone the Spark repo if needed and fetch updates, once per manager. The caller must hold
+        the git lock.
+        """
+        clone_spark(self._master_spark, self.spark_git_repo)
+        if not self._fetched:
+            logger.info("Updating Spark repo...")
+            run_cmd("cd %s && git fetch" % self._master_spark)
+            self._fetched = True
+
+    def resolve_sha(self, commit_id):
+        """
+        Return the SHA of `commit_id` in the Spark repo, fetching updates once per manager.
+        """
+        with self._git_lock:
+            self._fetch()
+            sha = self._git("rev-parse --verify %s^{commit}" % commit_id)
+        assert sha, "Could not find commit %s in %s" % (commit_id, self.spark_git_repo)
         logger.debug("Requested version %s corresponds to SHA %s" % (commit_id, sha))
-        cluster_dir = os.path.join(self.root_dir, sha)
-        # TODO: detect and recover from failed builds?
-        logger.debug("Searching for dir %s" % cluster_dir)
-        if os.path.exists(cluster_dir):
-            logger.info("Found pre-compiled Spark with SHA %s; skipping build" % sha)
+        return sha
+
+    def ensure_built(self, commit_id, merge_commit_into_master=False, is_yarn_mode=False,
+                     additional_make_distribution_args=""):
+        """
+        Build `commit_id` unless a complete build of it is already cached.
+
+        :param commit_id: the version to build.  Can specify any of the following:
+            1. A git commit hash         e.g. "4af93ff3"
+            2. A branch name             e.g. "origin/branch-0.7"
+            3. A tag name                e.g. "origin/tag/v0.8.0-incubating"
+            4. A pull request            e.g. "origin/pr/675"
+        :param merge_commit_into_master: if True, this commit_id will be merged into `master`;
+                                         this can be useful for testing un-merged pull requests.
+        :return: the SHA of the build.
+        """
+        if merge_commit_into_master:
+            start_point = "master"
         else:
-            logger.info("Could not find pre-compiled Spark with SHA %s" % sha)
-            # Check out and build the requested version of Spark in the master spark directory
-            make_spark_distribution(
-                commit_id=commit_id, target_dir=self._master_spark, spark_git_repo=self.spark_git_repo,
-                merge_commit_into_master=merge_commit_into_master, is_yarn_mode=is_yarn_mode,
-                additional_make_distribution_args=additional_make_distribution_args)
-            # Copy the completed build to a directory named after the SHA.
-            run_cmd("mv %s %s" % (os.path.join(self._master_spark, "dist"), cluster_dir))
+            start_point = self.resolve_sha(commit_id)
+            if self.is_built(start_point):
+                logger.info("Found pre-compiled Spark with SHA %s; skipping build" % start_point)
+                return start_point
+            logger.info("Could not find pre-compiled Spark with SHA %s" % start_point)
+            if os.path.exists(self._build_dir(start_point)):
+                logger.info("Removing incomplete build of SHA %s" % start_point)
+                shutil.rmtree(self._build_dir(start_point))
+
+        worktree = os.path.join(self._worktrees_dir, "%s-%d-%d" % (
+            start_point, os.getpid(), threading.current_thread().ident))
+        with self._git_lock:
+            # The commit to merge (e.g. a pull request) must be fetched in merge mode too.
+            self._fetch()
+            run_cmd("cd %s && git worktree prune && git worktree add --detach %s %s" %
+                    (self._master_spark, worktree, start_point))
+        try:
+            # Builds run in threads, so commands are run in the worktree with "cd" rather than
+            # by changing the working directory of the whole process.
+            if merge_commit_into_master:
+                run_cmd("cd %s && git merge %s -m ='Merging %s into master.'" %
+                        (worktree, commit_id, commit_id))
+            sha = Popen("cd %s; git rev-parse --verify HEAD" % worktree, shell=True,
+                        stdout=PIPE).communicate()[0].strip()
+            if merge_commit_into_master and self.is_built(sha):
+                return sha
+            logger.info("Building spark at version %s; This may take a while...\n" % commit_id)
+            # According to the SPARK-1520 JIRA, building with Java 7+ will only cause problems
+            # when running PySpark on YARN or when running on Java 6.  Since we'll be building
+            # and running Spark on the same machines and using standalone mode, it should be
+            # safe to disable this warning:
+            if is_yarn_mode:
+                run_cmd("cd %s && ./make-distribution.sh --skip-java-test -Pyarn %s" %
+                        (worktree, additional_make_distribution_args))
+            else:
+                run_cmd("cd %s && ./make-distribution.sh --skip-java-test %s" %
+                        (worktree, additional_make_distribution_args))
+            self._publish(os.path.join(worktree, "dist"), sha, commit_id)
+        finally:
+            with self._git_lock:
+                run_cmd("cd %s && git worktree remove --force %s" % (self._master_spark, worktree),
+                        exit_on_fail=False)
+        return sha
+
+    def _publish(self, dist_dir, sha, commit_id):
+        """
+        Atomically move a finished distribution into the cache as the build of `sha`.
+        """
+        partial_dir = os.path.join(self.root_dir, "%s%s-%d" % (self.PARTIAL_PREFIX, sha,
+                                                               os.getpid()))
+        shutil.move(dist_dir, partial_dir)
+        self._write_marker(partial_dir, sha, commit_id)
+        try:
+            os.rename(partial_dir, self._build_dir(sha))
+        except OSError:
+            # Another build of the same SHA was published first.
+            shutil.rmtree(partial_dir)
+
+    def build_all(self, commit_ids, max_parallel_builds=2, merge_commit_into_master=False,
+                  is_yarn_mode=False, additional_make_distribution_args=""):
+        """
+        Build several commits, running up to `max_parallel_builds` builds at the same time.
+
+        :return: a list with the SHA of each of `commit_ids`.
+        """
+        # Resolve (and fetch) up front so that the builds do not contend for the git lock.
+        if merge_commit_into_master:
+            with self._git_lock:
+                self._fetch()
+        else:
+            for commit_id in commit_ids:
+                self.resolve_sha(commit_id)
+        args_list = [(commit_id, merge_commit_into_master, is_yarn_mode,
+                      additional_make_distribution_args) for commit_id in commit_ids]
+        shas = [None] * len(commit_ids)
+        for i, sha in map_in_pool(self.ensure_built, args_list, max_parallel_builds):
+            shas[i] = sha
+        self.evict(keep=shas)
+        return shas
+
+    def evict(self, keep=()):
+        """
+        Delete the least recently used builds until the cache is within its limits. The builds
+        of the SHAs in `keep` are never deleted.
+        """
+        if self.max_cached_builds is None and self.max_cache_bytes is None:
+            return
+        builds = []
+        for name in os.listdir(self.root_dir):
+            if self.BUILD_DIR_PATTERN.match(name) and self.is_built(name):
+                builds.append((os.path.getmtime(self._marker_path(name)), name,
+                               directory_size(self._build_dir(name))))
+        builds.sort()
+        num_builds = len(builds)
+        total_bytes = sum(size for _, _, size in builds)
+        for _, sha, size in builds:
+            too_many = self.max_cached_builds is not None and num_builds > self.max_cached_builds
+            too_big = self.max_cache_bytes is not None and total_bytes > self.max_cache_bytes
+            if not (too_many or too_big):
+                break
+            if sha in keep:
+                continue
+            logger.info("Evicting least recently used Spark build %s" % sha)
+            # Remove the marker first, so that an interrupted deletion is not mistaken for a
+            # complete build.
+            os.remove(self._marker_path(sha))
+            shutil.rmtree(self._build_dir(sha))
+            num_builds -= 1
+            total_bytes -= size
+
+    def get_cluster(self, commit_id, conf_dir, merge_commit_into_master=False, is_yarn_mode=False,
+                    additional_make_distribution_args="", master_ui_url=None, sha=None,
+                    keep=()):
+        """
+        :param sha: the SHA of a build of `commit_id` which was already made with L{build_all},
+                    or None to build `commit_id` if needed. In merge mode, every merge makes a
+                    new SHA, so passing it avoids building the commit a second time.
+        :param keep: the SHAs of other builds, e.g. those made with L{build_all}, which must
+                     not be evicted from the cache.
+        """
+        if sha is None:
+            sha = self.ensure_built(commit_id, merge_commit_into_master, is_yarn_mode,
+                                    additional_make_distribution_args)
+        # Record the use of this build for least-recently-used eviction.
+        os.utime(self._marker_path(sha), None)
+        self.evict(keep=[sha] + list(keep))
+        cluster_dir = self._build_dir(sha)
         copy_configuration(conf_dir, cluster_dir)
-        return Cluster(spark_home=cluster_dir, spark_conf_dir=conf_dir, commit_sha=sha)
+        return Cluster(spark_home=cluster_dir, spark_conf_dir=conf_dir, commit_sha=sha,
+                       master_ui_url=master_ui_url)
@@ -1,8 +1,36 @@
-from sparkperf.commands import run_cmd, make_ssh_cmd, make_rsync_cmd, run_cmds_parallel, clear_dir
+from sparkperf.commands import run_cmd, make_ssh_cmd, make_rsync_cmd, run_cmds_parallel, \
+    clear_dir, run_remote_cmd
+import json
+import logging
 import re
 import os
+import socket
 import sys
 import time
+import urllib2
+
+
+logger = logging.getLogger("sparkperf.cluster")
+
+# Bounds on the interval between checks for running executors, in seconds.
+MIN_POLL_INTERVAL = 0.25
+MAX_POLL_INTERVAL = 5
+
+
+def standalone_master_ui_url(cluster_url):
+    """
+    Return the URL of the web UI of the standalone master at `cluster_url`, or None if
+    `cluster_url` does not point to a standalone master.
+
+    >>> standalone_master_ui_url("spark://host1:7077")
+    'http://host1:8080'
+    >>> standalone_master_ui_url("yarn") is None
+    True
+    """
+    match = re.match(r"spark://([^:/,]+)(:\d+)?$", cluster_url)
+    if match is None:
+        return None
+    return "http://%s:8080" % match.group(1)
 
 
 class Cluster(object):
@@ -10,10 +38,16 @@ class Cluster(object):
     Functionality for interacting with a Spark cluster.
     """
 
-    def __init__(self, spark_home, spark_conf_dir=None, commit_sha="unknown"):
+    def __init__(self, spark_home, spark_conf_dir=None, commit_sha="unknown", master_ui_url=None):
+        """
+        :param master_ui_url: URL of the standalone master's web UI, used to check whether
+                              executors are running without connecting to every slave.
+        """
         self.spark_home = spark_home
         self.spark_conf_dir = spark_conf_dir or "%s/conf" % spark_home
         self.commit_sha = commit_sha
+        self.master_ui_url = master_ui_url
+        self.total_stop_wait = 0.0
 
         # Get a list of slaves by parsing the slaves file in SPARK_CONF_DIR.
         slaves_file_path = "%s/slaves" % self.spark_conf_dir
@@ -45,20 +79,51 @@ class Cluster(object):
 
     def ensure_spark_stopped_on_slaves(self):
         """
-        Ensures that no executors are running on Spark slaves. Executors can continue to run for some
-        time after a shutdown signal is given due to cleaning up temporary files.
+        Ensures that no executors are running on Spark slaves. Executors can continue to run for
+        some time after a shutdown signal is given due to cleaning up temporary files.
+
+        Executors are checked for with an increasing interval and this returns as soon as none
+        remain. The time spent waiting is logged.
         """
-        stop = False
-        while not stop:
-            cmd = "ps -ef | grep -v grep | grep ExecutorBackend"
-            ret_vals = run_cmds_parallel([(make_ssh_cmd(cmd, s), False) for s in self.slaves])
-            if 0 in ret_vals:
-                print "Spark is still running on some slaves ... sleeping for 10 seconds"
-                time.sleep(10)
-            else:
-                stop = True
-        # Allow some extra time for slaves to fully terminate.
-        time.sleep(5)
+        start = time.time()
+        poll_interval = MIN_POLL_INTERVAL
+        while self.executors_running():
+            print("Spark is still running on some slaves ... sleeping for %s seconds" %
+                  poll_interval)
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
+        wait_time = time.time() - start
+        self.total_stop_wait += wait_time
+        logger.info("Waited %.2f s for executors to stop (%.2f s in total)" %
+                    (wait_time, self.total_stop_wait))
+
+    def executors_running(self):
+        """
+        :return: True if any executors are running. The standalone master's JSON status endpoint
+                 is queried first, if it is reachable. The master releases the cores of an
+                 application before its executors have exited, so once it reports no cores in
+                 use, each slave is checked for executor processes over its persistent SSH
+                 connection.
+        """
+        if self._executors_running_according_to_master():
+            return True
+        cmd = "ps -ef | grep -v grep | grep ExecutorBackend"
+        results = run_remote_cmd(cmd, self.slaves)
+        return any(result.return_code == 0 for result in results)
+
+    def _executors_running_according_to_master(self):
+        """
+        :return: whether the standalone master reports any cores in use by executors, or None if
+                 the master could not be queried.
+        """
+        if self.master_ui_url is None:
+            return None
+        try:
+            resp = urllib2.urlopen(self.master_ui_url + "/json", timeout=5)
+            state = json.loads(resp.read())
+        except (urllib2.URLError, socket.error, ValueError):
+            return None
+        return any(worker.get("coresused", 0) > 0 for worker in state.get("workers", []))
 
     def warmup_disks(self, bytes_to_write, disk_warmup_files):
         """
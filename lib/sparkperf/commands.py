@@ -1,12 +1,26 @@
+from collections import namedtuple
 import os
 import os.path
-from subprocess import Popen
+import Queue
+from subprocess import Popen, PIPE
 import sys
 import threading
+import time
 from contextlib import contextmanager
 
 SBT_CMD = "sbt/sbt"
 
+SSH_OPTS = "-o StrictHostKeyChecking=no -o ConnectTimeout=5"
+# Keep one master connection per host open in the background, for 10 minutes after last use.
+SSH_MULTIPLEX_OPTS = ("-o ControlMaster=auto -o ControlPath=/tmp/sparkperf-ssh-%r@%h:%p "
+                      "-o ControlPersist=600")
+
+# Maximum number of commands that run_cmds_parallel and run_remote_cmd run at the same time.
+MAX_PARALLEL_CMDS = 32
+
+# The outcome of running a command on a remote host.
+CommandResult = namedtuple("CommandResult", ["host", "return_code", "stdout", "stderr"])
+
 @contextmanager
 def cd(target_dir):
     """
@@ -43,41 +57,151 @@ def run_cmd(cmd, exit_on_fail=True):
     return return_code
 
 
-def run_cmds_parallel(commands):
+def map_in_pool(func, args_list, num_workers):
     """
-    Run several commands in parallel, waiting for them all to finish.
-    :param commands: an array of tuples, where each tuple consists of (command_name, exit_on_fail)
+    Call `func(*args)` for each tuple of arguments in `args_list`, using at most `num_workers`
+    threads. An exception raised by `func` (including SystemExit from run_cmd) is re-raised in
+    the calling thread.
+
+    >>> sorted(map_in_pool(lambda x, y: x + y, [(1, 2), (3, 4), (5, 6)], 2))
+    [(0, 3), (1, 7), (2, 11)]
+
+    :return: a generator of (index, result) tuples, yielded in the order in which calls finish.
     """
-    threads = []
-    results = [None] * len(commands)
-    
-    def run_cmd_in_thread(i, cmd,  exit_on_fail):
-        return_code = run_cmd(cmd, exit_on_fail)
-        results[i] = return_code
+    pending = Queue.Queue()
+    for i, args in enumerate(args_list):
+        pending.put((i, args))
+    finished = Queue.Queue()
+
+    def call_from_queue():
+        while True:
+            try:
+                i, args = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                finished.put((i, func(*args), None))
+            except BaseException:
+                finished.put((i, None, sys.exc_info()))
 
-    for i, (cmd_name, exit_on_fail) in enumerate(commands):
-        thread = threading.Thread(target=run_cmd_in_thread, args=(i, cmd_name, exit_on_fail))
+    threads = []
+    for _ in range(min(num_workers, len(args_list))):
+        thread = threading.Thread(target=call_from_queue)
         thread.daemon = True
         thread.start()
         threads.append(thread)
 
+    for _ in range(len(args_list)):
+        i, result, exc_info = finished.get()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        yield (i, result)
     for thread in threads:
         thread.join()
+
+
+def run_cmds_parallel(commands, max_workers=MAX_PARALLEL_CMDS):
+    """
+    Run several commands in parallel, waiting for them all to finish.
+
+    >>> run_cmds_parallel([("true", False), ("exit 2", False)], max_workers=1)
+    true
+    exit 2
+    [0, 2]
+
+    :param commands: an array of tuples, where each tuple consists of (command_name, exit_on_fail)
+    :param max_workers: the maximum number of commands to run at the same time.
+    :return: the return codes of the commands, in the order of `commands`.
+    """
+    results = [None] * len(commands)
+    for i, return_code in map_in_pool(run_cmd, commands, max_workers):
+        results[i] = return_code
     return results
 
-def make_ssh_cmd(cmd_name, host):
+
+def wait_for_process(process, on_poll=None, poll_interval=1.0):
+    """
+    Wait for `process` to exit, calling `on_poll()` about every `poll_interval` seconds while it
+    runs and once more after it exits.
+
+    >>> wait_for_process(Popen("exit 4", shell=True), lambda: None, 0.01)
+    4
+
+    :return: the return code of the process.
+    """
+    if on_poll is None:
+        return process.wait()
+    while process.poll() is None:
+        on_poll()
+        time.sleep(poll_interval)
+    on_poll()
+    return process.returncode
+
+
+def run_cmds_in_pool(commands, num_workers, on_poll=None, poll_interval=1.0):
+    """
+    Run shell commands with at most `num_workers` of them running at the same time.
+
+    >>> sorted(r[:2] for r in run_cmds_in_pool([("true", None), ("exit 3", None)], 2))
+    [(0, 0), (1, 3)]
+
+    :param commands: an array of tuples, where each tuple consists of (command, env); env is the
+                     environment to run the command with, or None to inherit the current one.
+    :param on_poll: if given, called from the waiting thread with the index of each running
+                    command about every `poll_interval` seconds (see L{wait_for_process}).
+    :return: a generator of (index, return_code, start_time, end_time) tuples, yielded in the
+             order in which the commands finish.
+    """
+    def run_timed_cmd(i, cmd, env):
+        start_time = time.time()
+        process = Popen(cmd, shell=True, env=env)
+        poll = (lambda: on_poll(i)) if on_poll is not None else None
+        return_code = wait_for_process(process, poll, poll_interval)
+        return (return_code, start_time, time.time())
+
+    args_list = [(i, cmd, env) for i, (cmd, env) in enumerate(commands)]
+    for i, (return_code, start_time, end_time) in map_in_pool(run_timed_cmd, args_list,
+                                                              num_workers):
+        yield (i, return_code, start_time, end_time)
+
+
+def run_remote_cmd(cmd_name, hosts, max_workers=MAX_PARALLEL_CMDS):
+    """
+    Run `cmd_name` on each of `hosts` over their persistent SSH connections, capturing its output.
+
+    :param max_workers: the maximum number of hosts to run the command on at the same time.
+    :return: a list of L{CommandResult}, in the order of `hosts`.
+    """
+    def run_on_host(host):
+        process = Popen(make_ssh_cmd(cmd_name, host), shell=True, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
+        return CommandResult(host, process.returncode, stdout, stderr)
+
+    results = [None] * len(hosts)
+    for i, result in map_in_pool(run_on_host, [(host,) for host in hosts], max_workers):
+        results[i] = result
+    return results
+
+def make_ssh_cmd(cmd_name, host, multiplex=True):
     """
     Return a command running `cmd_name` on `host` with proper SSH configs.
+
+    :param multiplex: if True, run the command over a persistent master connection to `host`
+                      which is shared by all multiplexed commands, instead of paying for a new
+                      SSH handshake on every call.
     """
-    return "ssh -o StrictHostKeyChecking=no -o ConnectTimeout=5 %s '%s'" % (host, cmd_name)
+    ssh_opts = SSH_OPTS
+    if multiplex:
+        ssh_opts += " " + SSH_MULTIPLEX_OPTS
+    return "ssh %s %s '%s'" % (ssh_opts, host, cmd_name)
 
 
 def make_rsync_cmd(dir_name, host):
     """
     Return a command which copies the supplied directory to the given host.
     """
-    return ('rsync --delete -e "ssh -o StrictHostKeyChecking=no -o ConnectTimeout=5" -az "%s/" '
-            '"%s:%s"') % (dir_name, host, os.path.abspath(dir_name))
+    return ('rsync --delete -e "ssh %s %s" -az "%s/" "%s:%s"') % (
+        SSH_OPTS, SSH_MULTIPLEX_OPTS, dir_name, host, os.path.abspath(dir_name))
 
 
 def clear_dir(dir_name, hosts, prompt_for_deletes):
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""
+Detect performance regressions between two commits whose results are in the result store.
+
+Runs of the two commits are paired by option combination (see L{sparkperf.utils.option_hash}),
+and the per-trial measurements of each pair are compared with a Mann-Whitney U test and a
+bootstrap confidence interval for the ratio of their medians.
+"""
+
+import argparse
+from collections import namedtuple
+import json
+from math import erfc, sqrt
+import random
+import sys
+
+from sparkperf.result_store import ResultStore
+from sparkperf.utils import OUTPUT_DIVIDER_STRING
+
+
+# Result of comparing the measurements of one option combination between two commits.
+# ratio and ci_low/ci_high are candidate median / baseline median, or None if the baseline median
+# is 0 (as for stage metrics like spilled bytes on tests which do not spill).
+Comparison = namedtuple("Comparison", ["short_name", "opts", "baseline_median", "candidate_median",
+                                       "ratio", "ci_low", "ci_high", "p_value", "regression"])
+
+
+def median(values):
+    """
+    >>> median([3.0, 1.0, 2.0])
+    2.0
+    >>> median([4.0, 1.0, 2.0, 3.0])
+    2.5
+    """
+    values = sorted(values)
+    mid = len(values) / 2
+    if len(values) % 2 == 0:
+        return (values[mid - 1] + values[mid]) / 2.0
+    return values[mid]
+
+
+def _ranks(values):
+    """
+    Return the rank of each of `values`, where tied values get the average of their ranks.
+
+    >>> _ranks([10, 20, 20, 30])
+    [1.0, 2.5, 2.5, 4.0]
+    """
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+            end += 1
+        for i in order[start:end + 1]:
+            ranks[i] = (start + end) / 2.0 + 1
+        start = end + 1
+    return ranks
+
+
+def mann_whitney_u(a, b):
+    """
+    Two-sided Mann-Whitney U test of whether `a` and `b` come from the same distribution, using
+    the normal approximation with tie and continuity corrections.
+
+    >>> u, p = mann_whitney_u([1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12])
+    >>> u, round(p, 4)
+    (0.0, 0.0051)
+    >>> mann_whitney_u([1, 1, 1], [1, 1, 1])
+    (4.5, 1.0)
+
+    :return: a (u, p_value) tuple, where u is the U statistic of `a`.
+    """
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    ranks = _ranks(list(a) + list(b))
+    u = sum(ranks[:n1]) - n1 * (n1 + 1) / 2.0
+    mean_u = n1 * n2 / 2.0
+    tie_counts = {}
+    for value in list(a) + list(b):
+        tie_counts[value] = tie_counts.get(value, 0) + 1
+    tie_term = sum(t ** 3 - t for t in tie_counts.values()) / float(n * (n - 1))
+    sigma_u = sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term))
+    if sigma_u == 0:
+        return (u, 1.0)
+    z = (abs(u - mean_u) - 0.5) / sigma_u
+    return (u, min(1.0, erfc(max(z, 0.0) / sqrt(2))))
+
+
+def _median_ratio(baseline, candidate):
+    """
+    :return: median(candidate) / median(baseline), where 0 / 0 is 1 and x / 0 is infinite.
+    """
+    baseline_median = median(baseline)
+    candidate_median = median(candidate)
+    if baseline_median == 0:
+        return 1.0 if candidate_median == 0 else float("inf")
+    return candidate_median / float(baseline_median)
+
+
+def bootstrap_ratio_ci(baseline, candidate, confidence=0.95, num_resamples=2000, seed=42):
+    """
+    Bootstrap confidence interval for median(candidate) / median(baseline).
+
+    >>> low, high = bootstrap_ratio_ci([10.0, 10.1, 9.9, 10.0], [12.0, 12.1, 11.9, 12.0])
+    >>> 1.15 < low <= high < 1.25
+    True
+
+    Resamples of the baseline with a median of 0 give a ratio of 1 if the candidate's median is
+    also 0, and an infinite one otherwise:
+
+    >>> bootstrap_ratio_ci([0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
+    (1.0, 1.0)
+    >>> bootstrap_ratio_ci([0.0, 0.0, 0.0], [5.0, 5.0, 5.0])
+    (inf, inf)
+
+    :return: a (low, high) tuple.
+    """
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(num_resamples):
+        baseline_sample = [rng.choice(baseline) for _ in baseline]
+        candidate_sample = [rng.choice(candidate) for _ in candidate]
+        ratios.append(_median_ratio(baseline_sample, candidate_sample))
+    ratios.sort()
+    tail = (1.0 - confidence) / 2
+    return (ratios[int(tail * (num_resamples - 1))], ratios[int((1 - tail) * (num_resamples - 1))])
+
+
+def compare_measurements(short_name, opts, baseline, candidate, threshold=0.05, alpha=0.05):
+    """
+    Compare the measurements of one option combination. The candidate is flagged as a regression
+    if it is slower than the baseline by more than `threshold` (a fraction of the baseline
+    median) and the difference is significant at level `alpha`.
+
+    >>> c = compare_measurements("t", "", [10.0, 10.2, 9.8, 10.1, 9.9, 10.0],
+    ...                          [11.0, 11.2, 10.8, 11.1, 10.9, 11.0])
+    >>> round(c.ratio, 2), c.regression
+    (1.1, True)
+    >>> compare_measurements("t", "", [10.0, 10.2, 9.8], [10.1, 9.9, 10.0]).regression
+    False
+
+    A slowdown relative to a baseline median of 0 is undefined, so such combinations are reported
+    without a ratio and never flagged:
+
+    >>> c = compare_measurements("t", "", [0.0, 0.0, 0.0], [0.0, 0.0, 100.0])
+    >>> c.ratio, c.ci_low, c.ci_high, c.regression
+    (None, None, None, False)
+
+    :return: a L{Comparison}.
+    """
+    baseline_median = median(baseline)
+    candidate_median = median(candidate)
+    _, p_value = mann_whitney_u(baseline, candidate)
+    if baseline_median == 0:
+        return Comparison(short_name, opts, baseline_median, candidate_median, None, None, None,
+                          p_value, False)
+    ratio = candidate_median / float(baseline_median)
+    ci_low, ci_high = bootstrap_ratio_ci(baseline, candidate)
+    regression = p_value < alpha and ratio > 1 + threshold
+    return Comparison(short_name, opts, baseline_median, candidate_median, ratio, ci_low, ci_high,
+                      p_value, regression)
+
+
+def _measurements_by_combination(store, commit_sha, metric, ignored_trials):
+    """
+    :param ignored_trials: number of leading trials to drop from runs which did not detect their
+                           own warm-up trials.
+    :return: a dict mapping option hashes to (short_name, opts, values), pooling the
+             measurements of all successful runs of each option combination of the commit.
+    """
+    measurements = {}
+    for run in store.find_runs(commit_sha=commit_sha, status="ok"):
+        num_ignored = run["warmup_trials"]
+        if num_ignored is None:
+            num_ignored = ignored_trials
+        values = store.trial_values(run["id"], metric)[num_ignored:]
+        if not values:
+            continue
+        opts = " ".join(json.loads(run["java_opts"]) + json.loads(run["opts"]))
+        entry = measurements.setdefault(run["opt_hash"], (run["short_name"], opts, []))
+        entry[2].extend(values)
+    return measurements
+
+
+def compare_commits(store, baseline_sha, candidate_sha, metric="time", ignored_trials=0,
+                    threshold=0.05, alpha=0.05):
+    """
+    Compare every option combination that was run for both commits.
+
+    :return: a list of L{Comparison}, ordered by test name.
+    """
+    baseline = _measurements_by_combination(store, baseline_sha, metric, ignored_trials)
+    candidate = _measurements_by_combination(store, candidate_sha, metric, ignored_trials)
+    comparisons = []
+    for combination in set(baseline) & set(candidate):
+        short_name, opts, baseline_values = baseline[combination]
+        candidate_values = candidate[combination][2]
+        comparisons.append(compare_measurements(short_name, opts, baseline_values,
+                                                candidate_values, threshold, alpha))
+    return sorted(comparisons, key=lambda c: (c.short_name, c.opts))
+
+
+def format_report(comparisons, baseline_sha, candidate_sha):
+    lines = [OUTPUT_DIVIDER_STRING,
+             "Comparing %s (candidate) against %s (baseline)" % (candidate_sha, baseline_sha),
+             OUTPUT_DIVIDER_STRING,
+             "# Test name, test options, baseline median, candidate median, ratio, "
+             "95% CI of ratio, p-value"]
+    for c in comparisons:
+        if c.ratio is None:
+            ratio = "n/a (baseline median is 0), n/a"
+        else:
+            ratio = "%.3f, [%.3f, %.3f]" % (c.ratio, c.ci_low, c.ci_high)
+        lines.append("%s%s, %s, %.3f, %.3f, %s, %.4f" % (
+            "REGRESSION: " if c.regression else "", c.short_name, c.opts, c.baseline_median,
+            c.candidate_median, ratio, c.p_value))
+    num_regressions = len([c for c in comparisons if c.regression])
+    lines.append(OUTPUT_DIVIDER_STRING)
+    lines.append("Compared %d option combinations, found %d regressions." %
+                 (len(comparisons), num_regressions))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the results of two Spark commits '
+        'stored in the spark-perf result store and report significant slowdowns.')
+    parser.add_argument('baseline', help='commit SHA of the baseline results')
+    parser.add_argument('candidate', help='commit SHA of the results to check for regressions')
+    parser.add_argument('--results-db', default="results/sparkperf_results.db",
+                        help='path to the result store (RESULTS_DB in the config file)')
+    parser.add_argument('--metric', default="time", help='per-trial metric to compare')
+    parser.add_argument('--ignored-trials', type=int, default=2,
+                        help='number of warm-up trials to drop from each run, unless the run '
+                             'detected its own warm-up trials')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='minimum slowdown, as a fraction of the baseline median, to report')
+    parser.add_argument('--alpha', type=float, default=0.05, help='significance level')
+    args = parser.parse_args()
+
+    store = ResultStore(args.results_db)
+    comparisons = compare_commits(store, args.baseline, args.candidate, args.metric,
+                                  args.ignored_trials, args.threshold, args.alpha)
+    store.close()
+    print(format_report(comparisons, args.baseline, args.candidate))
+    # A non-zero exit status lets the comparison gate upgrades in scripts.
+    sys.exit(1 if any(c.regression for c in comparisons) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,7 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
 
 from sparkperf.commands import *
-from sparkperf.cluster import Cluster
+from sparkperf.cluster import Cluster, standalone_master_ui_url
 from sparkperf.mesos_cluster import MesosCluster
 from sparkperf.testsuites import *
 from sparkperf.build import SparkBuildManager
@@ -25,6 +25,11 @@ parser.add_argument('--config-file', help='override default location of config f
 parser.add_argument('--additional-make-distribution-args',
     help='additional arugments to pass to make-distribution.sh when building Spark', default="")
 
+parser.add_argument('--resume', action='store_true',
+    help='resume an interrupted run: reuse the output of the most recent unfinished run of each '
+    'test suite and skip option combinations which already completed successfully (see '
+    'RESUME_TESTS in the config file)')
+
 args = parser.parse_args()
 assert args.config_file.endswith(".py"), "config filename must end with .py"
 
@@ -39,6 +44,9 @@ print "Loading configuration from %s" % args.config_file
 with open(args.config_file) as cf:
     config = imp.load_source("config", "", cf)
 
+if args.resume:
+    config.RESUME_TESTS = True
+
 # Spark will always be built, assuming that any possible test run
 # of this program is going to depend on Spark.
 run_spark_tests = config.RUN_SPARK_TESTS and (len(config.SPARK_TESTS) > 0)
@@ -72,20 +80,42 @@ if should_prep_spark:
 if os.path.exists(config.SPARK_HOME_DIR) and should_restart_cluster and not config.IS_MESOS_MODE:
     Cluster(spark_home=config.SPARK_HOME_DIR).stop()
 
-spark_build_manager = SparkBuildManager("%s/spark-build-cache" % PROJ_DIR, config.SPARK_GIT_REPO)
+max_spark_build_cache_gb = getattr(config, "MAX_SPARK_BUILD_CACHE_GB", None)
+spark_build_manager = SparkBuildManager(
+    "%s/spark-build-cache" % PROJ_DIR, config.SPARK_GIT_REPO,
+    max_cached_builds=getattr(config, "MAX_CACHED_SPARK_BUILDS", None),
+    max_cache_bytes=max_spark_build_cache_gb and int(max_spark_build_cache_gb * (1 << 30)))
+
+master_ui_url = getattr(config, "SPARK_MASTER_UI_URL", None) or \
+    standalone_master_ui_url(config.SPARK_CLUSTER_URL)
 
 if config.IS_MESOS_MODE:
     cluster = MesosCluster(spark_home=config.SPARK_HOME_DIR, spark_conf_dir=config.SPARK_CONF_DIR,
                            mesos_master=config.SPARK_CLUSTER_URL)
 elif config.USE_CLUSTER_SPARK:
-    cluster = Cluster(spark_home=config.SPARK_HOME_DIR, spark_conf_dir=config.SPARK_CONF_DIR)
+    cluster = Cluster(spark_home=config.SPARK_HOME_DIR, spark_conf_dir=config.SPARK_CONF_DIR,
+                      master_ui_url=master_ui_url)
 else:
+    # Build any other commits that are about to be tested (e.g. when bisecting a regression) at
+    # the same time as this one.
+    prebuild_commit_ids = getattr(config, "SPARK_PREBUILD_COMMIT_IDS", [])
+    prebuilt_shas = []
+    if prebuild_commit_ids:
+        prebuilt_shas = spark_build_manager.build_all(
+            [config.SPARK_COMMIT_ID] + list(prebuild_commit_ids),
+            max_parallel_builds=getattr(config, "MAX_PARALLEL_SPARK_BUILDS", 2),
+            merge_commit_into_master=config.SPARK_MERGE_COMMIT_INTO_MASTER,
+            is_yarn_mode=config.IS_YARN_MODE,
+            additional_make_distribution_args=args.additional_make_distribution_args)
     cluster = spark_build_manager.get_cluster(
         commit_id=config.SPARK_COMMIT_ID,
         conf_dir=config.SPARK_CONF_DIR,
         merge_commit_into_master=config.SPARK_MERGE_COMMIT_INTO_MASTER,
         is_yarn_mode=config.IS_YARN_MODE,
-        additional_make_distribution_args=args.additional_make_distribution_args)
+        additional_make_distribution_args=args.additional_make_distribution_args,
+        master_ui_url=master_ui_url,
+        sha=prebuilt_shas[0] if prebuilt_shas else None,
+        keep=prebuilt_shas)
 
 # rsync Spark to all nodes in case there is a change in Worker config
 if should_restart_cluster and should_rsync_spark_home:
@@ -0,0 +1,200 @@
+"""Embedded SQLite store for the results of Spark performance test runs."""
+
+import json
+import socket
+import sqlite3
+import threading
+import time
+
+from sparkperf.utils import option_hash
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    test_group TEXT NOT NULL,
+    short_name TEXT NOT NULL,
+    commit_sha TEXT,
+    spark_version TEXT,
+    host TEXT,
+    java_opts TEXT NOT NULL,
+    opts TEXT NOT NULL,
+    opt_hash TEXT NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    status TEXT NOT NULL,
+    summary TEXT,
+    warmup_trials INTEGER
+);
+CREATE TABLE IF NOT EXISTS trials (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    trial INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, trial, metric)
+);
+CREATE INDEX IF NOT EXISTS runs_by_test ON runs (short_name, commit_sha, opt_hash);
+CREATE INDEX IF NOT EXISTS runs_by_commit ON runs (commit_sha);
+CREATE INDEX IF NOT EXISTS runs_by_opt_hash ON runs (opt_hash);
+"""
+
+# Columns added to the runs table after it was first created, which databases written by older
+# versions of spark-perf lack.
+ADDED_RUN_COLUMNS = [("warmup_trials", "INTEGER")]
+
+
+def numeric_metrics(result):
+    """
+    :return: the (metric, value) pairs of a trial's result whose values can be stored as numbers,
+             sorted by metric; other values, such as nested breakdowns, are left out.
+
+    >>> numeric_metrics({"time": 1.5, "numExecutors": 4, "stages": [{"time": 1.0}], "ok": None})
+    [('numExecutors', 4), ('time', 1.5)]
+    """
+    return [(metric, value) for metric, value in sorted(result.items())
+            if isinstance(value, (int, long, float)) and not isinstance(value, bool)]
+
+
+class ResultStore(object):
+    """
+    Records every run of a test (one option combination) together with the raw measurements of
+    each of its trials, so that results can be queried across many invocations of spark-perf.
+
+    >>> store = ResultStore(":memory:")
+    >>> run_id = store.record_run("Spark-Tests", "scala-count", ["-Dspark.a=1"], ["--n=2"],
+    ...                           commit_sha="abc123", spark_version="2.0.0", status="ok",
+    ...                           trials=[{"time": 1.5}, {"time": 1.25}])
+    >>> [r["short_name"] for r in store.find_runs(commit_sha="abc123")]
+    [u'scala-count']
+    >>> store.trial_values(run_id, "time")
+    [1.5, 1.25]
+
+    Trials can also be recorded one at a time while a test runs:
+
+    >>> run_id = store.start_run("Spark-Tests", "scala-count", [], ["--n=3"])
+    >>> store.add_trials(run_id, [(0, {"time": 2.0})])
+    >>> store.finish_run(run_id, "failed")
+    >>> store.trial_values(run_id, "time"), store.find_runs(status="failed")[0]["id"] == run_id
+    ([2.0], True)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # Trials are recorded from the threads that wait for concurrently running tests.
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.conn.executescript(SCHEMA)
+        existing_columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(runs)")]
+        with self.conn:
+            for column, column_type in ADDED_RUN_COLUMNS:
+                if column not in existing_columns:
+                    self.conn.execute("ALTER TABLE runs ADD COLUMN %s %s" % (column, column_type))
+
+    def close(self):
+        self.conn.close()
+
+    def record_run(self, test_group, short_name, java_opt_list, opt_list, commit_sha=None,
+                   spark_version=None, status="ok", summary=None, trials=None, started_at=None,
+                   finished_at=None, host=None, warmup_trials=None):
+        """
+        Store the outcome of a single test run.
+
+        :param trials: list of dicts, one per trial, mapping metric names (e.g. "time") to values.
+        :param warmup_trials: the number of leading trials the test itself detected as warm-up
+                              when run with an adaptive number of trials, or None.
+        :return: the id of the new run.
+        """
+        run_id = self.start_run(test_group, short_name, java_opt_list, opt_list, commit_sha,
+                                started_at or finished_at, host)
+        self.finish_run(run_id, status, summary, spark_version, trials, started_at, finished_at,
+                        warmup_trials)
+        return run_id
+
+    def start_run(self, test_group, short_name, java_opt_list, opt_list, commit_sha=None,
+                  started_at=None, host=None):
+        """
+        Store a test run which is starting, with status "running", so that its trials can be
+        recorded as they complete.
+
+        :return: the id of the new run.
+        """
+        started_at = started_at or time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (test_group, short_name, commit_sha, host, java_opts, opts, "
+                "opt_hash, started_at, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (test_group, short_name, commit_sha, host or socket.gethostname(),
+                 json.dumps(list(java_opt_list)), json.dumps(list(opt_list)),
+                 option_hash(short_name, java_opt_list, opt_list), started_at, "running"))
+        return cursor.lastrowid
+
+    def add_trials(self, run_id, trials):
+        """
+        Record trials of a run as they complete.
+
+        :param trials: list of (trial, result) tuples, where trial is the index of the trial and
+                       result is a dict mapping metric names to values.
+
+        The trials of spark.ml pipeline tests report the time of each stage under its own metric:
+
+        >>> store = ResultStore(":memory:")
+        >>> run_id = store.start_run("MLlib-Tests", "pipeline-lr", [], ["--num-trials=1"])
+        >>> store.add_trials(run_id, [(0, {"time": 14.0, "stage0TransformTime": 0.5,
+        ...                                "stage2FitTime": 12.0, "stage2TransformTime": 1.5})])
+        >>> store.trial_values(run_id, "stage2FitTime"), store.trial_values(run_id, "time")
+        ([12.0], [14.0])
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO trials (run_id, trial, metric, value) VALUES (?, ?, ?, ?)",
+                [(run_id, trial, metric, value)
+                 for trial, result in trials
+                 for metric, value in numeric_metrics(result)])
+
+    def finish_run(self, run_id, status, summary=None, spark_version=None, trials=None,
+                   started_at=None, finished_at=None, warmup_trials=None):
+        """
+        Store the outcome of a run created with L{start_run}.
+
+        :param trials: the final list of per-trial dicts reported by the test. If given, it
+                       replaces the trials recorded so far; otherwise the trials recorded while
+                       the test ran are kept, e.g. when it died before reporting its results.
+        """
+        finished_at = finished_at or time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE runs SET spark_version = ?, started_at = COALESCE(?, started_at), "
+                "finished_at = ?, status = ?, summary = ?, warmup_trials = ? WHERE id = ?",
+                (spark_version, started_at, finished_at, status, summary, warmup_trials, run_id))
+            if trials:
+                self.conn.execute("DELETE FROM trials WHERE run_id = ?", (run_id,))
+                self.conn.executemany(
+                    "INSERT INTO trials (run_id, trial, metric, value) VALUES (?, ?, ?, ?)",
+                    [(run_id, i, metric, value)
+                     for i, trial in enumerate(trials)
+                     for metric, value in numeric_metrics(trial)])
+
+    def find_runs(self, short_name=None, commit_sha=None, opt_hash=None, status=None):
+        """
+        :return: the runs matching all of the given criteria, oldest first.
+        """
+        criteria = [("short_name", short_name), ("commit_sha", commit_sha),
+                    ("opt_hash", opt_hash), ("status", status)]
+        criteria = [(column, value) for column, value in criteria if value is not None]
+        query = "SELECT * FROM runs"
+        if criteria:
+            query += " WHERE " + " AND ".join("%s = ?" % column for column, _ in criteria)
+        query += " ORDER BY id"
+        with self.lock:
+            return self.conn.execute(query, [value for _, value in criteria]).fetchall()
+
+    def trial_values(self, run_id, metric="time"):
+        """
+        :return: the values of `metric` for each trial of the given run, in trial order.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT value FROM trials WHERE run_id = ? AND metric = ? ORDER BY trial",
+                (run_id, metric)).fetchall()
+        return [row["value"] for row in rows]
@@ -0,0 +1,201 @@
+"""
+Strategies for choosing which combinations of a test's option values to run.
+
+A test's OptionSets span a grid of option combinations. By default every combination is run
+(L{FullFactorial}). A different strategy can be given as an optional sixth element of the test's
+tuple in the config file, e.g.
+
+    SPARK_TESTS += [("scala-sort-by-key", "spark.perf.TestRunner", SCALE_FACTOR,
+        COMMON_JAVA_OPTS, [ConstantOption("sort-by-key")] + SPARK_KV_OPTS, OneFactorAtATime())]
+
+A combination is a tuple holding one option string (e.g. "--num-partitions=10" or
+"-Dspark.serializer=...") for each JavaOptionSet and OptionSet of the test, in that order.
+Strategies may run several rounds of combinations, choosing each round from the measured median
+times of the previous one.
+"""
+
+import itertools
+from math import ceil
+import random
+
+
+class SweepStrategy(object):
+    """Chooses which option combinations of a test to run."""
+
+    name = None
+
+    def first_round(self, option_arrays):
+        """
+        :param option_arrays: a list holding, for each option set of the test, the list of its
+                              option strings.
+        :return: the list of combinations to run first.
+        """
+        raise NotImplementedError
+
+    def next_round(self, medians):
+        """
+        :param medians: a dict mapping each combination of the previous round to the median of
+                        its primary metric (e.g. its running time), or None if it failed.
+        :return: the list of combinations to run next, or an empty list once the sweep is done.
+        """
+        return []
+
+    def num_skipped(self, option_arrays):
+        """
+        :return: the number of combinations in the full grid of `option_arrays` which the
+                 strategy did not run (to completion), once the sweep is done.
+        """
+        raise NotImplementedError
+
+
+def num_combinations(option_arrays):
+    """
+    >>> num_combinations([["-Da=1", "-Da=2"], ["--b=1", "--b=2", "--b=3"]])
+    6
+    """
+    return reduce(lambda n, values: n * len(values), option_arrays, 1)
+
+
+class FullFactorial(SweepStrategy):
+    """
+    Runs every combination of option values.
+
+    >>> FullFactorial().first_round([["-Da=1", "-Da=2"], ["--b=1", "--b=2"]])
+    [('-Da=1', '--b=1'), ('-Da=1', '--b=2'), ('-Da=2', '--b=1'), ('-Da=2', '--b=2')]
+    """
+
+    name = "full-factorial"
+
+    def first_round(self, option_arrays):
+        return list(itertools.product(*option_arrays))
+
+    def num_skipped(self, option_arrays):
+        return 0
+
+
+class OneFactorAtATime(SweepStrategy):
+    """
+    Varies one option at a time around a baseline combination made of the first value listed for
+    each option, so that the number of runs grows with the sum rather than the product of the
+    numbers of values.
+
+    >>> OneFactorAtATime().first_round([["-Da=1", "-Da=2"], ["--b=1", "--b=2", "--b=3"]])
+    [('-Da=1', '--b=1'), ('-Da=2', '--b=1'), ('-Da=1', '--b=2'), ('-Da=1', '--b=3')]
+    """
+
+    name = "one-factor-at-a-time"
+
+    def first_round(self, option_arrays):
+        baseline = tuple(values[0] for values in option_arrays)
+        combinations = [baseline]
+        for i, values in enumerate(option_arrays):
+            for value in values[1:]:
+                combinations.append(baseline[:i] + (value,) + baseline[i + 1:])
+        self.num_run = len(combinations)
+        return combinations
+
+    def num_skipped(self, option_arrays):
+        return num_combinations(option_arrays) - self.num_run
+
+
+class LatinHypercube(SweepStrategy):
+    """
+    Runs `num_samples` combinations chosen so that the values of every option are spread evenly
+    over the samples (each value of an option with at most `num_samples` values is used), while
+    the pairing of values across options is random.
+
+    >>> arrays = [["-Da=1", "-Da=2"], ["--b=%d" % i for i in range(4)], ["--c=1"]]
+    >>> samples = LatinHypercube(4).first_round(arrays)
+    >>> len(samples), sorted(set(s[1] for s in samples)), sorted(s[0] for s in samples)
+    (4, ['--b=0', '--b=1', '--b=2', '--b=3'], ['-Da=1', '-Da=1', '-Da=2', '-Da=2'])
+    """
+
+    name = "latin-hypercube"
+
+    def __init__(self, num_samples, seed=42):
+        self.num_samples = num_samples
+        self.seed = seed
+
+    def first_round(self, option_arrays):
+        rng = random.Random(self.seed)
+        columns = []
+        for values in option_arrays:
+            column = [values[k * len(values) / self.num_samples] for k in range(self.num_samples)]
+            rng.shuffle(column)
+            columns.append(column)
+        combinations = []
+        for combination in zip(*columns):
+            if combination not in combinations:
+                combinations.append(combination)
+        self.num_run = len(combinations)
+        return combinations
+
+    def num_skipped(self, option_arrays):
+        return num_combinations(option_arrays) - self.num_run
+
+
+class SuccessiveHalving(SweepStrategy):
+    """
+    Runs every combination with only `min_trials` trials, then repeatedly keeps the fastest
+    1 / `eta` of them and reruns those with `eta` times as many trials, up to the num-trials
+    given in the test's options. Combinations which are clearly slower after a few trials are
+    thus dropped without spending the full number of trials on them. `min_trials` must be larger
+    than IGNORED_TRIALS.
+
+    >>> arrays = [["-Da=1", "-Da=2"], ["--b=1", "--b=2"], ["--num-trials=8"]]
+    >>> halving = SuccessiveHalving(min_trials=2, eta=2)
+    >>> first = halving.first_round(arrays)
+    >>> first[0]
+    ('-Da=1', '--b=1', '--num-trials=2')
+    >>> medians = dict(zip(first, [4.0, 1.0, None, 2.0]))
+    >>> second = halving.next_round(medians)
+    >>> second
+    [('-Da=1', '--b=2', '--num-trials=4'), ('-Da=2', '--b=2', '--num-trials=4')]
+    >>> halving.next_round(dict(zip(second, [3.0, 2.5])))
+    [('-Da=2', '--b=2', '--num-trials=8')]
+    >>> halving.next_round({('-Da=2', '--b=2', '--num-trials=8'): 2.5})
+    []
+    >>> halving.num_skipped(arrays)
+    3
+    """
+
+    name = "successive-halving"
+    num_trials_prefix = "--num-trials="
+
+    def __init__(self, min_trials=3, eta=2):
+        assert eta > 1, "eta must be greater than 1"
+        self.min_trials = min_trials
+        self.eta = eta
+
+    def _with_num_trials(self, combination, num_trials):
+        return tuple(self.num_trials_prefix + str(num_trials)
+                     if value.startswith(self.num_trials_prefix) else value
+                     for value in combination)
+
+    def first_round(self, option_arrays):
+        full_trials = [int(value[len(self.num_trials_prefix):])
+                       for values in option_arrays for value in values
+                       if value.startswith(self.num_trials_prefix)]
+        assert full_trials, "SuccessiveHalving requires a num-trials option"
+        self.max_trials = max(full_trials)
+        self.num_trials = min(self.min_trials, self.max_trials)
+        self.last_round = []
+        for combination in itertools.product(*option_arrays):
+            combination = self._with_num_trials(combination, self.num_trials)
+            if combination not in self.last_round:
+                self.last_round.append(combination)
+        return self.last_round
+
+    def next_round(self, medians):
+        if self.num_trials >= self.max_trials:
+            return []
+        ranked = sorted((median, combination) for combination, median in medians.items()
+                        if median is not None)
+        num_kept = max(1, int(ceil(len(ranked) / float(self.eta))))
+        self.num_trials = min(self.num_trials * self.eta, self.max_trials)
+        self.last_round = [self._with_num_trials(combination, self.num_trials)
+                           for _, combination in ranked[:num_kept]]
+        return self.last_round
+
+    def num_skipped(self, option_arrays):
+        return num_combinations(option_arrays) - len(self.last_round)
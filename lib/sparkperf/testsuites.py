@@ -1,18 +1,124 @@
-import itertools
+from collections import deque, namedtuple
+import copy
 import os
-from subprocess import Popen, PIPE
+from subprocess import Popen
 import sys
 import json
+import time
 
 from sparkperf import PROJ_DIR
-from sparkperf.commands import run_cmd, SBT_CMD
-from sparkperf.utils import OUTPUT_DIVIDER_STRING, append_config_to_file, stats_for_results
+from sparkperf.commands import run_cmd, run_cmds_in_pool, wait_for_process, SBT_CMD
+from sparkperf.result_store import ResultStore
+from sparkperf.sweep import FullFactorial, num_combinations
+from sparkperf.trial_stream import TRIALS_FILE_ENV_VAR, TrialStream, format_trial_progress
+from sparkperf.utils import OUTPUT_DIVIDER_STRING, append_config_to_file, find_last_line, \
+    find_unfinished_output, load_completed_combinations, mark_combination_completed, \
+    mark_output_finished, mark_output_started, option_hash, stats_for_results
 
 
 test_env = os.environ.copy()
 
+# A single option combination of a test, along with the files its output is logged to.
+# Test processes append the result of each trial to trials_filename as it completes (see
+# L{sparkperf.trial_stream}).
+TestRun = namedtuple("TestRun", ["short_name", "main_class_or_script", "java_opt_list", "opt_list",
+                                 "combination_hash", "stdout_filename", "stderr_filename",
+                                 "trials_filename"])
+
+# Seconds between checks for newly completed trials of running tests.
+TRIAL_POLL_INTERVAL = 2
+
+
+def num_ignored_trials(config, result_dict):
+    """
+    :return: the number of leading trials to leave out of the summary of a run: the warm-up
+             trials the test detected itself when run with an adaptive number of trials
+             (--max-trials), otherwise IGNORED_TRIALS.
+    """
+    warmup_trials = result_dict.get("warmupTrials")
+    if warmup_trials is None:
+        return config.IGNORED_TRIALS
+    return warmup_trials
+
+
+def input_data_summary(short_name, result_dict):
+    """
+    :return: a line with the seconds a test spent generating its input data and loading it from
+             the input cache, and the rows it generated per second, or "" if it did not report
+             them.
+
+    >>> input_data_summary("count", {"inputData": {"inputGenerationTime": 0.0,
+    ...                                            "inputLoadTime": 12.5}})
+    'count input: 0.0 s generating, 12.5 s loading from cache\\n'
+    >>> input_data_summary("count", {"inputData": {"inputGenerationTime": 40.0}})
+    'count input: 40.0 s generating\\n'
+    >>> input_data_summary("kmeans", {"inputData": {"inputGenerationTime": 8.0,
+    ...                                             "inputRowsPerSecond": 125000.0}})
+    'kmeans input: 8.0 s generating, 125000 rows/s\\n'
+    >>> input_data_summary("count", {})
+    ''
+    """
+    metrics = result_dict.get("inputData") or {}
+    if "inputGenerationTime" not in metrics:
+        return ""
+    summary = "%s input: %.1f s generating" % (short_name, metrics["inputGenerationTime"])
+    if "inputLoadTime" in metrics:
+        summary += ", %.1f s loading from cache" % metrics["inputLoadTime"]
+    if "inputRowsPerSecond" in metrics:
+        summary += ", %.0f rows/s" % metrics["inputRowsPerSecond"]
+    return summary + "\n"
+
+
+def pipeline_stage_summary(short_name, trial_stages):
+    """
+    :param trial_stages: for each trial of a spark.ml pipeline test which is not ignored, the list
+                         of the metrics of its stages, as reported under "pipelineStages" in the
+                         JSON results.
+    :return: a line for each stage of the pipeline with the medians of the seconds its trials
+             spent fitting it, applying it and caching its output, and of the bytes it cached,
+             or "" if the test did not report pipeline stages.
+
+    >>> print pipeline_stage_summary("pipeline", [
+    ...     [{"stage": "VectorAssembler", "transformTime": 0.01, "cacheTime": 4.0,
+    ...       "cachedBytes": 8e8},
+    ...      {"stage": "LogisticRegression", "fitTime": 12.0, "transformTime": 1.5}],
+    ...     [{"stage": "VectorAssembler", "transformTime": 0.03, "cacheTime": 6.0,
+    ...       "cachedBytes": 8e8},
+    ...      {"stage": "LogisticRegression", "fitTime": 10.0, "transformTime": 2.5}]])
+    pipeline stage 1 VectorAssembler: 0.020 s transform, 5.000 s cache (800000000 bytes)
+    pipeline stage 2 LogisticRegression: 11.000 s fit, 2.000 s transform
+    <BLANKLINE>
+    >>> pipeline_stage_summary("kmeans", [])
+    ''
+    """
+    trials = [stages for stages in trial_stages if stages]
+    if not trials:
+        return ""
+    summary = ""
+    for i, stage in enumerate(trials[0]):
+        median = lambda metric: stats_for_results([t[i][metric] for t in trials])[0]
+        parts = ["%.3f s %s" % (median(metric + "Time"), metric)
+                 for metric in ["fit", "transform", "cache"] if metric + "Time" in stage]
+        summary += "%s stage %d %s: %s" % (short_name, i + 1, stage["stage"], ", ".join(parts))
+        if "cachedBytes" in stage:
+            summary += " (%d bytes)" % median("cachedBytes")
+        summary += "\n"
+    return summary
+
+
+def print_missing_results(stdout_filename, num_lines=50):
+    """
+    Report a test which did not produce the expected results line, showing the end of its output.
+    """
+    with open(stdout_filename, "r") as stdout_file:
+        last_lines = deque(stdout_file, num_lines)
+    print("Test did not produce expected results. Last %d lines of output were:" % num_lines)
+    print("".join(last_lines))
+
 
 class PerfTestSuite(object):
+    # Whether collect_trials returns the measurements of each trial of a run.
+    reports_trials = True
 
     @classmethod
     def build(cls):
@@ -29,9 +135,39 @@ class PerfTestSuite(object):
         return True
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
+        """
+        Summarize the results reported by a single run of a test.
+
+        :param stdout_offset: byte offset in `stdout_filename` at which the output of this run
+                              starts; earlier output belongs to previous option combinations.
+        :return: the summary of the run, which contains "FAILED" if the run failed.
+        """
         raise NotImplementedError
 
+    @classmethod
+    def collect_trials(cls, config, stdout_filename, stdout_offset=0):
+        """
+        Parse the raw per-trial measurements reported by a single run of a test.
+
+        :param stdout_offset: byte offset in `stdout_filename` at which the output of this run
+                              starts; earlier output belongs to previous option combinations.
+        :return: a (spark_version, trials, warmup_trials) tuple, where trials is a list of dicts
+                 mapping metric names to values and warmup_trials is the number of warm-up
+                 trials detected by the test, or None. Returns (None, [], None) if the run did
+                 not report any results.
+        """
+        result_json = find_last_line(stdout_filename, "results: ", stdout_offset)
+        if result_json is None:
+            return (None, [], None)
+        try:
+            result_dict = json.loads(result_json)
+        except ValueError:
+            return (None, [], None)
+        return (result_dict.get("sparkVersion"), result_dict.get("results", []),
+                result_dict.get("warmupTrials"))
+
     @classmethod
     def before_run_tests(cls, config, out_file):
         """
@@ -48,67 +184,276 @@ class PerfTestSuite(object):
         Run a set of tests from this performance suite.
 
         :param cluster:  The L{Cluster} to run the tests on.
-        :param tests_to_run:  A list of 5-tuple elements specifying the tests to run.  See the
+        :param tests_to_run:  A list of 5-tuple elements specifying the tests to run, optionally
+                             followed by a L{sparkperf.sweep.SweepStrategy}.  See the
                              'Test Setup' section in config.py.template for more info.
         :param test_group_name:  A short string identifier for this test run.
         :param output_filename:  The output file where we write results.
+
+        If config.RESUME_TESTS is set, the output of the most recent invocation of this suite
+        which was interrupted is reused instead of `output_filename` (which is itself reused if
+        it exists): results are appended to it and option combinations that already completed
+        successfully are skipped.
+
+        If config.CONCURRENT_TEST_SLICES is greater than 1, the cluster is divided into that many
+        slices of config.TOTAL_CLUSTER_CORES / CONCURRENT_TEST_SLICES cores (via spark.cores.max)
+        and that many option combinations are run at the same time, one per slice.
         """
+        resume = getattr(config, "RESUME_TESTS", False)
+        if resume and not os.path.isdir(output_filename + "_logs"):
+            # The output filenames are usually timestamped, so look for the interrupted run.
+            unfinished_output = find_unfinished_output(output_filename, test_group_name)
+            if unfinished_output is None:
+                print("No interrupted run of %s to resume." % test_group_name)
+                resume = False
+            else:
+                output_filename = unfinished_output
         output_dirname = output_filename + "_logs"
-        os.makedirs(output_dirname)
-        out_file = open(output_filename, 'w')
+        if not resume:
+            os.makedirs(output_dirname)
+            mark_output_started(output_dirname, test_group_name)
+        completed_filename = "%s/completed" % output_dirname
+        completed = load_completed_combinations(completed_filename)
+        out_file = open(output_filename, 'a' if resume else 'w')
+        result_store = ResultStore(getattr(config, "RESULTS_DB", "results/sparkperf_results.db"))
         num_tests_to_run = len(tests_to_run)
 
+        num_slices = getattr(config, "CONCURRENT_TEST_SLICES", 1)
+        slice_java_opts = ()
+        if num_slices > 1:
+            assert getattr(config, "TOTAL_CLUSTER_CORES", 0) >= num_slices, \
+                "TOTAL_CLUSTER_CORES must be at least CONCURRENT_TEST_SLICES (%s)" % num_slices
+            slice_cores = config.TOTAL_CLUSTER_CORES / num_slices
+            slice_java_opts = ("-Dspark.cores.max=%d" % slice_cores,)
+
         print(OUTPUT_DIVIDER_STRING)
         print("Running %d tests in %s.\n" % (num_tests_to_run, test_group_name))
+        if resume:
+            print("Resuming in %s; %d option combinations already completed.\n" %
+                  (output_dirname, len(completed)))
         failed_tests = []
-
-        cls.before_run_tests(config, out_file)
-
-        for short_name, main_class_or_script, scale_factor, java_opt_sets, opt_sets in tests_to_run:
+        num_skipped = 0
+
+        if not resume:
+            cls.before_run_tests(config, out_file)
+        if num_slices > 1:
+            out_file.write("# Running %d option combinations concurrently, each on a slice of %d "
+                           "cores\n" % (num_slices, slice_cores))
+            out_file.flush()
+
+        test_runs = []
+
+        def add_test_run(test_index, combination):
+            """
+            Add a TestRun for one option combination of a test, unless it already completed.
+
+            :return: the index of the new TestRun in test_runs, or None if it was skipped.
+            """
+            short_name, main_class_or_script = tests_to_run[test_index][:2]
+            num_java_opt_sets = len(tests_to_run[test_index][3])
+            java_opt_list = combination[:num_java_opt_sets]
+            opt_list = combination[num_java_opt_sets:]
+            combination_hash = option_hash(short_name, java_opt_list, opt_list)
+            if combination_hash in completed:
+                print("Skipping completed combination of %s: %s %s" %
+                      (short_name, " ".join(java_opt_list), " ".join(opt_list)))
+                return None
+            if num_slices > 1:
+                # Concurrent runs must not share their log files.
+                log_prefix = "%s/%s_%s" % (output_dirname, short_name, combination_hash[:8])
+            else:
+                log_prefix = "%s/%s" % (output_dirname, short_name)
+            trials_filename = "%s/%s_%s.trials" % (output_dirname, short_name,
+                                                   combination_hash[:8])
+            test_runs.append(TestRun(short_name, main_class_or_script,
+                                     java_opt_list + slice_java_opts, opt_list,
+                                     combination_hash, log_prefix + ".out",
+                                     log_prefix + ".err", trials_filename))
+            return len(test_runs) - 1
+
+        def measured_median(test_index, combination):
+            """
+            :return: the median time of the latest successful run of an option combination of a
+                     test at this commit, or None if it has none.
+            """
+            short_name = tests_to_run[test_index][0]
+            num_java_opt_sets = len(tests_to_run[test_index][3])
+            runs = result_store.find_runs(
+                short_name=short_name, commit_sha=cluster.commit_sha, status="ok",
+                opt_hash=option_hash(short_name, combination[:num_java_opt_sets] + slice_java_opts,
+                                     combination[num_java_opt_sets:]))
+            if not runs:
+                return None
+            times = (result_store.trial_values(runs[-1]["id"], "time") or
+                     result_store.trial_values(runs[-1]["id"], "trainingTime"))
+            num_ignored = runs[-1]["warmup_trials"]
+            if num_ignored is None:
+                num_ignored = config.IGNORED_TRIALS
+            if len(times) <= num_ignored:
+                return None
+            return stats_for_results(times[num_ignored:])[0]
+
+        # Maps the index of each test run that has been started to its [run id in the result
+        # store, TrialStream, start time].
+        live_runs = {}
+
+        def start_test_run(i):
+            test_run = test_runs[i]
+            run_id = result_store.start_run(test_group_name, test_run.short_name,
+                                            test_run.java_opt_list, test_run.opt_list,
+                                            commit_sha=cluster.commit_sha)
+            live_runs[i] = [run_id, TrialStream(test_run.trials_filename), None]
+
+        def poll_trials(i):
+            """Persist and report the trials test run `i` has completed since the last poll."""
+            live_run = live_runs[i]
+            if live_run[2] is None:
+                live_run[2] = time.time()
+            new_trials = live_run[1].read_new_trials()
+            if new_trials:
+                result_store.add_trials(live_run[0], new_trials)
+            for trial, result in new_trials:
+                # Named like the test's log files, which tells concurrent runs apart.
+                label = os.path.basename(test_runs[i].stdout_filename)[:-len(".out")]
+                print(format_trial_progress(label, trial, result, time.time() - live_run[2]))
+            sys.stdout.flush()
+
+        def finish_test_run(i, stdout_offset, started_at, finished_at):
+            test_run = test_runs[i]
+            run_id = live_runs.pop(i)[0]
+            try:
+                result_string = cls.process_output(config, test_run.short_name,
+                                                   test_run.opt_list, test_run.stdout_filename,
+                                                   test_run.stderr_filename, stdout_offset)
+            except BaseException:
+                # Keep the trials which were recorded before the test failed.
+                result_store.finish_run(run_id, "failed", started_at=started_at,
+                                        finished_at=finished_at)
+                raise
+            spark_version, trials, warmup_trials = cls.collect_trials(
+                config, test_run.stdout_filename, stdout_offset)
+            # A run which reported no trials did not complete, so that resuming reruns it.
+            completed = "FAILED" not in result_string and (trials or not cls.reports_trials)
+            result_store.finish_run(
+                run_id, "ok" if completed else "failed", summary=result_string,
+                spark_version=spark_version, trials=trials, started_at=started_at,
+                finished_at=finished_at, warmup_trials=warmup_trials)
             print(OUTPUT_DIVIDER_STRING)
-            print("Running test command: '%s' ..." % main_class_or_script)
-            stdout_filename = "%s/%s.out" % (output_dirname, short_name)
-            stderr_filename = "%s/%s.err" % (output_dirname, short_name)
-
-            # Run a test for all combinations of the OptionSets given, then capture
-            # and print the output.
-            java_opt_set_arrays = [i.to_array(scale_factor) for i in java_opt_sets]
-            opt_set_arrays = [i.to_array(scale_factor) for i in opt_sets]
-            for java_opt_list in itertools.product(*java_opt_set_arrays):
-                for opt_list in itertools.product(*opt_set_arrays):
-                    cluster.ensure_spark_stopped_on_slaves()
-                    append_config_to_file(stdout_filename, java_opt_list, opt_list)
-                    append_config_to_file(stderr_filename, java_opt_list, opt_list)
-                    java_opts_str = " ".join(java_opt_list)
-                    java_opts_str += " -Dsparkperf.commitSHA=" + cluster.commit_sha
-                    if hasattr(config, 'SPARK_EXECUTOR_URI'):
-                        java_opts_str += " -Dspark.executor.uri=" + config.SPARK_EXECUTOR_URI
-                    if hasattr(config, 'SPARK_MESOS_COARSE') and config.SPARK_MESOS_COARSE:
-                        java_opts_str += " -Dspark.mesos.coarse=true"
-                    cmd = cls.get_spark_submit_cmd(cluster, config, main_class_or_script, opt_list,
-                                                   stdout_filename, stderr_filename)
-                    print("\nSetting env var SPARK_SUBMIT_OPTS: %s" % java_opts_str)
-                    test_env["SPARK_SUBMIT_OPTS"] = java_opts_str
-                    if hasattr(config, 'MESOS_NATIVE_LIBRARY'):
-                        print("\nSetting env var MESOS_NATIVE_LIBRARY: %s" % config.MESOS_NATIVE_LIBRARY)
-                        test_env["MESOS_NATIVE_LIBRARY"] = config.MESOS_NATIVE_LIBRARY
-                    print("Running command: %s\n" % cmd)
-                    Popen(cmd, shell=True, env=test_env).wait()
-                    result_string = cls.process_output(config, short_name, opt_list,
-                                                       stdout_filename, stderr_filename)
-                    print(OUTPUT_DIVIDER_STRING)
-                    print("\nResult: " + result_string)
-                    print(OUTPUT_DIVIDER_STRING)
-                    if "FAILED" in result_string:
-                        failed_tests.append(short_name)
-                    out_file.write(result_string + "\n")
-                    out_file.flush()
-
-            print("\nFinished running %d tests in %s.\nSee summary in %s" %
-                  (num_tests_to_run, test_group_name, output_filename))
-            print("\nNumber of failed tests: %d, failed tests: %s" %
-                  (len(failed_tests), ",".join(failed_tests)))
+            print("\nResult: " + result_string)
             print(OUTPUT_DIVIDER_STRING)
+            if not completed:
+                failed_tests.append(test_run.short_name)
+            out_file.write(result_string + "\n")
+            out_file.flush()
+            if completed:
+                mark_combination_completed(completed_filename, test_run.combination_hash,
+                                           test_run.short_name)
+
+        def run_batch(batch):
+            """Run the test runs with the given indices in test_runs."""
+            if num_slices > 1:
+                cluster.ensure_spark_stopped_on_slaves()
+                prepared = [cls.prepare_test_run(cluster, config, test_runs[i]) for i in batch]
+                commands = [(cmd, env) for cmd, env, _ in prepared]
+                for i in batch:
+                    start_test_run(i)
+                for j, _, started_at, finished_at in run_cmds_in_pool(
+                        commands, num_slices, lambda j: poll_trials(batch[j]),
+                        TRIAL_POLL_INTERVAL):
+                    finish_test_run(batch[j], prepared[j][2], started_at, finished_at)
+            else:
+                for i in batch:
+                    cluster.ensure_spark_stopped_on_slaves()
+                    cmd, env, stdout_offset = cls.prepare_test_run(cluster, config, test_runs[i])
+                    start_test_run(i)
+                    started_at = time.time()
+                    wait_for_process(Popen(cmd, shell=True, env=env), lambda: poll_trials(i),
+                                     TRIAL_POLL_INTERVAL)
+                    finish_test_run(i, stdout_offset, started_at, time.time())
+
+        # Choose the option combinations of each test with its sweep strategy (by default, the
+        # full cross product of its OptionSets). Strategies with several rounds choose the
+        # combinations of each round from the results of the previous one.
+        sweeps = []
+        # Maps the index of each test to the option combinations of its current round.
+        rounds = {}
+        for test_index, test in enumerate(tests_to_run):
+            short_name, main_class_or_script, scale_factor, java_opt_sets, opt_sets = test[:5]
+            strategy = copy.deepcopy(test[5]) if len(test) > 5 else FullFactorial()
+            option_arrays = [i.to_array(scale_factor) for i in list(java_opt_sets) + opt_sets]
+            sweeps.append((test_index, strategy, option_arrays))
+            rounds[test_index] = [tuple(c) for c in strategy.first_round(option_arrays)]
+
+        while any(rounds.values()):
+            batch = []
+            for test_index, _, _ in sweeps:
+                for combination in rounds[test_index]:
+                    i = add_test_run(test_index, combination)
+                    if i is None:
+                        num_skipped += 1
+                    else:
+                        batch.append(i)
+            run_batch(batch)
+            for test_index, strategy, _ in sweeps:
+                if rounds[test_index]:
+                    medians = dict((combination, measured_median(test_index, combination))
+                                   for combination in rounds[test_index])
+                    rounds[test_index] = [tuple(c) for c in strategy.next_round(medians)]
+
+        for test_index, strategy, option_arrays in sweeps:
+            if not isinstance(strategy, FullFactorial):
+                summary = "%s: %s sweep skipped %d of %d option combinations" % (
+                    tests_to_run[test_index][0], strategy.name,
+                    strategy.num_skipped(option_arrays), num_combinations(option_arrays))
+                print(summary)
+                out_file.write("# %s\n" % summary)
+        out_file.flush()
+
+        mark_output_finished(output_dirname)
+        print("\nFinished running %d tests in %s.\nSee summary in %s" %
+              (num_tests_to_run, test_group_name, output_filename))
+        print("\nNumber of failed tests: %d, failed tests: %s" %
+              (len(failed_tests), ",".join(failed_tests)))
+        if num_skipped > 0:
+            print("Number of option combinations skipped as already completed: %d" %
+                  num_skipped)
+        print(OUTPUT_DIVIDER_STRING)
+
+        result_store.close()
+
+    @classmethod
+    def prepare_test_run(cls, cluster, config, test_run):
+        """
+        Log the configuration of a test run and build the command which launches it.
+
+        :return: a (cmd, env, stdout_offset) tuple, where stdout_offset is the byte offset in the
+                 test's stdout file at which the output of this run will start.
+        """
+        print(OUTPUT_DIVIDER_STRING)
+        print("Running test command: '%s' ..." % test_run.main_class_or_script)
+        append_config_to_file(test_run.stdout_filename, test_run.java_opt_list, test_run.opt_list)
+        append_config_to_file(test_run.stderr_filename, test_run.java_opt_list, test_run.opt_list)
+        stdout_offset = os.path.getsize(test_run.stdout_filename)
+        # Start each run with an empty side channel for its per-trial results.
+        open(test_run.trials_filename, "w").close()
+        java_opts_str = " ".join(test_run.java_opt_list)
+        java_opts_str += " -Dsparkperf.commitSHA=" + cluster.commit_sha
+        if hasattr(config, 'SPARK_EXECUTOR_URI'):
+            java_opts_str += " -Dspark.executor.uri=" + config.SPARK_EXECUTOR_URI
+        if hasattr(config, 'SPARK_MESOS_COARSE') and config.SPARK_MESOS_COARSE:
+            java_opts_str += " -Dspark.mesos.coarse=true"
+        cmd = cls.get_spark_submit_cmd(cluster, config, test_run.main_class_or_script,
+                                       test_run.opt_list, test_run.stdout_filename,
+                                       test_run.stderr_filename)
+        env = test_env.copy()
+        print("\nSetting env var SPARK_SUBMIT_OPTS: %s" % java_opts_str)
+        env["SPARK_SUBMIT_OPTS"] = java_opts_str
+        env[TRIALS_FILE_ENV_VAR] = os.path.abspath(test_run.trials_filename)
+        if hasattr(config, 'MESOS_NATIVE_LIBRARY'):
+            print("\nSetting env var MESOS_NATIVE_LIBRARY: %s" % config.MESOS_NATIVE_LIBRARY)
+            env["MESOS_NATIVE_LIBRARY"] = config.MESOS_NATIVE_LIBRARY
+        print("Running command: %s\n" % cmd)
+        return (cmd, env, stdout_offset)
 
     @classmethod
     def get_spark_submit_cmd(cls, cluster, config, main_class_or_script, opt_list, stdout_filename,
@@ -147,40 +492,50 @@ class SparkTests(JVMPerfTestSuite):
         out_file.flush()
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
-        with open(stdout_filename, "r") as stdout_file:
-            output = stdout_file.read()
-        results_token = "results: "
-        if results_token not in output:
-            print("Test did not produce expected results. Output was:")
-            print(output)
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
+        result_json = find_last_line(stdout_filename, "results: ", stdout_offset)
+        if result_json is None:
+            print_missing_results(stdout_filename)
             sys.exit(1)
-        result_line = filter(lambda x: results_token in x, output.split("\n"))[-1]
-        result_json = result_line.replace(results_token, "")
         result_dict = json.loads(result_json)
         times = [r['time'] for r in result_dict['results']]
+        ignored_trials = num_ignored_trials(config, result_dict)
         err_msg = ("Expecting at least %s results "
-                   "but only found %s" % (config.IGNORED_TRIALS + 1, len(times)))
-        assert len(times) > config.IGNORED_TRIALS, err_msg
-        times = times[config.IGNORED_TRIALS:]
+                   "but only found %s" % (ignored_trials + 1, len(times)))
+        assert len(times) > ignored_trials, err_msg
+        times = times[ignored_trials:]
 
         result_string = "%s, %s, " % (short_name, " ".join(opt_list))
         result_string += "%s, %.3f, %s, %s, %s\n" % stats_for_results(times)
 
+        # Key-value tests also report the bytes they shuffled.
+        shuffled = [r["shuffleWriteBytes"] for r in result_dict['results'][ignored_trials:]
+                    if "shuffleWriteBytes" in r]
+        if shuffled:
+            result_string += "%s shuffle: %d bytes written (median)\n" % (
+                short_name, stats_for_results(shuffled)[0])
+        result_string += input_data_summary(short_name, result_dict)
+
         sys.stdout.flush()
         return result_string
 
 
 class StreamingTests(JVMPerfTestSuite):
     test_jar_path = "%s/streaming-tests/target/streaming-perf-tests-assembly.jar" % PROJ_DIR
+    # Streaming tests only report a summary line, not per-trial measurements.
+    reports_trials = False
 
     @classmethod
     def build(cls):
         run_cmd("cd %s/streaming-tests; %s clean assembly" % (PROJ_DIR, SBT_CMD))
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
-        lastlines = Popen("tail -5 %s" % stdout_filename, shell=True, stdout=PIPE).stdout.read()
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
+        with open(stdout_filename, "r") as stdout_file:
+            stdout_file.seek(stdout_offset)
+            lastlines = "".join(deque(stdout_file, 5))
         results_token = "Result: "
         if results_token not in lastlines:
             result = "FAILED"
@@ -190,20 +545,21 @@ class StreamingTests(JVMPerfTestSuite):
         result_string = "%s [ %s ] - %s" % (short_name, " ".join(opt_list), result)
         return str(result_string)
 
+    @classmethod
+    def collect_trials(cls, config, stdout_filename, stdout_offset=0):
+        return (None, [], None)
+
 
 class MLlibTestHelper(object):
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
-        with open(stdout_filename, "r") as stdout_file:
-            output = stdout_file.read()
-        results_token = "results: "
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
+        result_json = find_last_line(stdout_filename, "results: ", stdout_offset)
         result_string = ""
-        if results_token not in output:
+        if result_json is None:
             result_string = "FAILED"
         else:
-            result_line = filter(lambda x: results_token in x, output.split("\n"))[-1]
-            result_json = result_line.replace(results_token, "")
             try:
                 result_dict = json.loads(result_json)
             except:
@@ -211,9 +567,10 @@ class MLlibTestHelper(object):
                 raise
 
             num_results = len(result_dict['results'])
+            ignored_trials = num_ignored_trials(config, result_dict)
             err_msg = ("Expecting at least %s results "
-                       "but only found %s" % (config.IGNORED_TRIALS + 1, num_results))
-            assert num_results > config.IGNORED_TRIALS, err_msg
+                       "but only found %s" % (ignored_trials + 1, num_results))
+            assert num_results > ignored_trials, err_msg
 
             # 2 modes: prediction problems (4 metrics) and others (time only)
             if 'trainingTime' in result_dict['results'][0]:
@@ -222,14 +579,20 @@ class MLlibTestHelper(object):
                 testTimes = [r['testTime'] for r in result_dict['results']]
                 trainingMetrics = [r['trainingMetric'] for r in result_dict['results']]
                 testMetrics = [r['testMetric'] for r in result_dict['results']]
-                trainingTimes = trainingTimes[config.IGNORED_TRIALS:]
-                testTimes = testTimes[config.IGNORED_TRIALS:]
-                trainingMetrics = trainingMetrics[config.IGNORED_TRIALS:]
-                testMetrics = testMetrics[config.IGNORED_TRIALS:]
+                trainingTimes = trainingTimes[ignored_trials:]
+                testTimes = testTimes[ignored_trials:]
+                trainingMetrics = trainingMetrics[ignored_trials:]
+                testMetrics = testMetrics[ignored_trials:]
                 result_string += "Training time: %s, %.3f, %s, %s, %s\n" % \
                                  stats_for_results(trainingTimes)
                 result_string += "Test time: %s, %.3f, %s, %s, %s\n" % \
                                  stats_for_results(testTimes)
+                # PySpark tests also time scoring in NumPy batches.
+                batchedTestTimes = [r['batchedTestTime'] for r in result_dict['results']
+                                    if 'batchedTestTime' in r][ignored_trials:]
+                if batchedTestTimes:
+                    result_string += "Batched test time: %s, %.3f, %s, %s, %s\n" % \
+                                     stats_for_results(batchedTestTimes)
                 result_string += "Training Set Metric: %s, %.3f, %s, %s, %s\n" % \
                                  stats_for_results(trainingMetrics)
                 result_string += "Test Set Metric: %s, %.3f, %s, %s, %s" % \
@@ -237,9 +600,13 @@ class MLlibTestHelper(object):
             else:
                 # non-prediction problem
                 times = [r['time'] for r in result_dict['results']]
-                times = times[config.IGNORED_TRIALS:]
+                times = times[ignored_trials:]
                 result_string += "Time: %s, %.3f, %s, %s, %s\n" % \
                                  stats_for_results(times)
+            summary = input_data_summary(short_name, result_dict) + pipeline_stage_summary(
+                short_name, result_dict.get('pipelineStages', [])[ignored_trials:])
+            if summary:
+                result_string = result_string.rstrip("\n") + "\n" + summary
 
         result_string = "%s, %s\n%s" % (short_name, " ".join(opt_list), result_string)
 
@@ -255,9 +622,10 @@ class MLlibTests(JVMPerfTestSuite, MLlibTestHelper):
         run_cmd("cd %s/mllib-tests; %s -Dspark.version=%s clean assembly" % (PROJ_DIR, SBT_CMD, spark_version))
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
         return MLlibTestHelper.process_output(config, short_name, opt_list,
-                                              stdout_filename, stderr_filename)
+                                              stdout_filename, stderr_filename, stdout_offset)
 
 
 class PythonMLlibTests(PerfTestSuite, MLlibTestHelper):
@@ -273,9 +641,10 @@ class PythonMLlibTests(PerfTestSuite, MLlibTestHelper):
         return cmd
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
         return MLlibTestHelper.process_output(config, short_name, opt_list,
-                                              stdout_filename, stderr_filename)
+                                              stdout_filename, stderr_filename, stdout_offset)
 
 
 class PythonTests(PerfTestSuite):
@@ -290,24 +659,53 @@ class PythonTests(PerfTestSuite):
         return cmd
 
     @classmethod
-    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename):
-        with open(stdout_filename, "r") as stdout_file:
-            output = stdout_file.read()
-        results_token = "results: "
-        if results_token not in output:
-            print("Test did not produce expected results. Output was:")
-            print(output)
+    def process_output(cls, config, short_name, opt_list, stdout_filename, stderr_filename,
+                       stdout_offset=0):
+        result_line = find_last_line(stdout_filename, "results: ", stdout_offset)
+        if result_line is None:
+            print_missing_results(stdout_filename)
             sys.exit(1)
-        result_line = filter(lambda x: results_token in x, output.split("\n"))[-1]
-        result_list = result_line.replace(results_token, "").split(",")
+        result_list = result_line.split(",")
+        result_json = find_last_line(stdout_filename, "jsonResults: ", stdout_offset)
+        result_dict = json.loads(result_json) if result_json is not None else {}
+        if result_json is not None:
+            ignored_trials = num_ignored_trials(config, result_dict)
+        else:
+            ignored_trials = config.IGNORED_TRIALS
         err_msg = ("Expecting at least %s results "
-                   "but only found %s" % (config.IGNORED_TRIALS + 1, len(result_list)))
-        assert len(result_list) > config.IGNORED_TRIALS, err_msg
-        result_list = result_list[config.IGNORED_TRIALS:]
+                   "but only found %s" % (ignored_trials + 1, len(result_list)))
+        assert len(result_list) > ignored_trials, err_msg
+        result_list = result_list[ignored_trials:]
 
         result_string = "%s, %s, " % (short_name, " ".join(opt_list))
 
         result_string += "%s, %.3f, %s, %s, %s\n" % stats_for_results(result_list)
 
+        # Key-value tests also report their throughput and the bytes they shuffled.
+        trial_metrics = (result_dict.get("trialMetrics") or [])[ignored_trials:]
+        rates = [m["recordsPerSecond"] for m in trial_metrics if "recordsPerSecond" in m]
+        if rates:
+            shuffled = [m.get("shuffleWriteBytes", 0) for m in trial_metrics]
+            result_string += "%s throughput: %.0f records/s, %d bytes shuffled (medians)\n" % (
+                short_name, stats_for_results(rates)[0], stats_for_results(shuffled)[0])
+        result_string += input_data_summary(short_name, result_dict)
+
         sys.stdout.flush()
         return result_string
+
+    @classmethod
+    def collect_trials(cls, config, stdout_filename, stdout_offset=0):
+        # The "results: " line of core_tests.py is a plain list of times; the full report is
+        # printed separately as JSON.
+        result_json = find_last_line(stdout_filename, "jsonResults: ", stdout_offset)
+        if result_json is None:
+            return (None, [], None)
+        try:
+            result_dict = json.loads(result_json)
+        except ValueError:
+            return (None, [], None)
+        trials = [{"time": t} for t in result_dict.get("results", [])]
+        # Totals of the stage metrics of each trial, e.g. shuffle bytes and GC time.
+        for trial, metrics in zip(trials, result_dict.get("trialMetrics") or []):
+            trial.update(metrics)
+        return (result_dict.get("sparkVersion"), trials, result_dict.get("warmupTrials"))
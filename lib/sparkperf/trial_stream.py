@@ -0,0 +1,70 @@
+"""
+Incremental reading of the per-trial results that test processes report while they run.
+
+Each test process appends one JSON line, {"trial": <index>, "result": {<metric>: <value>}}, to
+the file named by the TRIALS_FILE_ENV_VAR environment variable as soon as a trial completes
+(see TrialReporter in spark-tests and mllib-tests, and trial_reporter.py in pyspark-tests).
+"""
+
+import json
+import os
+
+TRIALS_FILE_ENV_VAR = "SPARKPERF_TRIALS_FILE"
+
+
+class TrialStream(object):
+    """
+    Follows a trials file, returning only the trials appended since the previous read. A line
+    which has not been completely written yet is kept until the rest of it arrives.
+
+    >>> import tempfile
+    >>> trials_file = tempfile.NamedTemporaryFile()
+    >>> stream = TrialStream(trials_file.name)
+    >>> trials_file.write('{"trial": 0, "result": {"time": 1.5}}\\n{"trial": 1, ')
+    >>> trials_file.flush()
+    >>> stream.read_new_trials()
+    [(0, {u'time': 1.5})]
+    >>> trials_file.write('"result": {"time": 1.25}}\\n')
+    >>> trials_file.flush()
+    >>> stream.read_new_trials()
+    [(1, {u'time': 1.25})]
+    >>> stream.read_new_trials()
+    []
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset = 0
+        self.partial_line = ""
+
+    def read_new_trials(self):
+        """
+        :return: a list of (trial, result) tuples, where result is a dict mapping metric names to
+                 values. Lines which are not valid trial reports are skipped.
+        """
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, "r") as trials_file:
+            trials_file.seek(self.offset)
+            data = trials_file.read()
+        self.offset += len(data)
+        lines = (self.partial_line + data).split("\n")
+        self.partial_line = lines.pop()
+        trials = []
+        for line in lines:
+            try:
+                report = json.loads(line)
+                trials.append((int(report["trial"]), report["result"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+        return trials
+
+
+def format_trial_progress(label, trial, result, elapsed):
+    """
+    >>> format_trial_progress("scala-count", 2, {"time": 1.25, "rate": 80}, 12.34)
+    'scala-count: trial 3 finished after 12.3s (rate=80.000, time=1.250)'
+    """
+    metrics = ", ".join("%s=%.3f" % (metric, value) for metric, value in sorted(result.items())
+                        if isinstance(value, (int, long, float)))
+    return "%s: trial %d finished after %.1fs (%s)" % (label, trial + 1, elapsed, metrics)
@@ -1,3 +1,6 @@
+import hashlib
+import json
+import os
 from math import sqrt
 
 
@@ -9,10 +12,12 @@ def average(in_list):
 
 
 def variance(in_list):
-    variance = 0
-    for x in in_list:
-        variance = variance + (average(in_list) - x) ** 2
-    return variance / len(in_list)
+    """
+    >>> variance([1.0, 2.0, 3.0, 4.0])
+    1.25
+    """
+    mean = average(in_list)
+    return sum((mean - x) ** 2 for x in in_list) / len(in_list)
 
 
 def append_config_to_file(filename, java_opt_list, opt_list):
@@ -27,6 +32,76 @@ def append_config_to_file(filename, java_opt_list, opt_list):
         fout.flush()
 
 
+def load_completed_combinations(filename):
+    """
+    Return the set of option combination hashes recorded as completed in `filename`.
+    """
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, "r") as fin:
+        return set(line.split()[0] for line in fin if line.strip())
+
+
+def mark_combination_completed(filename, combination_hash, short_name):
+    """
+    Record a successfully completed option combination so that resumed runs can skip it.
+    """
+    with open(filename, "a") as fout:
+        fout.write("%s %s\n" % (combination_hash, short_name))
+        fout.flush()
+
+
+def mark_output_started(output_dirname, test_group_name):
+    """
+    Record which test suite writes its logs to `output_dirname`, so that an interrupted run of
+    the suite can be found by L{find_unfinished_output}.
+    """
+    with open(os.path.join(output_dirname, "test_group"), "w") as fout:
+        fout.write(test_group_name + "\n")
+
+
+def mark_output_finished(output_dirname):
+    """
+    Record that the run of a test suite writing its logs to `output_dirname` finished.
+    """
+    open(os.path.join(output_dirname, "finished"), "w").close()
+
+
+def find_unfinished_output(output_filename, test_group_name):
+    """
+    Return the output filename of the most recently started run of a test suite which was
+    interrupted before it finished, among the outputs in the same directory as
+    `output_filename`, or None if there is none.
+
+    >>> import shutil, tempfile
+    >>> results_dir = tempfile.mkdtemp()
+    >>> for name, group in [("a", "Spark-Tests"), ("b", "Spark-Tests"), ("c", "MLlib-Tests")]:
+    ...     os.makedirs(os.path.join(results_dir, name + "_logs"))
+    ...     mark_output_started(os.path.join(results_dir, name + "_logs"), group)
+    >>> mark_output_finished(os.path.join(results_dir, "b_logs"))
+    >>> new_output = os.path.join(results_dir, "d")
+    >>> find_unfinished_output(new_output, "Spark-Tests") == os.path.join(results_dir, "a")
+    True
+    >>> find_unfinished_output(new_output, "PySpark-Tests") is None
+    True
+    >>> shutil.rmtree(results_dir)
+    """
+    results_dir = os.path.dirname(output_filename) or "."
+    candidates = []
+    for name in os.listdir(results_dir):
+        output_dirname = os.path.join(results_dir, name)
+        group_filename = os.path.join(output_dirname, "test_group")
+        if not name.endswith("_logs") or not os.path.isfile(group_filename) or \
+                os.path.exists(os.path.join(output_dirname, "finished")):
+            continue
+        with open(group_filename, "r") as fin:
+            if fin.read().strip() == test_group_name:
+                candidates.append((os.path.getmtime(group_filename), output_dirname))
+    if not candidates:
+        return None
+    return max(candidates)[1][:-len("_logs")]
+
+
 def stats_for_results(result_list):
     assert len(result_list) > 0, "stats_for_results given empty result_list"
     result_first = result_list[0]
@@ -39,3 +114,30 @@ def stats_for_results(result_list):
     result_min = sorted_results[0]
 
     return (result_med, result_std, result_min, result_first, result_last)
+
+
+def option_hash(short_name, java_opt_list, opt_list):
+    """
+    Return a stable identifier for a test name and one combination of its options.
+
+    >>> option_hash("scala-count", ["-Dspark.a=1"], ["--num-trials=10"])
+    'bd2128607fc91977a2ef3353d9ef2f1205d96955'
+    """
+    key = json.dumps([short_name, list(java_opt_list), list(opt_list)])
+    return hashlib.sha1(key).hexdigest()
+
+
+def find_last_line(filename, token, offset=0):
+    """
+    Return the text following `token` on the last line of `filename` containing it, or None.
+    The file is scanned line by line starting at byte `offset`.
+    """
+    result = None
+    with open(filename, "r") as in_file:
+        in_file.seek(offset)
+        for line in in_file:
+            if token in line:
+                result = line
+    if result is None:
+        return None
+    return result[result.index(token) + len(token):].rstrip("\n")
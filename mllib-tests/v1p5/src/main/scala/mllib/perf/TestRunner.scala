@@ -1,6 +1,7 @@
 package mllib.perf
 
 import scala.collection.JavaConverters._
+import scala.collection.mutable.ArrayBuffer
 
 import org.json4s.JsonAST._
 import org.json4s.JsonDSL._
@@ -12,6 +13,7 @@ import mllib.perf.clustering.{GaussianMixtureTest, LDATest, PICTest}
 import mllib.perf.feature.Word2VecTest
 import mllib.perf.fpm.{FPGrowthTest, PrefixSpanTest}
 import mllib.perf.linalg.BlockMatrixMultTest
+import mllib.perf.util.{AdaptiveTrials, TrialReporter}
 
 object TestRunner {
     def main(args: Array[String]) {
@@ -63,13 +65,28 @@ object TestRunner {
       val interTrialWait = test.getWait
 
       var testOptions: JValue = test.getOptions
-      val results: Seq[JValue] = (1 to numTrials).map { i =>
+      val maxTrials = test.getMaxTrials
+      val targetCI = test.getTargetCI
+
+      // With --max-trials, keep running trials until the primary timing of each trial has
+      // converged (see AdaptiveTrials); prediction tests report trainingTime instead of time.
+      val results = new ArrayBuffer[JValue]()
+      val times = new ArrayBuffer[Double]()
+      do {
         test.createInputData(rand.nextLong())
         val res: JValue = test.run()
+        results += res
+        TrialReporter.report(results.length - 1, res)
+        times += ((res \ "trainingTime", res \ "time") match {
+          case (JDouble(t), _) => t
+          case (_, JDouble(t)) => t
+          case _ => 0.0
+        })
         System.gc()
         Thread.sleep(interTrialWait)
-        res
-      }
+      } while (!AdaptiveTrials.isDone(times, numTrials, maxTrials, targetCI))
+      val warmupTrials =
+        if (maxTrials > 0) Some(AdaptiveTrials.numWarmupTrials(times, targetCI)) else None
       // Report the test results as a JSON object describing the test options, Spark
       // configuration, Java system properties, as well as the per-test results.
       // This extra information helps to ensure reproducibility and makes automatic analysis easier.
@@ -79,7 +96,8 @@ object TestRunner {
         ("sparkConf" -> sc.getConf.getAll.toMap) ~
         ("sparkVersion" -> sc.version) ~
         ("systemProperties" -> System.getProperties.asScala.toMap) ~
-        ("results" -> results)
+        ("results" -> results.toList) ~
+        ("warmupTrials" -> warmupTrials)
       println("results: " + compact(render(json)))
 
       sc.stop()
@@ -14,6 +14,10 @@ abstract class PerfTest {
   val INTER_TRIAL_WAIT =    ("inter-trial-wait",   "seconds to sleep between trials")
   val NUM_PARTITIONS =      ("num-partitions", "number of input partitions")
   val RANDOM_SEED =         ("random-seed", "seed for random number generator")
+  val MAX_TRIALS =          ("max-trials",
+    "if > 0, run up to this many trials, stopping once the timings have converged")
+  val TARGET_CI =           ("target-ci",
+    "with max-trials, the target width of the median's confidence interval, in percent")
 
   val log = LoggerFactory.getLogger("PerfTest")
   def logInfo(msg: String) {
@@ -40,6 +44,14 @@ abstract class PerfTest {
     intOptionValue(INTER_TRIAL_WAIT) * 1000
   }
 
+  def getMaxTrials: Int = {
+    intOptionValue(MAX_TRIALS)
+  }
+
+  def getTargetCI: Double = {
+    doubleOptionValue(TARGET_CI)
+  }
+
   def createInputData(seed: Long)
 
   /**
@@ -72,6 +84,11 @@ abstract class PerfTest {
   var optionSet: OptionSet = _
   var testName: String = _
 
+  parser.accepts(MAX_TRIALS._1, MAX_TRIALS._2).withRequiredArg()
+    .ofType(classOf[java.lang.Integer]).defaultsTo(0)
+  parser.accepts(TARGET_CI._1, TARGET_CI._2).withRequiredArg()
+    .ofType(classOf[java.lang.Double]).defaultsTo(5.0)
+
   var intOptions: Seq[(String, String)] = Seq(NUM_TRIALS, INTER_TRIAL_WAIT, NUM_PARTITIONS,
     RANDOM_SEED)
 
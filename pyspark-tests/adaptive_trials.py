@@ -0,0 +1,66 @@
+"""
+Decides how many trials of a test to run from the measured times themselves; this mirrors
+spark.perf.AdaptiveTrials in spark-tests.
+
+Leading trials which are clearly slower than the trials after them (e.g. while Python workers
+are still starting up) are treated as warm-up, and trials are run until the confidence interval
+of the median of the remaining times is narrower than a target percentage of that median.
+"""
+
+import math
+
+# Minimum number of trials after warm-up before convergence is checked.
+MIN_STEADY_TRIALS = 5
+
+
+def median(times):
+    ts = sorted(times)
+    n = len(ts)
+    if n % 2 == 0:
+        return (ts[n / 2 - 1] + ts[n / 2]) / 2.0
+    return ts[n / 2]
+
+
+def numWarmupTrials(times, tolerancePct):
+    """
+    Number of leading trials which are more than `tolerancePct` percent slower than the median of
+    the trials following them. At least MIN_STEADY_TRIALS trials are never counted as warm-up.
+    """
+    warmup = 0
+    while (warmup < len(times) - MIN_STEADY_TRIALS and
+           times[warmup] > median(times[warmup + 1:]) * (1 + tolerancePct / 100.0)):
+        warmup += 1
+    return warmup
+
+
+def medianCIWidthPct(times):
+    """
+    Width of the distribution-free 95% confidence interval of the median (between two order
+    statistics), as a percentage of the median.
+    """
+    ts = sorted(times)
+    n = len(ts)
+    halfWidth = 1.96 * math.sqrt(n) / 2
+    lower = max(0, int(math.floor(n / 2.0 - halfWidth)) - 1)
+    upper = min(n - 1, int(math.ceil(n / 2.0 + 1 + halfWidth)) - 1)
+    m = median(ts)
+    if m == 0:
+        return float("inf")
+    return (ts[upper] - ts[lower]) / m * 100
+
+
+def isDone(times, minTrials, maxTrials, targetCIPct):
+    """
+    Whether enough trials have been run. Without a positive `maxTrials`, exactly `minTrials`
+    trials are run. Otherwise trials continue past `minTrials` until the confidence interval of
+    the median of the post-warm-up times is at most `targetCIPct` percent wide, or `maxTrials`
+    trials have been run.
+    """
+    if maxTrials <= 0:
+        return len(times) >= minTrials
+    if len(times) >= maxTrials:
+        return True
+    if len(times) < minTrials:
+        return False
+    steady = times[numWarmupTrials(times, targetCIPct):]
+    return len(steady) >= MIN_STEADY_TRIALS and medianCIWidthPct(steady) <= targetCIPct
@@ -2,41 +2,232 @@ import time
 import random
 import json
 import sys
+import bisect
+import struct
 
 import pyspark
+from pyspark.rdd import portable_hash
+from pyspark.serializers import (AutoSerializer, CompressedSerializer, MarshalSerializer,
+                                 PickleSerializer)
+from pyspark.sql import functions
+
+from adaptive_trials import isDone, numWarmupTrials
+from input_cache import InputDataCache
+from stage_metrics import StageMetricsCollector, sumStageMetrics
+from trial_reporter import reportTrial
+
+
+# Number of records generated at a time by the "numpy" generation mode.
+GENERATION_CHUNK_SIZE = 1 << 16
+
+
+class KeyDistribution(object):
+    """
+    How the keys of generated key-value data are distributed over 0..uniqueKeys:
+
+    - "uniform": every key is equally likely.
+    - "zipf": key k is drawn with probability proportional to 1 / (k + 1) ** skew.
+    - "power-law": key k has a density proportional to k ** (1 / (1 + skew) - 1), so that the
+      low keys are the most common and skew = 0 is uniform.
+    - "hot-key": key 0 is drawn with probability hotKeyFraction, and otherwise keys are uniform.
+    """
+
+    names = ["uniform", "zipf", "power-law", "hot-key"]
+
+    def __init__(self, name="uniform", skew=1.0, hotKeyFraction=0.5):
+        assert name in self.names, "Unknown key distribution %s" % name
+        self.name = name
+        self.skew = skew
+        self.hotKeyFraction = hotKeyFraction
+
+    def _zipfWeights(self, uniqueKeys):
+        return [1.0 / (k + 1) ** self.skew for k in xrange(uniqueKeys + 1)]
+
+    def sampler(self, uniqueKeys):
+        """Return a function drawing one key from a random.Random."""
+        if self.name == "zipf":
+            cdf, total = [], 0.0
+            for weight in self._zipfWeights(uniqueKeys):
+                total += weight
+                cdf.append(total)
+            cdf = [c / total for c in cdf]
+            return lambda ran: min(bisect.bisect(cdf, ran.random()), uniqueKeys)
+        elif self.name == "power-law":
+            return lambda ran: min(int((uniqueKeys + 1) * ran.random() ** (1 + self.skew)),
+                                   uniqueKeys)
+        elif self.name == "hot-key":
+            return lambda ran: (0 if ran.random() < self.hotKeyFraction
+                                else ran.randint(0, uniqueKeys))
+        else:
+            return lambda ran: ran.randint(0, uniqueKeys)
+
+    def arraySampler(self, uniqueKeys):
+        """Return a function drawing a NumPy array of `size` keys from a RandomState."""
+        import numpy
+        if self.name == "zipf":
+            cdf = numpy.cumsum(1.0 / numpy.arange(1, uniqueKeys + 2) ** self.skew)
+            cdf /= cdf[-1]
+            return lambda rng, size: numpy.minimum(
+                numpy.searchsorted(cdf, rng.random_sample(size), side="right"), uniqueKeys)
+        elif self.name == "power-law":
+            return lambda rng, size: numpy.minimum(
+                ((uniqueKeys + 1) * rng.random_sample(size) ** (1 + self.skew)).astype(int),
+                uniqueKeys)
+        elif self.name == "hot-key":
+            def sample(rng, size):
+                keys = rng.randint(0, uniqueKeys + 1, size)
+                keys[rng.random_sample(size) < self.hotKeyFraction] = 0
+                return keys
+            return sample
+        else:
+            # randint's upper bound is exclusive, unlike random.randint's.
+            return lambda rng, size: rng.randint(0, uniqueKeys + 1, size)
+
+
+def generateIntChunks(index, n, uniqueKeys, uniqueValues, seed, keyDistribution=None,
+                      chunkSize=GENERATION_CHUNK_SIZE):
+    """
+    Generate the keys and values of partition `index` as pairs of NumPy arrays of at most
+    `chunkSize` records each. The output only depends on `seed` and `index`.
+    """
+    import numpy
+    rng = numpy.random.RandomState(hash(str(seed ^ index)) & 0xffffffff)
+    sampleKeys = (keyDistribution or KeyDistribution()).arraySampler(uniqueKeys)
+    for start in xrange(0, n, chunkSize):
+        size = min(chunkSize, n - start)
+        yield sampleKeys(rng, size), rng.randint(0, uniqueValues + 1, size)
+
+
+def formatChunk(numbers, length):
+    """Format a NumPy array of non-negative ints as zero-padded strings, like "%0<length>d"."""
+    import numpy
+    return numpy.char.zfill(numbers.astype(str), length)
+
+
+DEFAULT_STORAGE_LOCATION = "/tmp/spark-perf-kv-data"
+
+# The storage levels of the persistence types which cache the generated data in Spark.
+STORAGE_LEVELS = {
+    "memory": pyspark.StorageLevel.MEMORY_ONLY,
+    # The records are pickled batches either way, but without deserialization the JVM stores each
+    # partition as one buffer rather than an array of batches. PySpark 2 uses this for
+    # MEMORY_ONLY too.
+    "memory-ser": pyspark.StorageLevel(False, True, False, False),
+    "memory-and-disk": pyspark.StorageLevel.MEMORY_AND_DISK,
+    "disk": pyspark.StorageLevel.DISK_ONLY,
+    # Needs spark.memory.offHeap.enabled and spark.memory.offHeap.size.
+    "off-heap": pyspark.StorageLevel.OFF_HEAP,
+}
 
 
 class DataGenerator:
 
-    def generateIntData(self, sc, records, uniqueKeys, uniqueValues, numPartitions, seed):
+    def generateIntData(self, sc, records, uniqueKeys, uniqueValues, numPartitions, seed,
+                        generationMode="python", keyDistribution=None):
+        """
+        Generate `records` random (key, value) int pairs, with keys drawn from `keyDistribution`
+        (uniform by default). In the "python" mode every record is drawn separately from a
+        random.Random; in the "numpy" mode each partition is drawn in chunks of NumPy arrays,
+        which is much faster but produces different records.
+        """
+        n = records / numPartitions
+        if generationMode == "numpy":
+            def gen(index):
+                for keys, values in generateIntChunks(index, n, uniqueKeys, uniqueValues, seed,
+                                                       keyDistribution):
+                    for record in zip(keys.tolist(), values.tolist()):
+                        yield record
+        else:
+            def gen(index):
+                ran = random.Random(hash(str(seed ^ index)))
+                sampleKey = (keyDistribution or KeyDistribution()).sampler(uniqueKeys)
+                for i in xrange(n):
+                    yield sampleKey(ran), ran.randint(0, uniqueValues)
+        return sc.parallelize(xrange(numPartitions), numPartitions).flatMap(gen)
+
+    def generateStringData(self, sc, records, uniqueKeys, uniqueValues, keyLength, valueLength,
+                           numPartitions, seed, keyDistribution=None):
+        """
+        Like generateIntData in the "numpy" mode, but with the keys and values formatted as
+        zero-padded strings a chunk at a time.
+        """
         n = records / numPartitions
         def gen(index):
-            ran = random.Random(hash(str(seed ^ index)))
-            for i in xrange(n):
-                yield ran.randint(0, uniqueKeys), ran.randint(0, uniqueValues)
+            for keys, values in generateIntChunks(index, n, uniqueKeys, uniqueValues, seed,
+                                                   keyDistribution):
+                for record in zip(formatChunk(keys, keyLength).tolist(),
+                                  formatChunk(values, valueLength).tolist()):
+                    yield record
         return sc.parallelize(xrange(numPartitions), numPartitions).flatMap(gen)
 
     def createKVDataSet(self, sc, dataType, records, uniqueKeys, uniqueValues, keyLength,
                         valueLength, numPartitions, seed,
-                        persistenceType):
-        inputRDD = self.generateIntData(sc, records, uniqueKeys, uniqueValues, numPartitions, seed)
-        keyfmt = "%%0%dd" % keyLength
-        valuefmt = "%%0%dd" % valueLength
-        if dataType == "string":
-            inputRDD = inputRDD.map(lambda (k, v): (keyfmt % k, valuefmt % v)) 
-        if persistenceType == "memory":
-            rdd = inputRDD.persist(pyspark.StorageLevel.MEMORY_ONLY)
-        elif persistenceType == "disk":
-            rdd = inputRDD.persist(pyspark.StorageLevel.DISK_ONLY)
-        elif persistenceType == "hdfs":
-            pass
+                        persistenceType, generationMode="python", keyDistribution=None,
+                        storageLocation=DEFAULT_STORAGE_LOCATION, inputCache=None):
+        """
+        Generate a dataset and cache it with one of the STORAGE_LEVELS. With the "hdfs"
+        persistence type, write it once instead to a directory of `storageLocation` (which may be
+        a file:// URL) named after the generation parameters, and read it back from there, so
+        that later runs with the same parameters reuse it and every pass over it scans storage.
+
+        :param inputCache: an InputDataCache to load the dataset from before caching it, if the
+                           persistence type is not "hdfs".
+        """
+        if dataType == "string" and generationMode == "numpy":
+            inputRDD = self.generateStringData(sc, records, uniqueKeys, uniqueValues, keyLength,
+                                               valueLength, numPartitions, seed, keyDistribution)
+        else:
+            inputRDD = self.generateIntData(sc, records, uniqueKeys, uniqueValues, numPartitions,
+                                            seed, generationMode, keyDistribution)
+            keyfmt = "%%0%dd" % keyLength
+            valuefmt = "%%0%dd" % valueLength
+            if dataType == "string":
+                inputRDD = inputRDD.map(lambda (k, v): (keyfmt % k, valuefmt % v))
+        params = [dataType, generationMode, records, uniqueKeys, uniqueValues, keyLength,
+                  valueLength, numPartitions, seed]
+        if keyDistribution is not None and keyDistribution.name != "uniform":
+            params += [keyDistribution.name, keyDistribution.skew, keyDistribution.hotKeyFraction]
+        if persistenceType == "hdfs":
+            path = "%s/python-%s" % (storageLocation.rstrip("/"), "-".join(map(str, params)))
+            if not self.isStored(sc, path):
+                inputRDD.saveAsPickleFile(path)
+            else:
+                print "Using input data already stored in %s" % path
+            return sc.pickleFile(path, numPartitions)
+        if persistenceType not in STORAGE_LEVELS:
+            raise ValueError("Unrecognized persistence option: %s" % persistenceType)
+        if inputCache is not None:
+            inputRDD = inputCache.getOrCreate(["python"] + params, inputRDD, numPartitions)
+        rdd = inputRDD.persist(STORAGE_LEVELS[persistenceType])
         rdd.count()
         return rdd
 
+    def isStored(self, sc, path):
+        """
+        Return whether a dataset was completely written to `path`, deleting anything a failed
+        write left there.
+        """
+        Path = sc._jvm.org.apache.hadoop.fs.Path
+        fileSystem = Path(path).getFileSystem(sc._jsc.hadoopConfiguration())
+        if fileSystem.exists(Path(path + "/_SUCCESS")):
+            return True
+        fileSystem.delete(Path(path), True)
+        return False
+
 
 class PerfTest(object):
     def __init__(self, sc):
         self.sc = sc
+        self.warmupTrials = None
+        # For key-value tests, the number of input records and the number of them hashed to each
+        # reduce partition.
+        self.numRecords = None
+        self.partitionRecordCounts = None
+        # For key-value tests reading their input from storage, the time of one pass over it.
+        self.inputScanTime = None
+        # For each trial, the metrics of each stage it ran and their totals.
+        self.stageMetrics = []
+        self.trialMetrics = []
 
     def initialize(self, options):
         self.options = options
@@ -47,35 +238,176 @@ class PerfTest(object):
     def runTest(self):
         raise NotImplementedError
 
+    def inputMetrics(self):
+        """
+        :return: a dict of metrics of the creation of the input data, e.g. the seconds spent
+                 generating it ("inputGenerationTime") and loading it from a cache
+                 ("inputLoadTime").
+        """
+        return {}
+
+    def trialResults(self, runtime, stages):
+        """
+        :param stages: the metrics of the stages run by the trial, or None if they could not be
+                       collected.
+        :return: a dict of metrics of the trial which just ran in `runtime` seconds, reported
+                 along with its stage metrics.
+        """
+        if self.numRecords:
+            return {"recordsPerSecond": self.numRecords / runtime}
+        return {}
+
     def run(self):
         options = self.options
         rs = []
-        for i in range(options.num_trials):
+        self.collector = StageMetricsCollector(self.sc)
+        while not isDone(rs, options.num_trials, options.max_trials, options.target_ci):
+            self.collector.startTrial(len(rs))
             start = time.time()
             self.runTest()
             rs.append(time.time() - start)
+            stages = self.collector.finishTrial()
+            self.stageMetrics.append(stages)
+            self.trialMetrics.append(sumStageMetrics(stages))
+            self.trialMetrics[-1].update(self.trialResults(rs[-1], stages))
+            result = {"time": rs[-1]}
+            result.update(self.trialMetrics[-1])
+            reportTrial(len(rs) - 1, result)
             time.sleep(options.inter_trial_wait)
+        if options.max_trials > 0:
+            self.warmupTrials = numWarmupTrials(rs, options.target_ci)
         return rs
 
 
+def percentiles(values, ps=(50, 90, 99)):
+    """Return a dict with the nearest-rank percentiles `ps` of `values`, e.g. {"p50": ...}."""
+    if not values:
+        return {}
+    values = sorted(values)
+    return dict(("p%d" % p, values[min(len(values) - 1, int(len(values) * p / 100.0))])
+                for p in ps)
+
+
 class SchedulerThroughputTest(PerfTest):
+    """
+    Runs --num-jobs jobs of --num-tasks empty tasks each, whose closures hold --closure-size
+    random bytes. With --concurrent-jobs > 1 the jobs are submitted from a pool of that many
+    threads, as many small interactive jobs would be.
+
+    Besides the scheduler throughput, each trial reports percentiles of the latency of the jobs
+    and of the delay between the submission of each stage and the launch of each of its tasks.
+    The same jobs are then run again without Python code (counting the serialized records in the
+    JVM), and the extra time per task of the Python jobs is reported as pythonTaskOverheadMs; it
+    is mostly the cost of starting Python workers when spark.python.worker.reuse is false.
+    """
+
+    def createInputData(self):
+        ran = random.Random(self.options.random_seed)
+        self.closureData = "".join(chr(ran.getrandbits(8))
+                                   for i in xrange(self.options.closure_size))
+
+    def runJobs(self, job):
+        """Run `job` --num-jobs times and return the latency of each run."""
+        options = self.options
+        collector = self.collector
+
+        def timeJob(i):
+            collector.tagThread()
+            start = time.time()
+            job()
+            return time.time() - start
+
+        if options.concurrent_jobs > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(options.concurrent_jobs)
+            try:
+                return pool.map(timeJob, xrange(options.num_jobs))
+            finally:
+                pool.close()
+        return [timeJob(i) for i in xrange(options.num_jobs)]
+
     def runTest(self):
-        self.sc.parallelize(xrange(options.num_tasks), options.num_tasks).count()
-      
+        numTasks = self.options.num_tasks
+        closureData = self.closureData
+
+        def emptyTask(iterator):
+            len(closureData)  # Reference the data so that it is serialized with the task.
+            return iterator
+
+        self.jobLatencies = self.runJobs(
+            lambda: self.sc.parallelize(xrange(numTasks), numTasks).mapPartitions(emptyTask)
+                    .count())
+
+    def trialResults(self, runtime, stages):
+        options = self.options
+        numTasks = options.num_jobs * options.num_tasks
+        start = time.time()
+        self.runJobs(lambda: self.sc.parallelize(range(options.num_tasks), options.num_tasks)
+                     ._jrdd.count())
+        jvmRuntime = time.time() - start
+        results = {"tasksPerSecond": numTasks / runtime,
+                   "pythonTaskOverheadMs": (runtime - jvmRuntime) * 1000 / numTasks}
+        for name, value in percentiles([l * 1000 for l in self.jobLatencies]).items():
+            results["jobLatencyMs%s" % name] = value
+        launchDelays = self.collector.taskLaunchDelays(stages or [])
+        for name, value in percentiles(launchDelays).items():
+            results["taskLaunchDelayMs%s" % name] = value
+        return results
+
 
 class KVDataTest(PerfTest):
     def __init__(self, sc, dataType="string"):
         PerfTest.__init__(self, sc)
         self.dataType = dataType
+        self.inputCache = None
+        # Seconds spent creating (generating or loading) and materializing the input data.
+        self.inputTime = 0.0
+
+    def initialize(self, options):
+        PerfTest.initialize(self, options)
+        if options.input_cache:
+            self.inputCache = InputDataCache(self.sc, options.input_cache,
+                                             options.input_cache_max_bytes)
+
+    def inputMetrics(self):
+        if self.inputCache is None:
+            return {"inputGenerationTime": self.inputTime}
+        return {"inputGenerationTime": self.inputCache.generationTime,
+                "inputLoadTime": self.inputTime - self.inputCache.generationTime}
+
+    def createKVDataSet(self, *args, **kwargs):
+        """Create a dataset with DataGenerator.createKVDataSet, adding the time to inputTime."""
+        start = time.time()
+        rdd = DataGenerator().createKVDataSet(*args, inputCache=self.inputCache, **kwargs)
+        self.inputTime += time.time() - start
+        return rdd
 
     def createInputData(self):
         options = self.options
-        self.rdd = DataGenerator().createKVDataSet(
+        self.rdd = self.createKVDataSet(
                 self.sc, self.dataType, options.num_records,
                 options.unique_keys, options.unique_values,
                 options.key_length, options.value_length,
                 options.num_partitions, options.random_seed,
-                options.persistent_type)
+                options.persistent_type, options.generation_mode,
+                KeyDistribution(options.key_distribution, options.skew,
+                                options.hot_key_fraction),
+                options.storage_location)
+        self.numRecords = (options.num_records / options.num_partitions) * options.num_partitions
+        if options.persistent_type == "hdfs":
+            start = time.time()
+            self.rdd.count()
+            self.inputScanTime = time.time() - start
+        self.partitionRecordCounts = self.countRecordsPerPartition()
+
+    def countRecordsPerPartition(self):
+        """
+        Count the records that hash partitioning sends to each of the reduce tasks (as
+        reduceByKey and groupByKey do), which shows how skewed the shuffle is.
+        """
+        numPartitions = self.options.reduce_tasks
+        counts = self.rdd.map(lambda (k, v): portable_hash(k) % numPartitions).countByValue()
+        return [counts.get(i, 0) for i in xrange(numPartitions)]
 
 
 class KVDataTestInt(KVDataTest):
@@ -110,46 +442,304 @@ class CountWithFilter(KVDataTest):
     def runTest(self):
         self.rdd.filter(lambda (k, v): int(v) % 2).count()
 
+
+def mergeJoinPartition(records):
+    """
+    Join the ((key, side), value) records of a partition sorted by (key, side), where side is 0
+    for the left side of the join and 1 for the right side.
+    """
+    currentKey, leftValues = None, []
+    for (k, side), v in records:
+        if k != currentKey:
+            currentKey, leftValues = k, []
+        if side == 0:
+            leftValues.append(v)
+        else:
+            for leftValue in leftValues:
+                yield k, (leftValue, v)
+
+
+class KVJoinTest(KVDataTest):
+    """
+    Joins the generated dataset (the left side) with a second, uniformly distributed one (the
+    right side) of --join-size-ratio times as many records. The right side's keys are drawn from
+    a range 1 / --join-key-overlap times as large as the left side's, so that about that
+    fraction of them have a match.
+    """
+
+    def createInputData(self):
+        KVDataTest.createInputData(self)
+        options = self.options
+        assert 0 < options.join_key_overlap <= 1, "--join-key-overlap must be in (0, 1]"
+        self.right = self.createKVDataSet(
+                self.sc, self.dataType, max(1, int(options.num_records * options.join_size_ratio)),
+                int(options.unique_keys / options.join_key_overlap), options.unique_values,
+                options.key_length, options.value_length,
+                options.num_partitions, options.random_seed + 1,
+                options.persistent_type, options.generation_mode,
+                storageLocation=options.storage_location)
+
+class ShuffleHashJoin(KVJoinTest):
+    def runTest(self):
+        self.rdd.join(self.right, self.options.reduce_tasks).count()
+
+class SortMergeJoin(KVJoinTest):
+    def runTest(self):
+        left = self.rdd.map(lambda (k, v): ((k, 0), v))
+        right = self.right.map(lambda (k, v): ((k, 1), v))
+        left.union(right).repartitionAndSortWithinPartitions(
+            self.options.reduce_tasks, partitionFunc=lambda (k, side): portable_hash(k)) \
+            .mapPartitions(mergeJoinPartition).count()
+
+class BroadcastJoin(KVJoinTest):
+    def runTest(self):
+        table = {}
+        for k, v in self.right.collect():
+            table.setdefault(k, []).append(v)
+        broadcastTable = self.sc.broadcast(table)
+        self.rdd.flatMap(
+            lambda (k, v): [(k, (v, w)) for w in broadcastTable.value.get(k, [])]).count()
+        broadcastTable.unpersist()
+
+class SkewJoin(KVJoinTest):
+    """
+    Joins like ShuffleHashJoin, but splits the keys which hold more than a reduce task's share of
+    the left side (found by sampling) over --join-salts tasks, replicating their right side
+    records to each of them. Meant to be run with a skewed --key-distribution.
+    """
+
+    def runTest(self):
+        numRecords, reduceTasks = self.numRecords, self.options.reduce_tasks
+        numSalts = self.options.join_salts
+        sampleFraction = min(1.0, 100000.0 / numRecords)
+        sampleCounts = self.rdd.sample(False, sampleFraction, 42).keys().countByValue()
+        hotKeys = self.sc.broadcast(set(
+            k for k, count in sampleCounts.items()
+            if count / sampleFraction > float(numRecords) / reduceTasks))
+
+        def saltLeft(index, records):
+            ran = random.Random(index)
+            for k, v in records:
+                salt = ran.randint(0, numSalts - 1) if k in hotKeys.value else 0
+                yield (k, salt), v
+
+        def saltRight((k, v)):
+            salts = xrange(numSalts) if k in hotKeys.value else [0]
+            return [((k, salt), v) for salt in salts]
+
+        self.rdd.mapPartitionsWithIndex(saltLeft).join(
+            self.right.flatMap(saltRight), reduceTasks).count()
+        hotKeys.unpersist()
+
 class BroadcastWithBytes(PerfTest):
+    """
+    Broadcasts --broadcast-size random bytes and reads them in --broadcast-tasks tasks. Values
+    over 1 MB are split into a list of 1 MB strings, as Python 2 cannot pickle strings over 2 GB.
+    The spark.broadcast.blockSize and spark.broadcast.compress Java options set how the value is
+    split into blocks and whether they are compressed.
+
+    Besides the total time, each trial reports serializationTime, the time to pickle the value
+    and store it in the driver's block manager, and firstFetchTime and disseminationTime, the
+    times from the submission of the reading job until the first and the last task had the
+    value. Executors fetch the value before running a task's Python code, so the latter include
+    the launch of the tasks, and compare the clocks of the driver and the executors.
+
+    With --broadcast-mode=closure the value is shipped in the closure of every task instead.
+    PySpark broadcasts closures over 1 MB itself, so that is only meaningful for small values.
+    """
+
     def createInputData(self):
         n = self.options.broadcast_size
         if n > (1 << 20):
             block = open("/dev/urandom").read(1 << 20)
-            self.data = block * (n >> 20)
+            # Copy the block with a different suffix, so that pickle sends every chunk.
+            self.data = [block[:-8] + struct.pack("<q", i) for i in xrange(n >> 20)]
+            if n & ((1 << 20) - 1):
+                self.data.append(block[:n & ((1 << 20) - 1)])
         else:
             self.data = open("/dev/urandom").read(n)
+
     def runTest(self):
-        n = len(self.data)
-        s = self.sc.broadcast(self.data)
-        rdd = self.sc.parallelize(range(self.options.num_partitions), 100)
-        assert rdd.filter(lambda x: len(s.value) == n).count() == self.options.num_partitions
-        s.unpersist()
-   
+        data, n = self.data, len(self.data)
+        numTasks = self.options.broadcast_tasks
+        self.serializationTime = None
+        if self.options.broadcast_mode == "closure":
+            broadcast = None
+            getValue = lambda: data
+        else:
+            start = time.time()
+            broadcast = self.sc.broadcast(data)
+            self.serializationTime = time.time() - start
+            getValue = lambda: broadcast.value
+
+        def readValue(iterator):
+            assert len(getValue()) == n
+            yield time.time()
+
+        start = time.time()
+        readTimes = self.sc.parallelize(range(numTasks), numTasks).mapPartitions(readValue) \
+            .collect()
+        self.firstFetchTime = min(readTimes) - start
+        self.disseminationTime = max(readTimes) - start
+        if broadcast is not None:
+            broadcast.unpersist()
+
+    def trialResults(self, runtime, stages):
+        results = {"firstFetchTime": self.firstFetchTime,
+                   "disseminationTime": self.disseminationTime}
+        if self.serializationTime is not None:
+            results["serializationTime"] = self.serializationTime
+        return results
+
 class BroadcastWithSet(BroadcastWithBytes):
     def createInputData(self):
         n = self.options.broadcast_size / 32
         self.data = set(range(n))
 
 
+def countRows(df):
+    """
+    Count the rows of `df` by running its whole physical plan in the JVM, so that the optimizer
+    cannot drop work which does not change the count (such as a sort).
+    """
+    return df._jdf.queryExecution().toRdd().count()
+
+
+class DataFrameTest(KVDataTest):
+    """
+    Runs on the same generated data as the RDD tests, converted to a DataFrame with "key" and
+    "value" columns, to compare DataFrame operations and Arrow-based pandas UDFs with the
+    pickled RDD path. The pandas UDF tests need pandas and pyarrow on the workers.
+    """
+
+    def createInputData(self):
+        from pyspark.sql import SparkSession
+        from pyspark.sql.types import LongType, StringType, StructField, StructType
+        KVDataTest.createInputData(self)
+        self.spark = SparkSession.builder.getOrCreate()
+        # Shuffle into as many partitions as the RDD tests do.
+        self.spark.conf.set("spark.sql.shuffle.partitions", str(self.options.reduce_tasks))
+        fieldType = StringType() if self.dataType == "string" else LongType()
+        schema = StructType([StructField("key", fieldType), StructField("value", fieldType)])
+        self.df = self.spark.createDataFrame(self.rdd, schema)
+        if self.rdd.is_cached:
+            self.df.persist(self.rdd.getStorageLevel())
+            self.df.count()
+            self.rdd.unpersist()
+
+class DataFrameAggregateByKey(DataFrameTest):
+    def runTest(self):
+        countRows(self.df.groupBy("key").agg(functions.sum(self.df.value.cast("long"))))
+
+class PandasUDFAggregateByKey(DataFrameTest):
+    def createInputData(self):
+        from pyspark.sql.functions import pandas_udf, PandasUDFType
+        DataFrameTest.createInputData(self)
+        self.sumValues = pandas_udf(lambda v: v.astype("int64").sum(), "long",
+                                    PandasUDFType.GROUPED_AGG)
+
+    def runTest(self):
+        countRows(self.df.groupBy("key").agg(self.sumValues(self.df.value)))
+
+class DataFrameSortByKey(DataFrameTest):
+    def runTest(self):
+        countRows(self.df.sort("key"))
+
+class DataFrameCountWithFilter(DataFrameTest):
+    def runTest(self):
+        countRows(self.df.filter(self.df.value.cast("long") % 2 == 1))
+
+class PandasUDFCountWithFilter(DataFrameTest):
+    def createInputData(self):
+        from pyspark.sql.functions import pandas_udf
+        DataFrameTest.createInputData(self)
+        self.isOdd = pandas_udf(lambda v: v.astype("int64") % 2 == 1, "boolean")
+
+    def runTest(self):
+        countRows(self.df.filter(self.isOdd(self.df.value)))
+
+class DataFrameBroadcastJoin(DataFrameTest):
+    """Joins the data with a broadcast table holding an id for each of the unique keys."""
+
+    def createInputData(self):
+        DataFrameTest.createInputData(self)
+        keyfmt = "%%0%dd" % self.options.key_length
+        if self.dataType == "string":
+            keys = self.sc.parallelize(xrange(self.options.unique_keys + 1)).map(
+                lambda k: (keyfmt % k, k))
+        else:
+            keys = self.sc.parallelize(xrange(self.options.unique_keys + 1)).map(
+                lambda k: (k, k))
+        self.keyIds = self.spark.createDataFrame(keys, ["key", "keyId"]).cache()
+        self.keyIds.count()
+
+    def joined(self):
+        return self.df.join(functions.broadcast(self.keyIds), "key")
+
+    def runTest(self):
+        countRows(self.joined())
+
+class PandasUDFBroadcastJoin(DataFrameBroadcastJoin):
+    def createInputData(self):
+        from pyspark.sql.functions import pandas_udf
+        DataFrameBroadcastJoin.createInputData(self)
+        self.addValue = pandas_udf(lambda keyId, value: keyId + value.astype("int64"), "long")
+
+    def runTest(self):
+        joined = self.joined()
+        countRows(joined.select(self.addValue(joined.keyId, joined.value)))
+
+
 all_tests = [
     "AggregateByKey",
     "AggregateByKeyInt",
     "AggregateByKeyNaive",
+    "BroadcastJoin",
     "BroadcastWithBytes",
     "BroadcastWithSet",
     "Count",
     "CountWithFilter",
+    "DataFrameAggregateByKey",
+    "DataFrameBroadcastJoin",
+    "DataFrameCountWithFilter",
+    "DataFrameSortByKey",
+    "PandasUDFAggregateByKey",
+    "PandasUDFBroadcastJoin",
+    "PandasUDFCountWithFilter",
     "SchedulerThroughputTest",
+    "ShuffleHashJoin",
+    "SkewJoin",
     "SortByKey",
     "SortByKeyInt",
+    "SortMergeJoin",
 ]
 
 
+def createSerializer(options):
+    """Return the serializer of RDD records chosen by the --serializer options."""
+    serializer = {"pickle": PickleSerializer, "marshal": MarshalSerializer,
+                  "auto": AutoSerializer}[options.serializer]()
+    if options.compress_serializer:
+        serializer = CompressedSerializer(serializer)
+    return serializer
+
+
 if __name__ == "__main__":
     import optparse
     parser = optparse.OptionParser(usage="Usage: %prog [options] test_names")
     parser.add_option("--num-trials", type="int", default=1)
+    parser.add_option("--max-trials", type="int", default=0,
+                      help="if > 0, run up to this many trials, stopping once the timings "
+                           "have converged")
+    parser.add_option("--target-ci", type="float", default=5.0,
+                      help="with --max-trials, the target width of the median's confidence "
+                           "interval, in percent")
     parser.add_option("--num-tasks", type="int", default=4)
+    parser.add_option("--num-jobs", type="int", default=1)
+    parser.add_option("--closure-size", type="int", default=0,
+                      help="size in bytes of the random data in each task's closure")
+    parser.add_option("--concurrent-jobs", type="int", default=1,
+                      help="number of threads submitting the jobs of SchedulerThroughputTest")
     parser.add_option("--reduce-tasks", type="int", default=4)
     parser.add_option("--num-records", type="int", default=1024)
     parser.add_option("--inter-trial-wait", type="int", default=0)
@@ -158,10 +748,53 @@ if __name__ == "__main__":
     parser.add_option("--unique-values", type="int", default=102400)
     parser.add_option("--value-length", type="int", default=20)
     parser.add_option("--num-partitions", type="int", default=10)
-    parser.add_option("--broadcast-size", type="int", default=1 << 20)
+    parser.add_option("--broadcast-size", type="long", default=1 << 20)
+    parser.add_option("--broadcast-tasks", type="int", default=100,
+                      help="number of tasks reading the value of the broadcast tests")
+    parser.add_option("--broadcast-mode", type="choice", choices=["torrent", "closure"],
+                      default="torrent",
+                      help="whether the broadcast tests broadcast their value or ship it in the "
+                           "closure of each task")
     parser.add_option("--random-seed", type="int", default=1)
-    parser.add_option("--storage-location", type="str", default="/")
-    parser.add_option("--persistent-type", default="memory")
+    parser.add_option("--storage-location", type="str", default=DEFAULT_STORAGE_LOCATION,
+                      help="directory (or file:// URL) of the datasets of the hdfs persistence "
+                           "type")
+    parser.add_option("--input-cache", default="",
+                      help="directory (or file:// URL) caching generated input data across "
+                           "runs, or empty to always generate it")
+    parser.add_option("--input-cache-max-bytes", type="long", default=100 << 30,
+                      help="size above which the least recently used datasets are evicted from "
+                           "the input cache")
+    parser.add_option("--persistent-type", type="choice",
+                      choices=sorted(STORAGE_LEVELS) + ["hdfs"], default="memory")
+    parser.add_option("--generation-mode", type="choice", choices=["python", "numpy"],
+                      default="python",
+                      help="generate the input one record at a time (python) or in NumPy "
+                           "chunks (numpy)")
+    parser.add_option("--key-distribution", type="choice", choices=KeyDistribution.names,
+                      default="uniform")
+    parser.add_option("--skew", type="float", default=1.0,
+                      help="exponent of the zipf and power-law key distributions")
+    parser.add_option("--hot-key-fraction", type="float", default=0.5,
+                      help="fraction of the records with the hot key, for the hot-key "
+                           "distribution")
+    parser.add_option("--join-size-ratio", type="float", default=0.1,
+                      help="for join tests, right side records per left side record")
+    parser.add_option("--join-key-overlap", type="float", default=1.0,
+                      help="for join tests, fraction of the right side's keys which are drawn "
+                           "from the left side's keys")
+    parser.add_option("--join-salts", type="int", default=16,
+                      help="number of tasks each hot key is split over by SkewJoin")
+    parser.add_option("--serializer", type="choice", choices=["pickle", "marshal", "auto"],
+                      default="pickle",
+                      help="serializer of RDD records (auto tries marshal, then pickle)")
+    parser.add_option("--batch-size", type="int", default=0,
+                      help="records per serialized batch: 0 to choose the batch size "
+                           "automatically, 1 to disable batching, -1 for unlimited batches")
+    parser.add_option("--compress-serializer", action="store_true",
+                      help="compress the serialized batches")
+    parser.add_option("--python-worker-reuse", type="choice", choices=["true", "false"],
+                      help="value of spark.python.worker.reuse, if set")
     parser.add_option("--wait-for-exit", action="store_true")
 
     parser.add_option("--list", "-l", action="store_true", help="list all tests")
@@ -177,7 +810,11 @@ if __name__ == "__main__":
     if options.all:
         cases = all_tests
 
-    sc = pyspark.SparkContext(appName="TestRunner")
+    conf = pyspark.SparkConf()
+    if options.python_worker_reuse is not None:
+        conf.set("spark.python.worker.reuse", options.python_worker_reuse)
+    sc = pyspark.SparkContext(appName="TestRunner", conf=conf,
+                              serializer=createSerializer(options), batchSize=options.batch_size)
     for name in cases:
         print 'run test:', name
         test = globals()[name](sc)
@@ -200,6 +837,12 @@ if __name__ == "__main__":
                                   "sparkVersion": sc.version,
                                   "systemProperties": systemProperties,
                                   "results": results,
-                                  "bestResult:": min(results)},
+                                  "bestResult:": min(results),
+                                  "warmupTrials": test.warmupTrials,
+                                  "partitionRecordCounts": test.partitionRecordCounts,
+                                  "inputScanTime": test.inputScanTime,
+                                  "inputData": test.inputMetrics(),
+                                  "trialMetrics": test.trialMetrics,
+                                  "stageMetrics": test.stageMetrics},
                                  separators=(',', ':'))  # use separators for compact encoding
         print "jsonResults: " + jsonResults
@@ -0,0 +1,70 @@
+"""
+A cache of generated input datasets in a directory of a Hadoop file system (a file:// URL on a
+single machine), shared by the runs of the tests. Every option combination runs as a new
+application, so without it each one generates its input again even if only options which do not
+affect the input (such as --reduce-tasks or Java options) changed.
+
+Each dataset is stored as a pickle file (SequenceFiles of pickled batches of records) under a
+hash of the parameters it was generated with. Once the cache holds more than maxBytes, the least
+recently used datasets are evicted. This mirrors spark.perf.InputDataCache of the Scala tests.
+"""
+
+import hashlib
+import time
+
+# Records per pickled batch of the stored datasets.
+BATCH_SIZE = 1024
+
+
+class InputDataCache(object):
+
+    def __init__(self, sc, location, maxBytes):
+        self.sc = sc
+        self.maxBytes = maxBytes
+        self.Path = sc._jvm.org.apache.hadoop.fs.Path
+        self.root = self.Path(location)
+        self.fileSystem = self.root.getFileSystem(sc._jsc.hadoopConfiguration())
+        # Seconds spent generating and storing the datasets which were not cached yet.
+        self.generationTime = 0.0
+
+    def getOrCreate(self, params, rdd, numPartitions):
+        """
+        Return the dataset generated with `params`, read back from the cache. If it is not
+        cached yet, `rdd` is first generated and stored.
+        """
+        key = hashlib.sha1(",".join(map(str, params))).hexdigest()
+        path = self.Path(self.root, key)
+        if self.fileSystem.exists(self.Path(path, "_SUCCESS")):
+            print "Loading input data from %s" % path.toString()
+        else:
+            self.fileSystem.delete(path, True)
+            # Write to a temporary directory first, so that concurrent runs never read partial
+            # data.
+            tmp = self.Path(self.root, "%s.tmp-%s" % (key, self.sc.applicationId))
+            start = time.time()
+            rdd.saveAsPickleFile(tmp.toString(), BATCH_SIZE)
+            self.generationTime += time.time() - start
+            if self.fileSystem.exists(path):
+                # Another run stored the same dataset in the meantime.
+                self.fileSystem.delete(tmp, True)
+            else:
+                self.fileSystem.rename(tmp, path)
+            self.evict(key)
+        # Mark the dataset as recently used.
+        self.fileSystem.setTimes(path, int(time.time() * 1000), -1)
+        return self.sc.pickleFile(path.toString(), numPartitions)
+
+    def evict(self, keep):
+        """Delete the least recently used datasets other than `keep` until maxBytes are cached."""
+        entries = [(status, self.fileSystem.getContentSummary(status.getPath()).getLength())
+                   for status in self.fileSystem.listStatus(self.root)
+                   if status.isDirectory() and ".tmp-" not in status.getPath().getName()]
+        entries.sort(key=lambda (status, size): status.getModificationTime())
+        cachedBytes = sum(size for status, size in entries)
+        for status, size in entries:
+            if cachedBytes <= self.maxBytes:
+                break
+            if status.getPath().getName() != keep:
+                print "Evicting input data from %s" % status.getPath().toString()
+                self.fileSystem.delete(status.getPath(), True)
+                cachedBytes -= size
@@ -5,22 +5,110 @@ Data generation for MLlib spark-perf tests
 
 import numpy
 
-from pyspark.mllib.linalg import Vectors
+from pyspark.mllib.linalg import Matrices, Vectors
 from pyspark.mllib.regression import LabeledPoint
+from pyspark.mllib.util import MLUtils
+
+# Maximum number of values generated at once by the NumPy block generators.
+BLOCK_SIZE = 1 << 20
+
+
+def generatePartitions(sc, numRows, numPartitions, generatePartition):
+    """
+    Parallelize only the partition ids and generate the rows of each partition on the executors.
+
+    :param generatePartition: function (partition index, number of rows) => iterator of rows.
+    :return: RDD with numPartitions partitions of numRows rows in all, split between partitions
+             like sc.parallelize(xrange(numRows), numPartitions) would.
+    """
+    def mapPart(idx, part):
+        n = partitionStart(numRows, numPartitions, idx + 1) - \
+            partitionStart(numRows, numPartitions, idx)
+        return generatePartition(idx, n)
+    return sc.parallelize(range(numPartitions), numPartitions).mapPartitionsWithIndex(mapPart)
+
+
+def partitionStart(numRows, numPartitions, idx):
+    """
+    :return: the index of the first row of partition idx of the RDDs of generatePartitions.
+    """
+    return idx * numRows / numPartitions
+
+
+def blocks(n, valuesPerRow):
+    """
+    :return: the sizes of the blocks n rows are generated in, so that each block has at most
+             BLOCK_SIZE values (or one row).
+    """
+    rowsPerBlock = max(1, BLOCK_SIZE / max(1, valuesPerRow))
+    return [min(rowsPerBlock, n - start) for start in xrange(0, n, rowsPerBlock)]
+
 
 class FeaturesGenerator:
     """
-    Generator for feature vectors for prediction algorithms.
-    TODO: Generalize to categorical features later.
+    Generator for feature vectors for prediction algorithms. The rows of each partition are
+    generated in NumPy blocks from a per-partition seed.
     """
 
+    # The kinds of feature vectors generateData can generate.
+    featureTypes = ["dense", "sparse", "hashed", "categorical"]
+
+    @staticmethod
+    def generateData(sc, numExamples, numFeatures, numPartitions, seed, featureType="dense",
+                     density=0.01):
+        """
+        :param featureType: "dense" for dense vectors of uniform random values, or one of the
+                            sparse types:
+                            "sparse": random values for density * numFeatures random features.
+                            "hashed": counts of density * numFeatures raw feature tokens hashed
+                            into numFeatures buckets (as with HashingTF), like click logs.
+                            "categorical": density * numFeatures categorical fields, one-hot
+                            encoded over numFeatures.
+        :return: RDD[Vector]
+        """
+        assert featureType in FeaturesGenerator.featureTypes, \
+            "FeaturesGenerator.generateData given invalid featureType: %r" % featureType
+        if featureType == "dense":
+            return FeaturesGenerator.generateContinuousData(sc, numExamples, numFeatures,
+                                                            numPartitions, seed)
+        numNonZeros = max(1, int(density * numFeatures))
+        if featureType == "sparse":
+            def genPart(idx, n):
+                rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+                for size in blocks(n, numNonZeros):
+                    indexBlock = rng.randint(numFeatures, size=(size, numNonZeros))
+                    valueBlock = rng.rand(size, numNonZeros)
+                    for rowIndices, rowValues in zip(indexBlock, valueBlock):
+                        indices = numpy.unique(rowIndices)
+                        yield Vectors.sparse(numFeatures, indices, rowValues[:len(indices)])
+        elif featureType == "hashed":
+            from pyspark.mllib.feature import HashingTF
+            hashingTF = HashingTF(numFeatures)
+            def genPart(idx, n):
+                rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+                for size in blocks(n, numNonZeros):
+                    # Raw feature ids are Zipf distributed, like the values of click-log fields.
+                    for rowTokens in rng.zipf(1.5, (size, numNonZeros)):
+                        yield hashingTF.transform(["f%d" % t for t in rowTokens])
+        else:
+            arity = numFeatures / numNonZeros
+            offsets = numpy.arange(numNonZeros) * arity
+            values = numpy.ones(numNonZeros)
+            def genPart(idx, n):
+                rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+                for size in blocks(n, numNonZeros):
+                    for indices in offsets + rng.randint(arity, size=(size, numNonZeros)):
+                        yield Vectors.sparse(numFeatures, indices, values)
+        return generatePartitions(sc, numExamples, numPartitions, genPart)
+
     @staticmethod
     def generateContinuousData(sc, numExamples, numFeatures, numPartitions, seed):
-        def mapPart(idx, part):
+        def genPart(idx, n):
             rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
-            for i in part:
-                yield Vectors.dense(rng.rand(numFeatures))
-        return sc.parallelize(xrange(numExamples), numPartitions).mapPartitionsWithIndex(mapPart)
+            for size in blocks(n, numFeatures):
+                for row in rng.rand(size, numFeatures):
+                    yield Vectors.dense(row)
+        return generatePartitions(sc, numExamples, numPartitions, genPart)
 
 
 class LabeledDataGenerator:
@@ -29,17 +117,20 @@ class LabeledDataGenerator:
     """
 
     @staticmethod
-    def generateGLMData(sc, numExamples, numFeatures, numPartitions, seed, labelType):
+    def generateGLMData(sc, numExamples, numFeatures, numPartitions, seed, labelType,
+                        featureType="dense", density=0.01):
         """
         :param labelType: 0 = unbounded real-valued labels.  2 = binary 0/1 labels
         :param perNegative: Fraction of example to be negative.  Ignore if not using binary labels.
+        :param featureType: see FeaturesGenerator.generateData
         :return: RDD[LabeledPoint]
         """
         assert labelType == 0 or labelType == 2, \
             "LabeledDataGenerator.generateGLMData given invalid labelType: %r" % labelType
         rng = numpy.random.RandomState(hash(str(seed ^ -1)) & 0xffffffff)
         weights = rng.rand(numFeatures)
-        featuresRDD = FeaturesGenerator.generateContinuousData(sc, numExamples, numFeatures, numPartitions, seed)
+        featuresRDD = FeaturesGenerator.generateData(sc, numExamples, numFeatures, numPartitions,
+                                                     seed, featureType, density)
         def makeLP(features):
             label = features.dot(weights)
             if labelType == 2:
@@ -47,6 +138,144 @@ class LabeledDataGenerator:
             return LabeledPoint(label, features)
         return featuresRDD.map(makeLP)
 
+    @staticmethod
+    def generateClassificationData(sc, numExamples, numFeatures, threshold, numPartitions, seed,
+                                   chiSq=False):
+        """
+        :param threshold: fraction of examples with label 0 (the others have label 1).
+        :param chiSq: if True, the features are random integers in [0, 6), independent of the
+                      label, as for chi-squared tests. Otherwise they are Gaussian with the label
+                      as mean.
+        :return: RDD[LabeledPoint]
+        """
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for size in blocks(n, numFeatures):
+                labels = (rng.rand(size) >= threshold).astype(float)
+                if chiSq:
+                    featureBlock = rng.randint(6, size=(size, numFeatures)).astype(float)
+                else:
+                    featureBlock = rng.randn(size, numFeatures) + labels[:, numpy.newaxis]
+                for label, features in zip(labels, featureBlock):
+                    yield LabeledPoint(label, Vectors.dense(features))
+        return generatePartitions(sc, numExamples, numPartitions, genPart)
+
+    @staticmethod
+    def generateDecisionTreeData(sc, numExamples, numFeatures, numPartitions, seed, labelType,
+                                 fracCategorical, fracBinary, treeDepth):
+        """
+        Generate examples labeled by a random balanced decision tree, like
+        DataGenerator.generateDecisionTreeLabeledPoints of the Scala tests.
+
+        :param labelType: 0 = real-valued labels in [0, 1].  k >= 2 = labels in {0, ..., k-1}
+        :param fracCategorical: fraction of the features which are categorical. They come first,
+                                and their values are the indices of their categories.
+        :param fracBinary: fraction of the categorical features which are binary. The others
+                           have 20 categories.
+        :param treeDepth: depth of the tree labeling the examples.
+        :return: (RDD[LabeledPoint], categoricalFeaturesInfo), with categoricalFeaturesInfo
+                 mapping each categorical feature to its number of categories.
+        """
+        assert labelType == 0 or labelType >= 2, \
+            "LabeledDataGenerator.generateDecisionTreeData given invalid labelType: %r" % labelType
+        assert 0 <= fracCategorical <= 1 and 0 <= fracBinary <= 1, \
+            "LabeledDataGenerator.generateDecisionTreeData given invalid fracCategorical = %r" \
+            " or fracBinary = %r" % (fracCategorical, fracBinary)
+        numCategorical = int(numFeatures * fracCategorical)
+        numBinary = int(numCategorical * fracBinary)
+        arities = numpy.array([2] * numBinary + [20] * (numCategorical - numBinary))
+        rng = numpy.random.RandomState(hash(str(seed ^ -1)) & 0xffffffff)
+        featureArity = list(arities) + [0] * (numFeatures - numCategorical)
+        tree = randomBalancedDecisionTree(treeDepth, labelType, featureArity, rng)
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for size in blocks(n, numFeatures):
+                featureBlock = rng.rand(size, numFeatures)
+                featureBlock[:, :numCategorical] = \
+                    numpy.floor(featureBlock[:, :numCategorical] * arities)
+                for label, features in zip(predictDecisionTree(tree, featureBlock), featureBlock):
+                    yield LabeledPoint(label, Vectors.dense(features))
+        categoricalFeaturesInfo = dict(enumerate(arities.tolist()))
+        return generatePartitions(sc, numExamples, numPartitions, genPart), categoricalFeaturesInfo
+
+    @staticmethod
+    def loadLibSVMData(sc, numPartitions, trainingDataPath, testDataPath, testDataFraction, seed):
+        """
+        Load training and test data in LIBSVM format, like DataLoader.loadLibSVMFiles of the
+        Scala tests.
+
+        :param testDataPath: if "", hold out testDataFraction of the training data instead.
+        :return: ([training RDD[LabeledPoint], test RDD[LabeledPoint]], categoricalFeaturesInfo,
+                 numClasses), with numClasses = 0 unless the labels are all integers, which are
+                 then re-indexed to 0, ..., numClasses - 1.
+        """
+        trainingData = MLUtils.loadLibSVMFile(sc, trainingDataPath, -1, numPartitions)
+        if testDataPath == "":
+            rdds = trainingData.randomSplit([1.0 - testDataFraction, testDataFraction], seed)
+        else:
+            numFeatures = trainingData.first().features.size
+            rdds = [trainingData,
+                    MLUtils.loadLibSVMFile(sc, testDataPath, numFeatures, numPartitions)]
+        classes = sorted(set(rdds[0].map(lambda lp: lp.label).distinct().collect() +
+                             rdds[1].map(lambda lp: lp.label).distinct().collect()))
+        if any(label != int(label) for label in classes):
+            return rdds, {}, 0
+        if classes != [0.0, 1.0]:
+            classIndex = dict((label, float(i)) for i, label in enumerate(classes))
+            rdds = [rdd.map(lambda lp: LabeledPoint(classIndex[lp.label], lp.features))
+                    for rdd in rdds]
+        return rdds, {}, len(classes)
+
+
+def randomBalancedDecisionTree(depth, labelType, featureArity, rng):
+    """
+    :param featureArity: the number of categories of each feature, or 0 if it is continuous.
+    :return: a random balanced tree of the given depth, which splits on a distinct feature at
+             each level of every path, and whose sibling leaves have distinct labels for
+             classification. Internal nodes are tuples (feature, threshold, left categories,
+             left child, right child), and leaves are labels.
+    """
+    assert depth <= len(featureArity), \
+        "randomBalancedDecisionTree requires depth <= len(featureArity), but depth = %d and" \
+        " len(featureArity) = %d" % (depth, len(featureArity))
+    def node(depth, usedFeatures):
+        if depth == 0:
+            return 0.0
+        feature = rng.choice([f for f in xrange(len(featureArity)) if f not in usedFeatures])
+        arity = featureArity[feature]
+        if arity == 0:
+            threshold, categories = rng.rand(), None
+        else:
+            threshold, categories = 0.0, rng.permutation(arity)[:rng.randint(1, arity)]
+        if depth == 1:
+            if labelType == 0:
+                left, right = rng.rand(2)
+            else:
+                left, right = map(float, rng.choice(labelType, 2, replace=False))
+        else:
+            left = node(depth - 1, usedFeatures | set([feature]))
+            right = node(depth - 1, usedFeatures | set([feature]))
+        return (feature, threshold, categories, left, right)
+    return node(depth, set())
+
+
+def predictDecisionTree(tree, X):
+    """
+    :param tree: a tree returned by randomBalancedDecisionTree.
+    :return: the labels `tree` predicts for the examples in the rows of matrix X.
+    """
+    if not isinstance(tree, tuple):
+        return numpy.repeat(tree, len(X))
+    feature, threshold, categories, left, right = tree
+    if categories is None:
+        goLeft = X[:, feature] <= threshold
+    else:
+        goLeft = numpy.in1d(X[:, feature], categories)
+    labels = numpy.empty(len(X))
+    labels[goLeft] = predictDecisionTree(left, X[goLeft])
+    labels[~goLeft] = predictDecisionTree(right, X[~goLeft])
+    return labels
+
 
 class RatingGenerator:
     """
@@ -66,11 +295,156 @@ class RatingGenerator:
         assert numRatings / numUsers <= numProducts, \
             "RatingGenerator.generateRatingData given numRatings=%d too large for numUsers=%d, numProducts=%d" \
             % (numRatings, numUsers, numProducts)
-        def mapPart(idx, part):
+        def genPart(idx, n):
             rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
-            for i in part:
-                user = rng.randint(numUsers)
-                prod = rng.randint(numProducts)
-                rating = float(rng.randint(2)) if implicitPrefs else rng.rand() * 5
-                yield (user, prod, rating)
-        return sc.parallelize(xrange(numRatings), numPartitions).mapPartitionsWithIndex(mapPart)
+            for size in blocks(n, 3):
+                users = rng.randint(numUsers, size=size)
+                prods = rng.randint(numProducts, size=size)
+                if implicitPrefs:
+                    ratings = rng.randint(2, size=size).astype(float)
+                else:
+                    ratings = rng.rand(size) * 5
+                for rating in zip(users.tolist(), prods.tolist(), ratings.tolist()):
+                    yield rating
+        return generatePartitions(sc, numRatings, numPartitions, genPart)
+
+
+class ClusteringDataGenerator:
+    """
+    Data generator for clustering problems
+    """
+
+    @staticmethod
+    def generateGMMData(sc, numExamples, numFeatures, numCenters, numPartitions, seed):
+        """
+        :return: RDD[Vector] of points drawn from numCenters random multivariate Gaussians.
+        """
+        rng = numpy.random.RandomState(hash(str(seed ^ -1)) & 0xffffffff)
+        means = rng.randn(numCenters, numFeatures)
+        transforms = rng.randn(numCenters, numFeatures, numFeatures)
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for size in blocks(n, numFeatures * numFeatures):
+                centers = rng.randint(numCenters, size=size)
+                x = rng.randn(size, numFeatures)
+                y = numpy.einsum("rij,rj->ri", transforms[centers], x) + means[centers]
+                for row in y:
+                    yield Vectors.dense(row)
+        return generatePartitions(sc, numExamples, numPartitions, genPart)
+
+    @staticmethod
+    def generateLDAData(sc, numDocuments, numVocab, documentLength, numPartitions, seed):
+        """
+        :return: RDD of [document id, term count Vector] pairs for documents of documentLength
+                 terms drawn uniformly from the vocabulary.
+        """
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            docId = partitionStart(numDocuments, numPartitions, idx)
+            for size in blocks(n, documentLength):
+                for terms in rng.randint(numVocab, size=(size, documentLength)):
+                    indices, counts = numpy.unique(terms, return_counts=True)
+                    yield [docId, Vectors.sparse(numVocab, indices, counts.astype(float))]
+                    docId += 1
+        return generatePartitions(sc, numDocuments, numPartitions, genPart)
+
+    @staticmethod
+    def generatePICData(sc, numPoints, nodeDegree, numPartitions):
+        """
+        :return: RDD of (i, j, similarity) tuples of a periodic banded similarity matrix, which
+                 connects each point to the nodeDegree / 2 points before it.
+        """
+        def genPart(idx, n):
+            start = partitionStart(numPoints, numPartitions, idx)
+            for i in xrange(start, start + n):
+                for j in xrange(i - nodeDegree / 2, i):
+                    yield (i, j % numPoints, 1.0)
+        return generatePartitions(sc, numPoints, numPartitions, genPart)
+
+
+class MatrixGenerator:
+    """
+    Data generator for distributed matrices
+    """
+
+    @staticmethod
+    def generateBlocks(sc, numRows, numCols, blockSize, numPartitions, seed):
+        """
+        :return: RDD of ((block row, block column), Matrix) blocks of a numRows x numCols matrix
+                 of standard normal values, in blockSize x blockSize blocks.
+        """
+        numRowBlocks = (numRows + blockSize - 1) / blockSize
+        numColBlocks = (numCols + blockSize - 1) / blockSize
+        sqrtParts = int(numpy.ceil(numpy.sqrt(numPartitions)))
+        blockIds = sc.parallelize(range(numRowBlocks), sqrtParts).cartesian(
+            sc.parallelize(range(numColBlocks), sqrtParts))
+        def genPart(idx, ids):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for rowBlock, colBlock in ids:
+                m = min(numRows - rowBlock * blockSize, blockSize)
+                n = min(numCols - colBlock * blockSize, blockSize)
+                yield ((rowBlock, colBlock), Matrices.dense(m, n, rng.randn(m * n)))
+        return blockIds.mapPartitionsWithIndex(genPart)
+
+
+class SequenceGenerator:
+    """
+    Data generator for text and frequent pattern mining problems. Item ids are skewed towards
+    numItems, as in the Scala tests.
+    """
+
+    @staticmethod
+    def generateSentences(sc, numSentences, numWords, numPartitions, seed,
+                          avgSentenceLength=16):
+        """
+        :return: RDD of sentences, each a list of words (string ids) which perform a random walk
+                 over the vocabulary, with geometrically distributed lengths.
+        """
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for size in blocks(n, avgSentenceLength):
+                lengths = rng.geometric(1.0 / avgSentenceLength, size) - 1
+                starts = rng.randint(numWords, size=size)
+                for start, length in zip(starts, lengths):
+                    steps = (rng.randn(length) * 10).astype(int)
+                    yield map(str, (start + numpy.cumsum(steps)) % numWords)
+        return generatePartitions(sc, numSentences, numPartitions, genPart)
+
+    @staticmethod
+    def generateBaskets(sc, numBaskets, avgBasketSize, numItems, numPartitions, seed):
+        """
+        :return: RDD of non-empty baskets, each a list of distinct item ids, with sizes following
+                 a binomial distribution B(10 * avgBasketSize, 1/10) before deduplication.
+        """
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for size in blocks(n, avgBasketSize):
+                for basketSize in rng.binomial(10 * avgBasketSize, 0.1, size):
+                    if basketSize > 0:
+                        yield numpy.unique(SequenceGenerator._items(rng, numItems, basketSize)) \
+                            .tolist()
+        return generatePartitions(sc, numBaskets, numPartitions, genPart)
+
+    @staticmethod
+    def generateSequences(sc, numSequences, avgSequenceSize, avgItemsetSize, numItems,
+                          numPartitions, seed):
+        """
+        :return: RDD of non-empty sequences of non-empty itemsets, each a list of distinct item
+                 ids. The number of itemsets of a sequence follows B(10 * avgSequenceSize, 1/10),
+                 and the number of items of an itemset B(10 * avgItemsetSize, 1/10), before
+                 empty itemsets are dropped.
+        """
+        def genPart(idx, n):
+            rng = numpy.random.RandomState(hash(str(seed ^ idx)) & 0xffffffff)
+            for size in blocks(n, avgSequenceSize * avgItemsetSize):
+                for sequenceSize in rng.binomial(10 * avgSequenceSize, 0.1, size):
+                    itemsetSizes = rng.binomial(10 * avgItemsetSize, 0.1, sequenceSize)
+                    sequence = [numpy.unique(SequenceGenerator._items(rng, numItems, s)).tolist()
+                                for s in itemsetSizes if s > 0]
+                    if sequence:
+                        yield sequence
+        return generatePartitions(sc, numSequences, numPartitions, genPart)
+
+    @staticmethod
+    def _items(rng, numItems, n):
+        return (numItems * rng.rand(n) ** 0.1).astype(int)
@@ -3,19 +3,156 @@ import numpy
 import time
 
 import pyspark
+from pyspark.ml import Estimator
+from pyspark.ml.classification import GBTClassifier, RandomForestClassifier
 from pyspark.ml.classification import LogisticRegression as MLLogisticRegression
+from pyspark.ml.feature import StandardScaler as MLStandardScaler
+from pyspark.ml.feature import VectorAssembler
+from pyspark.ml.regression import GBTRegressor, RandomForestRegressor
 from pyspark.ml.regression import LinearRegression as MLLinearRegression
 from pyspark.mllib.classification import *
 from pyspark.mllib.clustering import *
+from pyspark.mllib.feature import Word2Vec
+from pyspark.mllib.fpm import *
+from pyspark.mllib.linalg import Matrices, SparseVector, Vectors
 from pyspark.mllib.regression import *
 from pyspark.mllib.recommendation import *
 from pyspark.mllib.stat import *
+from pyspark.mllib.tree import *
+from pyspark.sql import Column, SQLContext
+from pyspark.sql.types import DoubleType, StructField, StructType
 
+from adaptive_trials import isDone, numWarmupTrials
+from stage_metrics import StageMetricsCollector, sumStageMetrics
+from trial_reporter import reportTrial
 from mllib_data import *
 
+def workersHaveSciPy(sc):
+    """
+    :return: True if SciPy, which featureMatrix needs for sparse vectors, can be imported on the
+             executors.
+    """
+    def canImportSciPy(_):
+        try:
+            import scipy.sparse
+        except ImportError:
+            return False
+        return True
+    return sc.parallelize([0], 1).map(canImportSciPy).first()
+
+
+def featureMatrix(vectors):
+    """
+    :return: a matrix with `vectors` as its rows: a dense NumPy array, or a SciPy CSR matrix if
+             they are sparse (which needs SciPy, see workersHaveSciPy).
+    """
+    if not isinstance(vectors[0], SparseVector):
+        return numpy.array([v.toArray() for v in vectors])
+    import scipy.sparse
+    indptr = numpy.cumsum([0] + [len(v.indices) for v in vectors])
+    return scipy.sparse.csr_matrix((numpy.concatenate([v.values for v in vectors]),
+                                    numpy.concatenate([v.indices for v in vectors]), indptr),
+                                   shape=(len(vectors), vectors[0].size))
+
+
+def batchPredictor(model):
+    """
+    :return: a function predicting the labels of a matrix of examples (one per row) at once,
+             the same way model.predict predicts the label of one example, or None if `model`
+             is not a binary GLM or a NaiveBayesModel.
+    """
+    if isinstance(model, NaiveBayesModel):
+        labels, pi, theta = model.labels, model.pi, model.theta
+        return lambda X: labels[numpy.argmax(pi + X.dot(theta.T), axis=1)]
+    if not isinstance(model, LinearModel):
+        return None
+    weights, intercept = model.weights.toArray(), model.intercept
+    margin = lambda X: X.dot(weights) + intercept
+    if isinstance(model, (LinearRegressionModel, LassoModel, RidgeRegressionModel)):
+        return margin
+    threshold = getattr(model, "threshold", None)
+    if isinstance(model, LogisticRegressionModel) and model.numClasses == 2:
+        # The logistic function, computed without overflowing for large margins.
+        probability = lambda X: 0.5 * (1.0 + numpy.tanh(0.5 * margin(X)))
+        if threshold is None:
+            return probability
+        return lambda X: (probability(X) > threshold).astype(float)
+    if isinstance(model, SVMModel):
+        if threshold is None:
+            return margin
+        return lambda X: (margin(X) > threshold).astype(float)
+    return None
+
+
+def labeledPointDataFrame(rdd, categoricalFeaturesInfo, numClasses):
+    """
+    :return: a DataFrame of the LabeledPoints in `rdd` whose columns carry the ML attributes of
+             the features and label, so that spark.ml treats the features in
+             categoricalFeaturesInfo as categorical and the label as one of numClasses classes
+             (or continuous if numClasses is 0), like DataGenerator.setMetadata of the Scala
+             tests.
+    """
+    sc = rdd.context
+    def toRow(lp):
+        # spark.ml takes pyspark.ml.linalg vectors as of Spark 2.0.
+        features = lp.features.asML() if hasattr(lp.features, "asML") else lp.features
+        return (float(lp.label), features)
+    df = SQLContext.getOrCreate(sc).createDataFrame(rdd.map(toRow), ["label", "features"])
+    numFeatures = rdd.first().features.size
+    featuresAttrs = {"nominal": [{"idx": i, "num_vals": k}
+                                 for i, k in sorted(categoricalFeaturesInfo.items())],
+                     "numeric": [{"idx": i} for i in xrange(numFeatures)
+                                 if i not in categoricalFeaturesInfo]}
+    if numClasses == 0:
+        labelAttr = {"type": "numeric", "name": "label"}
+    else:
+        labelAttr = {"type": "nominal", "name": "label", "num_vals": numClasses}
+    def withMetadata(name, attr):
+        metadata = sc._jvm.org.apache.spark.sql.types.Metadata.fromJson(
+            json.dumps({"ml_attr": attr}))
+        # Column.alias only takes metadata as of PySpark 2.2.
+        return Column(getattr(df._jdf.col(name), "as")(name, metadata))
+    return df.select(withMetadata("features", {"attrs": featuresAttrs, "num_attrs": numFeatures}),
+                     withMetadata("label", labelAttr))
+
+
+def cachedRDDIds(sc):
+    """
+    :return: the set of ids of the RDDs with cached partitions. The RDDs cached by an action are
+             those it adds, which also finds the RDD storing a cached DataFrame.
+    """
+    return set(info.id() for info in sc._jsc.sc().getRDDStorageInfo())
+
+
+def cachedRDDMetrics(sc, rddIds):
+    """
+    :return: a dict with the bytes the cached partitions of the RDDs with ids `rddIds` take in
+             memory and on disk, their number, and the mean memory per cached partition, or an
+             empty dict if none of them is cached.
+    """
+    infos = [info for info in sc._jsc.sc().getRDDStorageInfo() if info.id() in rddIds]
+    if not infos:
+        return {}
+    memSize = sum(info.memSize() for info in infos)
+    numCachedPartitions = sum(info.numCachedPartitions() for info in infos)
+    return {"cachedMemoryBytes": memSize,
+            "cachedDiskBytes": sum(info.diskSize() for info in infos),
+            "cachedPartitions": numCachedPartitions,
+            "memoryBytesPerPartition": memSize / max(1, numCachedPartitions)}
+
+
 class PerfTest:
     def __init__(self, sc):
         self.sc = sc
+        self.warmupTrials = None
+        # For each trial, the metrics of each stage it ran and their totals.
+        self.stageMetrics = []
+        self.trialMetrics = []
+        # The ids of the RDDs caching the input of the test, whose size is reported with each
+        # trial.
+        self.cachedRDDIds = set()
+        # Metrics of the generation of the input.
+        self.inputMetrics = {}
 
     def initialize(self, options):
         self.options = options
@@ -23,6 +160,29 @@ class PerfTest:
     def createInputData(self):
         raise NotImplementedError
 
+    def cacheInput(self, rdd):
+        """
+        Cache and generate the input `rdd` (or DataFrame), reporting the time it takes separately
+        from the trials.
+        """
+        cachedBefore = cachedRDDIds(self.sc)
+        rdd.cache()
+        start = time.time()
+        numRows = rdd.count()
+        generationTime = time.time() - start
+        self.cachedRDDIds = cachedRDDIds(self.sc) - cachedBefore
+        self.inputMetrics = {"inputGenerationTime": generationTime,
+                             "inputRowsPerSecond": numRows / generationTime}
+
+    def trialResults(self, runtime, stages):
+        """
+        :param stages: the metrics of the stages run by the trial, or None if they could not be
+                       collected.
+        :return: a dict of metrics of the trial which just ran in `runtime` seconds, reported
+                 along with its stage metrics.
+        """
+        return {}
+
     def run(self):
         """
         :return: List of [trainingTime, testTime, trainingMetric, testMetric] tuples,
@@ -44,12 +204,26 @@ class NonPredictionTest(PerfTest):
         """
         options = self.options
         results = []
-        for i in range(options.num_trials):
+        times = []
+        collector = StageMetricsCollector(self.sc)
+        while not isDone(times, options.num_trials, options.max_trials, options.target_ci):
+            collector.startTrial(len(times))
             start = time.time()
             self.runTest()
             runtime = time.time() - start
+            stages = collector.finishTrial()
+            self.stageMetrics.append(stages)
+            self.trialMetrics.append(sumStageMetrics(stages))
+            self.trialMetrics[-1].update(cachedRDDMetrics(self.sc, self.cachedRDDIds))
+            self.trialMetrics[-1].update(self.trialResults(runtime, stages))
             results.append([runtime])
+            times.append(runtime)
+            result = {"time": runtime}
+            result.update(self.trialMetrics[-1])
+            reportTrial(len(times) - 1, result)
             time.sleep(options.inter_trial_wait)
+        if options.max_trials > 0:
+            self.warmupTrials = numWarmupTrials(times, options.target_ci)
         return results
 
 
@@ -69,12 +243,27 @@ class PredictionTest(PerfTest):
         """
         raise NotImplementedError
 
+    def evaluateBatched(self, model, rdd):
+        """
+        :return:  The same metric as evaluate, computed by scoring each partition in NumPy at
+                  once, or None if that is not supported for this test's models.
+        """
+        return None
+
     def run(self):
         options = self.options
-        self.trainRDD.cache() # match Scala tests for caching before computing testTime
-        self.trainRDD.count()
+        self.cacheInput(self.trainRDD) # match Scala tests for caching before computing testTime
         results = []
-        for i in range(options.num_trials):
+        trainingTimes = []
+        # Scoring sparse features in batches needs SciPy on the executors, which is optional.
+        scoreBatches = not isinstance(self.trainRDD.first().features, SparseVector) or \
+            workersHaveSciPy(self.sc)
+        if not scoreBatches:
+            print 'SciPy is not installed on the executors; not scoring sparse features in batches'
+        collector = StageMetricsCollector(self.sc)
+        while not isDone(trainingTimes, options.num_trials, options.max_trials,
+                         options.target_ci):
+            collector.startTrial(len(trainingTimes))
             # Train
             start = time.time()
             model = self.train(self.trainRDD)
@@ -85,12 +274,33 @@ class PredictionTest(PerfTest):
             trainingMetric = self.evaluate(model, self.trainRDD)
             print '  done computing trainingMetric'
             testTime = time.time() - start
+            # Measure scoring the training set in NumPy batches too, as an optimized scorer would,
+            # since testTime is dominated by the cost of calling predict once per example.
+            batchedTrainingMetric = None
+            if scoreBatches:
+                start = time.time()
+                batchedTrainingMetric = self.evaluateBatched(model, self.trainRDD)
+                batchedTestTime = time.time() - start
             # Test
             print 'computing testMetric...'
             testMetric = self.evaluate(model, self.testRDD)
             print '  done computing testMetric'
+            stages = collector.finishTrial()
+            self.stageMetrics.append(stages)
+            self.trialMetrics.append(sumStageMetrics(stages))
+            self.trialMetrics[-1].update(cachedRDDMetrics(self.sc, self.cachedRDDIds))
+            if batchedTrainingMetric is not None:
+                self.trialMetrics[-1].update({"batchedTestTime": batchedTestTime,
+                                              "batchedTrainingMetric": batchedTrainingMetric})
             results.append([trainingTime, testTime, trainingMetric, testMetric])
+            trainingTimes.append(trainingTime)
+            result = {"trainingTime": trainingTime, "testTime": testTime,
+                      "trainingMetric": trainingMetric, "testMetric": testMetric}
+            result.update(self.trialMetrics[-1])
+            reportTrial(len(trainingTimes) - 1, result)
             time.sleep(options.inter_trial_wait)
+        if options.max_trials > 0:
+            self.warmupTrials = numWarmupTrials(trainingTimes, options.target_ci)
         return results
 
     @classmethod
@@ -110,6 +320,39 @@ class PredictionTest(PerfTest):
             rdd.map(lambda lp: numpy.square(lp.label - model.predict(lp.features))).mean()
         return numpy.sqrt(squaredError)
 
+    @classmethod
+    def _sumBatchedErrors(cls, model, rdd, error):
+        """
+        :return:  (number of examples, sum of error(labels, predictions) over them) for model on
+                  the given data, scoring a dense matrix of each partition's examples at once.
+        """
+        predict = batchPredictor(model)
+
+        def partitionErrors(lps):
+            lps = list(lps)
+            if lps:
+                X = featureMatrix([lp.features for lp in lps])
+                y = numpy.array([lp.label for lp in lps])
+                yield len(lps), float(numpy.sum(error(y, predict(X))))
+
+        return rdd.mapPartitions(partitionErrors).reduce(lambda a, b: (a[0] + b[0], a[1] + b[1]))
+
+    @classmethod
+    def _evaluateAccuracyBatched(cls, model, rdd):
+        """
+        :return:  0/1 classification accuracy as percentage, like _evaluateAccuracy.
+        """
+        count, correct = cls._sumBatchedErrors(model, rdd, lambda y, p: y == p)
+        return 100.0 * correct / count
+
+    @classmethod
+    def _evaluateRMSEBatched(cls, model, rdd):
+        """
+        :return:  root mean squared error (RMSE), like _evaluateRMSE.
+        """
+        count, squaredError = cls._sumBatchedErrors(model, rdd, lambda y, p: numpy.square(y - p))
+        return numpy.sqrt(squaredError / count)
+
 
 class GLMTest(PredictionTest):
     def __init__(self, sc):
@@ -121,10 +364,12 @@ class GLMTest(PredictionTest):
         numTest = int(options.num_examples * 0.2)
         self.trainRDD = LabeledDataGenerator.generateGLMData(
             self.sc, numTrain, options.num_features,
-            options.num_partitions, options.random_seed, labelType=2)
+            options.num_partitions, options.random_seed, labelType=2,
+            featureType=options.feature_type, density=options.feature_density)
         self.testRDD = LabeledDataGenerator.generateGLMData(
             self.sc, numTest, options.num_features,
-            options.num_partitions, options.random_seed + 1, labelType=2)
+            options.num_partitions, options.random_seed + 1, labelType=2,
+            featureType=options.feature_type, density=options.feature_density)
 
 
 class GLMClassificationTest(GLMTest):
@@ -176,6 +421,11 @@ class GLMClassificationTest(GLMTest):
     def evaluate(self, model, rdd):
         return PredictionTest._evaluateAccuracy(model, rdd)
 
+    def evaluateBatched(self, model, rdd):
+        if batchPredictor(model) is None:
+            return None
+        return PredictionTest._evaluateAccuracyBatched(model, rdd)
+
 
 class GLMRegressionTest(GLMTest):
     def __init__(self, sc):
@@ -212,6 +462,9 @@ class GLMRegressionTest(GLMTest):
     def evaluate(self, model, rdd):
         return PredictionTest._evaluateRMSE(model, rdd)
 
+    def evaluateBatched(self, model, rdd):
+        return PredictionTest._evaluateRMSEBatched(model, rdd)
+
 
 class NaiveBayesTest(PredictionTest):
     def __init__(self, sc):
@@ -223,16 +476,119 @@ class NaiveBayesTest(PredictionTest):
         numTest = int(options.num_examples * 0.2)
         self.trainRDD = LabeledDataGenerator.generateGLMData(
             self.sc, numTrain, options.num_features,
-            options.num_partitions, options.random_seed, labelType=2)
+            options.num_partitions, options.random_seed, labelType=2,
+            featureType=options.feature_type, density=options.feature_density)
         self.testRDD = LabeledDataGenerator.generateGLMData(
             self.sc, numTest, options.num_features,
-            options.num_partitions, options.random_seed + 1, labelType=2)
+            options.num_partitions, options.random_seed + 1, labelType=2,
+            featureType=options.feature_type, density=options.feature_density)
 
     def evaluate(self, model, rdd):
         return PredictionTest._evaluateAccuracy(model, rdd)
 
+    def evaluateBatched(self, model, rdd):
+        return PredictionTest._evaluateAccuracyBatched(model, rdd)
+
     def train(self, rdd):
-        return NaiveBayes.train(rdd, lambda_=options.nb_lambda)
+        return NaiveBayes.train(rdd, lambda_=self.options.nb_lambda)
+
+
+class DecisionTreeTest(PredictionTest):
+    supportedEnsembleTypes = ["RandomForest", "GradientBoostedTrees",
+                              "ml.RandomForest", "ml.GradientBoostedTrees"]
+
+    def __init__(self, sc):
+        PredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        if options.training_data != "":
+            print "LOADING FILE: %s" % options.training_data
+            assert 0 <= options.test_data_fraction <= 1, \
+                "Bad test_data_fraction: %r" % options.test_data_fraction
+            rdds, self.categoricalFeaturesInfo, self.labelType = \
+                LabeledDataGenerator.loadLibSVMData(
+                    self.sc, options.num_partitions, options.training_data, options.test_data,
+                    options.test_data_fraction, options.random_seed)
+        else:
+            # Hold out a fifth of the generated examples for testing, like the Scala tests.
+            rdd, self.categoricalFeaturesInfo = LabeledDataGenerator.generateDecisionTreeData(
+                self.sc, int(numpy.ceil(options.num_examples * 1.25)), options.num_features,
+                options.num_partitions, options.random_seed, options.label_type,
+                options.frac_categorical_features, options.frac_binary_features,
+                options.tree_depth)
+            rdds = rdd.randomSplit([0.8, 0.2], options.random_seed)
+            self.labelType = options.label_type
+        self.trainRDD, self.testRDD = rdds
+        if options.ensemble_type.startswith("ml."):
+            # Build and cache the DataFrames once, so that the trials do not include the time
+            # for converting the data to them.
+            self.dataFrames = {}
+            for rdd in rdds:
+                df = labeledPointDataFrame(rdd, self.categoricalFeaturesInfo, self.labelType)
+                df.cache().count()
+                self.dataFrames[rdd.id()] = df
+
+    def train(self, rdd):
+        """
+        :return:  Trained model to be passed to test.
+        """
+        options = self.options
+        if options.ensemble_type not in self.supportedEnsembleTypes:
+            raise Exception("DecisionTreeTest given unknown ensemble_type: %s. Supported values:"
+                            " %s" % (options.ensemble_type, " ".join(self.supportedEnsembleTypes)))
+        if self.labelType != 0 and self.labelType < 2:
+            raise Exception("DecisionTreeTest given bad label_type: %d" % self.labelType)
+        isRegression = self.labelType == 0
+        if options.ensemble_type == "RandomForest":
+            if isRegression:
+                return RandomForest.trainRegressor(
+                    rdd, self.categoricalFeaturesInfo, options.num_trees,
+                    options.feature_subset_strategy, "variance", options.tree_depth,
+                    options.max_bins, options.random_seed)
+            return RandomForest.trainClassifier(
+                rdd, self.labelType, self.categoricalFeaturesInfo, options.num_trees,
+                options.feature_subset_strategy, "gini", options.tree_depth, options.max_bins,
+                options.random_seed)
+        elif options.ensemble_type == "GradientBoostedTrees":
+            if isRegression:
+                return GradientBoostedTrees.trainRegressor(
+                    rdd, self.categoricalFeaturesInfo, loss="leastSquaresError",
+                    numIterations=options.num_trees, learningRate=0.1,
+                    maxDepth=options.tree_depth, maxBins=options.max_bins)
+            return GradientBoostedTrees.trainClassifier(
+                rdd, self.categoricalFeaturesInfo, loss="logLoss",
+                numIterations=options.num_trees, learningRate=0.1, maxDepth=options.tree_depth,
+                maxBins=options.max_bins)
+        df = self.dataFrames[rdd.id()]
+        if options.ensemble_type == "ml.RandomForest":
+            estimator = (RandomForestRegressor if isRegression else RandomForestClassifier)(
+                impurity="variance" if isRegression else "gini", maxDepth=options.tree_depth,
+                maxBins=options.max_bins, numTrees=options.num_trees,
+                featureSubsetStrategy=options.feature_subset_strategy, seed=options.random_seed)
+        else:
+            estimator = (GBTRegressor if isRegression else GBTClassifier)(
+                lossType="squared" if isRegression else "logistic", maxBins=options.max_bins,
+                maxDepth=options.tree_depth, maxIter=options.num_trees, stepSize=0.1,
+                seed=options.random_seed)
+        return estimator.fit(df)
+
+    def evaluate(self, model, rdd):
+        """
+        :return:  RMSE for regression, or accuracy as percentage for classification.
+        """
+        if self.options.ensemble_type.startswith("ml."):
+            predictionsAndLabels = model.transform(self.dataFrames[rdd.id()]) \
+                .select("prediction", "label").rdd.map(tuple)
+        else:
+            # The pyspark.mllib.tree models predict on the JVM, so they cannot be called from
+            # within a Python closure like the GLMs.
+            predictionsAndLabels = model.predict(rdd.map(lambda lp: lp.features)) \
+                .zip(rdd.map(lambda lp: lp.label))
+        if self.labelType == 0:
+            return numpy.sqrt(predictionsAndLabels.map(lambda pl: numpy.square(pl[0] - pl[1]))
+                              .mean())
+        return 100.0 * predictionsAndLabels.map(lambda pl: 1.0 if pl[0] == pl[1] else 0.0).mean()
 
 
 class KMeansTest(NonPredictionTest):
@@ -241,13 +597,66 @@ class KMeansTest(NonPredictionTest):
 
     def createInputData(self):
         options = self.options
-        self.data = FeaturesGenerator.generateContinuousData(
+        self.data = FeaturesGenerator.generateData(
             self.sc, options.num_examples, options.num_features,
+            options.num_partitions, options.random_seed,
+            options.feature_type, options.feature_density)
+        # Cache the input like the prediction tests, so that its size can be reported.
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        model = KMeans.train(self.data, k=self.options.num_centers,
+                             maxIterations=self.options.num_iterations)
+
+
+class GaussianMixtureTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = ClusteringDataGenerator.generateGMMData(
+            self.sc, options.num_examples, options.num_features, options.num_centers,
             options.num_partitions, options.random_seed)
+        self.cacheInput(self.data)
 
     def runTest(self):
-        model = KMeans.train(self.data, k=options.num_centers,
-                             maxIterations=options.num_iterations)
+        model = GaussianMixture.train(self.data, k=self.options.num_centers,
+                                      maxIterations=self.options.num_iterations)
+
+
+class LDATest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = ClusteringDataGenerator.generateLDAData(
+            self.sc, options.num_documents, options.num_vocab, options.document_length,
+            options.num_partitions, options.random_seed)
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        options = self.options
+        if options.optimizer not in ["em", "online"]:
+            raise Exception("LDATest does not recognize optimizer: %s" % options.optimizer)
+        model = LDA.train(self.data, k=options.num_topics, maxIterations=options.num_iterations,
+                          optimizer=options.optimizer)
+
+
+class PowerIterationClusteringTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = ClusteringDataGenerator.generatePICData(
+            self.sc, options.num_examples, options.node_degree, options.num_partitions)
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        model = PowerIterationClustering.train(self.data, k=self.options.num_centers,
+                                               maxIterations=self.options.num_iterations)
 
 
 class ALSTest(PredictionTest):
@@ -271,7 +680,7 @@ class ALSTest(PredictionTest):
         """
         implicit_prefs = self.options.implicit_prefs
         predictions = model.predictAll(rdd.map(lambda r: (r[0], r[1])))
-        sparkVersion = float(str(sc.version)[:3])
+        sparkVersion = float(str(self.sc.version)[:3])
         def mapPrediction(r):
             if sparkVersion <= 1.1:
                 (user, product, rating) = (r[0], r[1], r[2])
@@ -284,6 +693,7 @@ class ALSTest(PredictionTest):
         return numpy.sqrt(predictionsAndRatings.map(lambda ab: numpy.square(ab[0] - ab[1])).mean())
 
     def train(self, rdd):
+        options = self.options
         if options.implicit_prefs:
             model = ALS.trainImplicit(rdd, rank=options.rank,
                                       iterations=options.num_iterations,
@@ -322,11 +732,321 @@ class SpearmanCorrelationTest(CorrelationTest):
         corr = Statistics.corr(self.data, method="spearman")
 
 
+class ChiSquaredFeatureTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = LabeledDataGenerator.generateClassificationData(
+            self.sc, options.num_rows, options.num_cols, 0.5, options.num_partitions,
+            options.random_seed, chiSq=True)
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        results = Statistics.chiSqTest(self.data)
+
+
+class ChiSquaredGoFTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        rng = numpy.random.RandomState(self.options.random_seed)
+        self.data = Vectors.dense(rng.rand(self.options.num_rows))
+
+    def runTest(self):
+        result = Statistics.chiSqTest(self.data)
+
+
+class ChiSquaredMatTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        n = self.options.num_rows
+        rng = numpy.random.RandomState(self.options.random_seed)
+        self.data = Matrices.dense(n, n, rng.rand(n * n))
+
+    def runTest(self):
+        result = Statistics.chiSqTest(self.data)
+
+
+class LinearAlgebraTest(NonPredictionTest):
+    """
+    Parent class for the tests of a distributed RowMatrix.
+    """
+
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        # pyspark.mllib.linalg.distributed is new in Spark 1.5.
+        from pyspark.mllib.linalg.distributed import RowMatrix
+        options = self.options
+        self.data = FeaturesGenerator.generateContinuousData(
+            self.sc, options.num_rows, options.num_cols,
+            options.num_partitions, options.random_seed)
+        self.cacheInput(self.data)
+        self.matrix = RowMatrix(self.data, options.num_rows, options.num_cols)
+
+    def javaMatrix(self):
+        """
+        :return: the JVM RowMatrix of self.matrix, for the methods which PySpark < 2.2 does not
+                 expose (the Python ones just call them).
+        """
+        return self.matrix._java_matrix_wrapper._java_model
+
+
+class SVDTest(LinearAlgebraTest):
+    def __init__(self, sc):
+        LinearAlgebraTest.__init__(self, sc)
+
+    def runTest(self):
+        rank = self.options.rank
+        if hasattr(self.matrix, "computeSVD"):
+            svd = self.matrix.computeSVD(rank, computeU=True)
+        else:
+            svd = self.javaMatrix().computeSVD(rank, True, 1e-9)
+
+
+class PCATest(LinearAlgebraTest):
+    def __init__(self, sc):
+        LinearAlgebraTest.__init__(self, sc)
+
+    def runTest(self):
+        rank = self.options.rank
+        if hasattr(self.matrix, "computePrincipalComponents"):
+            projected = self.matrix.multiply(self.matrix.computePrincipalComponents(rank))
+        else:
+            matrix = self.javaMatrix()
+            projected = matrix.multiply(matrix.computePrincipalComponents(rank))
+
+
+class ColumnSummaryStatisticsTest(LinearAlgebraTest):
+    def __init__(self, sc):
+        LinearAlgebraTest.__init__(self, sc)
+
+    def runTest(self):
+        summary = Statistics.colStats(self.data)
+
+
+class BlockMatrixMultTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        # pyspark.mllib.linalg.distributed is new in Spark 1.5.
+        from pyspark.mllib.linalg.distributed import BlockMatrix
+        options = self.options
+        rng = numpy.random.RandomState(options.random_seed)
+        seedA, seedB = rng.randint(1 << 30, size=2)
+        blocksA = MatrixGenerator.generateBlocks(self.sc, options.m, options.k,
+                                                 options.block_size, options.num_partitions,
+                                                 options.random_seed ^ seedA)
+        blocksB = MatrixGenerator.generateBlocks(self.sc, options.k, options.n,
+                                                 options.block_size, options.num_partitions,
+                                                 options.random_seed ^ seedB)
+        # Cache the blocks of both matrices as one input, so that its size is reported.
+        blocks = blocksA.map(lambda b: (0, b)).union(blocksB.map(lambda b: (1, b)))
+        self.cacheInput(blocks)
+        self.A = BlockMatrix(blocks.filter(lambda b: b[0] == 0).values(),
+                             options.block_size, options.block_size, options.m, options.k)
+        self.B = BlockMatrix(blocks.filter(lambda b: b[0] == 1).values(),
+                             options.block_size, options.block_size, options.k, options.n)
+
+    def runTest(self):
+        self.A.multiply(self.B).blocks.count()
+
+
+class Word2VecTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = SequenceGenerator.generateSentences(
+            self.sc, options.num_sentences, options.num_words, options.num_partitions,
+            options.random_seed)
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        options = self.options
+        w2v = Word2Vec() \
+            .setNumPartitions(int(numpy.ceil(options.num_iterations ** 1.5))) \
+            .setNumIterations(options.num_iterations) \
+            .setVectorSize(options.vector_size) \
+            .setMinCount(options.min_count) \
+            .setSeed(0)
+        model = w2v.fit(self.data)
+
+
+class FPGrowthTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = SequenceGenerator.generateBaskets(
+            self.sc, options.num_baskets, options.avg_basket_size, options.num_items,
+            options.num_partitions, options.random_seed)
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        model = FPGrowth.train(self.data, minSupport=self.options.min_support,
+                               numPartitions=self.data.getNumPartitions() * 8)
+        numFreqItemsets = model.freqItemsets().count()
+
+
+class PrefixSpanTest(NonPredictionTest):
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+
+    def createInputData(self):
+        options = self.options
+        self.data = SequenceGenerator.generateSequences(
+            self.sc, options.num_sequences, options.avg_sequence_size, options.avg_itemset_size,
+            options.num_items, options.num_partitions, options.random_seed)
+        self.cacheInput(self.data)
+
+    def runTest(self):
+        options = self.options
+        model = PrefixSpan.train(self.data, minSupport=options.min_support,
+                                 maxPatternLength=options.max_pattern_len,
+                                 maxLocalProjDBSize=options.max_local_proj_db_size)
+        numFreqSequences = model.freqSequences().count()
+
+
+class PipelineTest(NonPredictionTest):
+    """
+    Parent class for the tests of a spark.ml Pipeline which assembles the numeric feature columns
+    of a DataFrame into a vector, scales it and fits an estimator to it. The DataFrame is built
+    and cached before the trials, so their times do not include converting the input to it.
+
+    Each trial fits and applies the stages one by one, as Pipeline.fit does, and reports the
+    time of each. As transforms are lazy, the time of applying a stage shows up in the fit time
+    of the next estimator, unless --cache-intermediate is given: then the output of each stage
+    but the last is cached before the next one runs, and the time and bytes this takes are
+    reported too.
+    """
+
+    def __init__(self, sc):
+        NonPredictionTest.__init__(self, sc)
+        # The metrics of each stage of the pipeline in the last trial.
+        self.pipelineStages = []
+        # The metrics of the stages in each trial, reported in the JSON results.
+        self.trialPipelineStages = []
+
+    def generateData(self):
+        """
+        :return: RDD[LabeledPoint] whose features become the columns of the input DataFrame.
+        """
+        raise NotImplementedError
+
+    def estimator(self):
+        """
+        :return: the spark.ml estimator of the last stage of the pipeline.
+        """
+        raise NotImplementedError
+
+    def createInputData(self):
+        columns = ["f%d" % i for i in xrange(self.options.num_features)]
+        schema = StructType([StructField(name, DoubleType(), False)
+                             for name in ["label"] + columns])
+        rows = self.generateData().map(
+            lambda lp: [float(lp.label)] + lp.features.toArray().tolist())
+        self.data = SQLContext.getOrCreate(self.sc).createDataFrame(rows, schema)
+        self.cacheInput(self.data)
+        self.stages = [VectorAssembler(inputCols=columns, outputCol="rawFeatures"),
+                       MLStandardScaler(inputCol="rawFeatures", outputCol="features"),
+                       self.estimator()]
+
+    def runTest(self):
+        df = self.data
+        cachedDataFrames = []
+        self.pipelineStages = []
+        for i, stage in enumerate(self.stages):
+            metrics = {"stage": type(stage).__name__}
+            if isinstance(stage, Estimator):
+                start = time.time()
+                stage = stage.fit(df)
+                metrics["fitTime"] = time.time() - start
+            start = time.time()
+            df = stage.transform(df)
+            if i == len(self.stages) - 1:
+                # Apply the fitted pipeline. count() would skip computing the predictions, as it
+                # does not need their column.
+                df.agg({"prediction": "sum"}).collect()
+            metrics["transformTime"] = time.time() - start
+            if i < len(self.stages) - 1 and self.options.cache_intermediate:
+                cachedBefore = cachedRDDIds(self.sc)
+                start = time.time()
+                df.cache().count()
+                metrics["cacheTime"] = time.time() - start
+                cached = cachedRDDMetrics(self.sc, cachedRDDIds(self.sc) - cachedBefore)
+                metrics["cachedBytes"] = \
+                    cached.get("cachedMemoryBytes", 0) + cached.get("cachedDiskBytes", 0)
+                cachedDataFrames.append(df)
+            self.pipelineStages.append(metrics)
+        # Drop the cached outputs of the stages, so that every trial pays for caching them.
+        for cachedDataFrame in cachedDataFrames:
+            cachedDataFrame.unpersist()
+
+    def trialResults(self, runtime, stages):
+        # The results of a trial are stored as one number per metric, so report the time of each
+        # stage under its own key (e.g. stage0FitTime), and its name only in the JSON results.
+        self.trialPipelineStages.append(self.pipelineStages)
+        results = {}
+        for i, metrics in enumerate(self.pipelineStages):
+            for metric, value in metrics.items():
+                if metric != "stage":
+                    results["stage%d%s%s" % (i, metric[0].upper(), metric[1:])] = value
+        return results
+
+
+class LogisticRegressionPipelineTest(PipelineTest):
+    def __init__(self, sc):
+        PipelineTest.__init__(self, sc)
+
+    def generateData(self):
+        options = self.options
+        return LabeledDataGenerator.generateClassificationData(
+            self.sc, options.num_examples, options.num_features, 0.5, options.num_partitions,
+            options.random_seed)
+
+    def estimator(self):
+        options = self.options
+        return MLLogisticRegression(maxIter=options.num_iterations, regParam=options.reg_param,
+                                    elasticNetParam=options.elastic_net_param)
+
+
+class LinearRegressionPipelineTest(PipelineTest):
+    def __init__(self, sc):
+        PipelineTest.__init__(self, sc)
+
+    def generateData(self):
+        options = self.options
+        return LabeledDataGenerator.generateGLMData(
+            self.sc, options.num_examples, options.num_features, options.num_partitions,
+            options.random_seed, labelType=0)
+
+    def estimator(self):
+        options = self.options
+        return MLLinearRegression(maxIter=options.num_iterations, regParam=options.reg_param,
+                                  elasticNetParam=options.elastic_net_param)
+
+
 if __name__ == "__main__":
     import optparse
     parser = optparse.OptionParser(usage="Usage: %prog [options] test_names")
     # COMMON_OPTS
     parser.add_option("--num-trials", type="int", default=1)
+    parser.add_option("--max-trials", type="int", default=0,
+                      help="if > 0, run up to this many trials, stopping once the timings "
+                           "have converged")
+    parser.add_option("--target-ci", type="float", default=5.0,
+                      help="with --max-trials, the target width of the median's confidence "
+                           "interval, in percent")
     parser.add_option("--inter-trial-wait", type="int", default=3)
     # MLLIB_COMMON_OPTS
     parser.add_option("--num-partitions", type="int", default=10)
@@ -337,6 +1057,12 @@ if __name__ == "__main__":
     # MLLIB_REGRESSION_CLASSIFICATION_TEST_OPTS
     parser.add_option("--num-examples", type="int", default=1024)
     parser.add_option("--num-features", type="int", default=50)
+    parser.add_option("--feature-type", type="choice", choices=FeaturesGenerator.featureTypes,
+                      default="dense",
+                      help="kind of feature vectors of the GLM, NaiveBayes and KMeans tests "
+                           "(see FeaturesGenerator.generateData)")
+    parser.add_option("--feature-density", type="float", default=0.01,
+                      help="fraction of non-zero features of the sparse feature types")
     # MLLIB_GLM_TEST_OPTS
     parser.add_option("--step-size", type="float", default=0.1)
     parser.add_option("--reg-type", type="string", default="none")
@@ -360,6 +1086,9 @@ if __name__ == "__main__":
     parser.add_option("--max-bins", type="int", default=32)
     #  (for Spark 1.2+ only:)
     parser.add_option("--ensemble-type", type="string", default="RandomForest")
+    parser.add_option("--training-data", type="string", default="")
+    parser.add_option("--test-data", type="string", default="")
+    parser.add_option("--test-data-fraction", type="float", default=0.2)
     parser.add_option("--num-trees", type="int", default=1)
     parser.add_option("--feature-subset-strategy", type="string", default="auto")
     # MLLIB_RECOMMENDATION_TEST_OPTS
@@ -372,6 +1101,37 @@ if __name__ == "__main__":
     # MLLIB_LINALG_TEST_OPTS + MLLIB_STATS_TEST_OPTS
     parser.add_option("--num-rows", type="int", default=1000)
     parser.add_option("--num-cols", type="int", default=10)
+    # MLLIB_BLOCK_MATRIX_MULT_TEST_OPTS
+    parser.add_option("--m", type="long", default=1000)
+    parser.add_option("--k", type="long", default=1000)
+    parser.add_option("--n", type="long", default=1000)
+    parser.add_option("--block-size", type="int", default=128)
+    # MLLIB_LDA_TEST_OPTS (with --optimizer em or online)
+    parser.add_option("--num-documents", type="int", default=1000)
+    parser.add_option("--num-vocab", type="int", default=1000)
+    parser.add_option("--num-topics", type="int", default=10)
+    parser.add_option("--document-length", type="int", default=100)
+    # MLLIB_PIC_TEST_OPTS
+    parser.add_option("--node-degree", type="int", default=20)
+    # MLLIB_WORD2VEC_TEST_OPTS
+    parser.add_option("--num-sentences", type="int", default=1000)
+    parser.add_option("--num-words", type="int", default=1000)
+    parser.add_option("--vector-size", type="int", default=100)
+    parser.add_option("--min-count", type="int", default=5)
+    # MLLIB_FP_GROWTH_TEST_OPTS + MLLIB_PREFIX_SPAN_TEST_OPTS
+    parser.add_option("--num-baskets", type="int", default=1000)
+    parser.add_option("--avg-basket-size", type="int", default=10)
+    parser.add_option("--num-items", type="int", default=100)
+    parser.add_option("--min-support", type="float", default=0.01)
+    parser.add_option("--num-sequences", type="int", default=1000)
+    parser.add_option("--avg-sequence-size", type="int", default=5)
+    parser.add_option("--avg-itemset-size", type="int", default=2)
+    parser.add_option("--max-pattern-len", type="int", default=10)
+    parser.add_option("--max-local-proj-db-size", type="long", default=32000000)
+    # PYTHON_ML_PIPELINE_TEST_OPTS
+    parser.add_option("--cache-intermediate", action="store_true", default=False,
+                      help="cache the output of each stage of the spark.ml pipeline tests "
+                           "before running the next one")
 
     options, cases = parser.parse_args()
 
@@ -388,36 +1148,43 @@ if __name__ == "__main__":
                 print "\t type(javaSystemProperties[k]) = %r" % type(javaSystemProperties[k])
             systemProperties[k] = javaSystemProperties[k]
         ts = test.run()
-        if len(ts) != test.options.num_trials:
-            raise Exception("mllib_tests.py FAILED (got %d results instead of %d)" %
+        if len(ts) < test.options.num_trials:
+            raise Exception("mllib_tests.py FAILED (got %d results instead of at least %d)" %
                             (len(ts), test.options.num_trials))
         results = []
         if len(ts[0]) == 1:
             # results include: time
             print "Results from each trial:"
             print "trial\ttime"
-            for trial in range(test.options.num_trials):
+            for trial in range(len(ts)):
                 t = ts[trial]
                 print "%d\t%.3f" % (trial, t[0])
                 results.append({"time": t[0]})
+                results[-1].update(test.trialMetrics[trial])
         else:
             # results include: trainingTime, testTime, trainingMetric, testMetric
             print "Results from each trial:"
             print "trial\ttrainingTime\ttestTime\ttrainingMetric\ttestMetric"
-            for trial in range(test.options.num_trials):
+            for trial in range(len(ts)):
                 t = ts[trial]
                 print "%d\t%.3f\t%.3f\t%.3f\t%.3f" % (trial, t[0], t[1], t[2], t[3])
                 results.append({"trainingTime": t[0], "testTime": t[1],
                                 "trainingMetric": t[2], "testMetric": t[3]})
+                results[-1].update(test.trialMetrics[trial])
         # JSON results
         sparkConfInfo = {} # convert to dict to match Scala JSON
         for (a,b) in sc._conf.getAll():
             sparkConfInfo[a] = b
-        jsonResults = json.dumps({"testName": name,
-                                  "options": vars(options),
-                                  "sparkConf": sparkConfInfo,
-                                  "sparkVersion": sc.version,
-                                  "systemProperties": systemProperties,
-                                  "results": results},
-                                 separators=(',', ':'))  # use separators for compact encoding
+        jsonDict = {"testName": name,
+                    "options": vars(options),
+                    "sparkConf": sparkConfInfo,
+                    "sparkVersion": sc.version,
+                    "systemProperties": systemProperties,
+                    "results": results,
+                    "warmupTrials": test.warmupTrials,
+                    "inputData": test.inputMetrics,
+                    "stageMetrics": test.stageMetrics}
+        if isinstance(test, PipelineTest):
+            jsonDict["pipelineStages"] = test.trialPipelineStages
+        jsonResults = json.dumps(jsonDict, separators=(',', ':'))  # use compact encoding
         print "results: " + jsonResults
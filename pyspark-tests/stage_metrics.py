@@ -0,0 +1,173 @@
+"""
+Collects the task metrics of the stages run by each trial of a test, summed per stage, so that a
+slower trial can be traced to e.g. more shuffle data, spilling or GC time.
+
+PySpark cannot register a JVM SparkListener without a py4j callback server, so the jobs of a
+trial are tagged with a job group, found through the status tracker, and the metrics of their
+stages are read from the REST API of the Spark UI (which is fed by the UI's own listener).
+"""
+
+from datetime import datetime
+import json
+import sys
+import time
+import urllib2
+
+# Metrics reported for each stage, summed over its tasks. Times are in milliseconds.
+STAGE_METRICS = ["executorRunTime", "executorCpuTime", "executorDeserializeTime", "jvmGcTime",
+                 "resultSerializationTime", "inputBytes", "shuffleReadBytes", "shuffleWriteBytes",
+                 "memoryBytesSpilled", "diskBytesSpilled"]
+# Metrics which the stage data of older Spark versions lacks; they are summed from its tasks.
+TASK_METRICS = ["executorDeserializeTime", "jvmGcTime", "resultSerializationTime"]
+# Statuses of stage attempts which will not run (any more) tasks.
+FINISHED_STATUSES = ["COMPLETE", "FAILED", "SKIPPED"]
+# Format of the times reported by the REST API, e.g. "2017-06-26T10:00:00.123GMT", without the
+# time zone.
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def uiWebUrl(sc):
+    """Return the URL of the Spark UI, or None if the UI is disabled."""
+    ui = sc._jsc.sc().ui()
+    if not ui.isDefined():
+        return None
+    # PySpark < 2.1 does not expose the URL.
+    return getattr(sc, "uiWebUrl", None) or ui.get().appUIAddress()
+
+
+def sumStageMetrics(stages):
+    """
+    :param stages: the list of per-stage metrics returned by StageMetricsCollector.finishTrial.
+    :return: a dict mapping each metric to its sum over the stages, plus "numStages", or an
+             empty dict if the metrics were not collected.
+    """
+    if stages is None:
+        return {}
+    totals = {"numStages": len(stages)}
+    for metric in STAGE_METRICS:
+        values = [stage[metric] for stage in stages if stage.get(metric) is not None]
+        if values:
+            totals[metric] = sum(values)
+    return totals
+
+
+class StageMetricsCollector(object):
+
+    def __init__(self, sc, timeout=30):
+        """
+        :param timeout: the number of seconds to wait for the stages of a trial to be reported
+                        as finished by the UI, which may lag behind the jobs themselves.
+        """
+        self.sc = sc
+        self.timeout = timeout
+        self.jobGroup = None
+        self.baseUrl = uiWebUrl(sc)
+        if self.baseUrl is None:
+            print >> sys.stderr, "The Spark UI is disabled; stage metrics will not be collected"
+
+    def _get(self, path):
+        url = "%s/api/v1/applications/%s/%s" % (self.baseUrl, self.sc.applicationId, path)
+        return json.load(urllib2.urlopen(url, timeout=self.timeout))
+
+    def startTrial(self, trial):
+        """Tag the jobs run from now on as belonging to trial number `trial`."""
+        self.jobGroup = "spark-perf-trial-%d" % trial
+        self.sc.setJobGroup(self.jobGroup, "spark-perf trial %d" % trial)
+
+    def tagThread(self):
+        """
+        Tag the jobs run from the calling thread like those of the main thread. Job groups are
+        set per thread, so this must be called by the threads which submit a trial's jobs.
+        """
+        if self.jobGroup is None:
+            self.sc._jsc.clearJobGroup()
+        else:
+            self.sc.setJobGroup(self.jobGroup, "spark-perf trial")
+
+    def finishTrial(self):
+        """
+        :return: a list with a dict of metrics for each stage run since L{startTrial}, in the
+                 order of their ids, or None if the metrics could not be collected.
+        """
+        self.sc._jsc.clearJobGroup()
+        jobGroup, self.jobGroup = self.jobGroup, None
+        if self.baseUrl is None:
+            return None
+        tracker = self.sc.statusTracker()
+        stageIds = set()
+        for jobId in tracker.getJobIdsForGroup(jobGroup):
+            jobInfo = tracker.getJobInfo(jobId)
+            if jobInfo is not None:
+                stageIds.update(jobInfo.stageIds)
+        try:
+            stages = [self._stageMetrics(stageId) for stageId in sorted(stageIds)]
+        except (urllib2.URLError, IOError, ValueError) as e:
+            print >> sys.stderr, "Could not collect stage metrics: %s" % e
+            return None
+        return [stage for stage in stages if stage is not None]
+
+    def _stageMetrics(self, stageId):
+        """
+        Sum the metrics of all attempts of a stage, or return None if the stage never ran (e.g.
+        because its shuffle output was reused).
+        """
+        deadline = time.time() + self.timeout
+        attempts = self._get("stages/%d" % stageId)
+        while (any(a["status"] not in FINISHED_STATUSES + ["PENDING"] for a in attempts) and
+               time.time() < deadline):
+            time.sleep(0.1)
+            attempts = self._get("stages/%d" % stageId)
+        attempts = [a for a in attempts if a["status"] not in ["PENDING", "SKIPPED"]]
+        if not attempts:
+            return None
+        stage = {"stageId": stageId, "name": attempts[0]["name"],
+                 "numAttempts": len(attempts),
+                 "numTasks": sum(a["numCompleteTasks"] + a["numFailedTasks"] for a in attempts)}
+        tasks = {}
+        for metric in STAGE_METRICS:
+            values = [a.get(metric) for a in attempts]
+            if None in values and metric in TASK_METRICS:
+                values = []
+                for a in attempts:
+                    if a["attemptId"] not in tasks:
+                        tasks[a["attemptId"]] = self._taskMetrics(stageId, a)
+                    values.append(sum(t.get(metric, 0) for t in tasks[a["attemptId"]]))
+            if None not in values:
+                stage[metric] = sum(values)
+        if "executorCpuTime" in stage:
+            # Reported in nanoseconds.
+            stage["executorCpuTime"] /= 1e6
+        return stage
+
+    def _taskMetrics(self, stageId, attempt):
+        numTasks = attempt["numCompleteTasks"] + attempt["numFailedTasks"] + \
+            attempt.get("numActiveTasks", 0)
+        tasks = self._get("stages/%d/%d/taskList?length=%d" %
+                          (stageId, attempt["attemptId"], max(numTasks, 1)))
+        return [task.get("taskMetrics", {}) for task in tasks]
+
+    def taskLaunchDelays(self, stages):
+        """
+        :param stages: the per-stage metrics returned by L{finishTrial}.
+        :return: for each task of `stages`, the number of milliseconds between the submission of
+                 its stage and its launch, or an empty list if they could not be collected.
+        """
+        parseTime = lambda t: datetime.strptime(t[:23], TIME_FORMAT)
+        delays = []
+        try:
+            for stage in stages:
+                for attempt in self._get("stages/%d" % stage["stageId"]):
+                    if attempt.get("submissionTime") is None:
+                        continue
+                    submitted = parseTime(attempt["submissionTime"])
+                    numTasks = attempt["numCompleteTasks"] + attempt["numFailedTasks"]
+                    tasks = self._get("stages/%d/%d/taskList?length=%d" %
+                                      (stage["stageId"], attempt["attemptId"], max(numTasks, 1)))
+                    for task in tasks:
+                        delay = parseTime(task["launchTime"]) - submitted
+                        delays.append(delay.days * 86400000 + delay.seconds * 1000 +
+                                      delay.microseconds / 1000.0)
+        except (urllib2.URLError, IOError, ValueError, KeyError) as e:
+            print >> sys.stderr, "Could not collect task launch times: %s" % e
+            return []
+        return delays
@@ -0,0 +1,23 @@
+"""
+Reports the result of each trial as soon as it completes, as one JSON line appended to the file
+named by the SPARKPERF_TRIALS_FILE environment variable (set by the spark-perf harness); this
+mirrors spark.perf.TrialReporter in spark-tests. It lets the harness show progress and keep the
+completed trials of a test which dies before printing its final results.
+"""
+
+import json
+import os
+
+TRIALS_FILE_ENV_VAR = "SPARKPERF_TRIALS_FILE"
+
+
+def reportTrial(trial, result):
+    """
+    Report the result of trial number `trial` (starting from 0), a dict mapping metric names to
+    values. Does nothing when SPARKPERF_TRIALS_FILE is not set.
+    """
+    path = os.environ.get(TRIALS_FILE_ENV_VAR)
+    if not path:
+        return
+    with open(path, "a") as trialsFile:
+        trialsFile.write(json.dumps({"trial": trial, "result": result}) + "\n")
@@ -0,0 +1,13 @@
+package org.apache.spark
+
+/**
+ * Gives spark-perf access to the listener bus of a SparkContext, which is private to Spark.
+ * Listener events are delivered asynchronously, so metrics gathered by a listener are only
+ * complete for a job once the events posted while it ran have been delivered.
+ */
+object SparkPerfListenerBus {
+  /** Wait until all events posted so far have been delivered to the listeners. */
+  def waitUntilEmpty(sc: SparkContext, timeoutMillis: Long = 60 * 1000): Unit = {
+    sc.listenerBus.waitUntilEmpty(timeoutMillis)
+  }
+}
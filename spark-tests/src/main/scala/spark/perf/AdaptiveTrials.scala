@@ -0,0 +1,63 @@
+package spark.perf
+
+/**
+ * Decides how many trials of a test to run from the measured times themselves. Leading trials
+ * which are clearly slower than the trials after them (e.g. due to JIT warm-up) are treated as
+ * warm-up, and trials are run until the confidence interval of the median of the remaining times
+ * is narrower than a target percentage of that median.
+ */
+object AdaptiveTrials {
+  /** Minimum number of trials after warm-up before convergence is checked. */
+  val MinSteadyTrials = 5
+
+  def median(times: Seq[Double]): Double = {
+    val sorted = times.sorted
+    val n = sorted.length
+    if (n % 2 == 0) (sorted(n / 2 - 1) + sorted(n / 2)) / 2 else sorted(n / 2)
+  }
+
+  /**
+   * Number of leading trials which are more than `tolerancePct` percent slower than the median of
+   * the trials following them. At least MinSteadyTrials trials are never counted as warm-up.
+   */
+  def numWarmupTrials(times: Seq[Double], tolerancePct: Double): Int = {
+    var warmup = 0
+    while (warmup < times.length - MinSteadyTrials &&
+        times(warmup) > median(times.drop(warmup + 1)) * (1 + tolerancePct / 100)) {
+      warmup += 1
+    }
+    warmup
+  }
+
+  /**
+   * Width of the distribution-free 95% confidence interval of the median (between two order
+   * statistics), as a percentage of the median.
+   */
+  def medianCIWidthPct(times: Seq[Double]): Double = {
+    val sorted = times.sorted
+    val n = sorted.length
+    val halfWidth = 1.96 * math.sqrt(n) / 2
+    val lower = math.max(0, math.floor(n / 2.0 - halfWidth).toInt - 1)
+    val upper = math.min(n - 1, math.ceil(n / 2.0 + 1 + halfWidth).toInt - 1)
+    (sorted(upper) - sorted(lower)) / median(sorted) * 100
+  }
+
+  /**
+   * Whether enough trials have been run. Without a positive `maxTrials`, exactly `minTrials`
+   * trials are run. Otherwise trials continue past `minTrials` until the confidence interval of
+   * the median of the post-warm-up times is at most `targetCIPct` percent wide, or `maxTrials`
+   * trials have been run.
+   */
+  def isDone(times: Seq[Double], minTrials: Int, maxTrials: Int, targetCIPct: Double): Boolean = {
+    if (maxTrials <= 0) {
+      times.length >= minTrials
+    } else if (times.length >= maxTrials) {
+      true
+    } else if (times.length < minTrials) {
+      false
+    } else {
+      val steady = times.drop(numWarmupTrials(times, targetCIPct))
+      steady.length >= MinSteadyTrials && medianCIWidthPct(steady) <= targetCIPct
+    }
+  }
+}
@@ -67,10 +67,18 @@ object DataGenerator {
       randomSeed: Int,
       skew: Int,
       persistenceType: String,
-      storageLocation: String = "/tmp/spark-perf-kv-data")
+      storageLocation: String = "/tmp/spark-perf-kv-data",
+      cache: Option[InputDataCache] = None)
     : RDD[(Int, Int)] =
   {
-    val inputRDD = generateIntData(sc, numRecords, uniqueKeys, uniqueValues, numPartitions, randomSeed, skew)
+    val generated = generateIntData(sc, numRecords, uniqueKeys, uniqueValues, numPartitions, randomSeed, skew)
+    val inputRDD = cache match {
+      case Some(c) if persistenceType != "hdfs" =>
+        c.getOrCreate(Seq("int", numRecords, uniqueKeys, uniqueValues, numPartitions, randomSeed, skew),
+          path => generated.saveAsSequenceFile(path, Some(classOf[DefaultCodec])),
+          path => sc.sequenceFile[Int, Int](path, numPartitions))
+      case _ => generated
+    }
 
     val rdd = persistenceType match {
       case "memory" => {
@@ -115,14 +123,23 @@ object DataGenerator {
       skew: Int,
       persistenceType: String,
       storageLocation: String = "/tmp/spark-perf-kv-data",
-      hashFunction: Option[HashFunction] = None)
+      hashFunction: Option[HashFunction] = None,
+      cache: Option[InputDataCache] = None)
     : RDD[(String, String)] =
   {
     val ints = generateIntData(sc, numRecords, uniqueKeys, uniqueValues, numPartitions, randomSeed, skew)
 
-    val inputRDD = ints.map { case (k, v) =>
+    val generated = ints.map { case (k, v) =>
       (paddedString(k, keyLength, hashFunction), paddedString(v, valueLength, hashFunction))
     }
+    val inputRDD = cache match {
+      case Some(c) if persistenceType != "hdfs" =>
+        c.getOrCreate(Seq("string", numRecords, uniqueKeys, keyLength, uniqueValues, valueLength,
+            numPartitions, randomSeed, skew, hashFunction.isDefined),
+          path => generated.saveAsSequenceFile(path, Some(classOf[DefaultCodec])),
+          path => sc.sequenceFile[String, String](path, numPartitions))
+      case _ => generated
+    }
 
     val rdd = persistenceType match {
       case "memory" => {
@@ -0,0 +1,70 @@
+package spark.perf
+
+import java.nio.charset.StandardCharsets
+
+import com.google.common.hash.Hashing
+import org.apache.hadoop.fs.Path
+
+import org.apache.spark.SparkContext
+import org.apache.spark.rdd.RDD
+
+/**
+ * A cache of generated input datasets in a directory of a Hadoop file system (a file:// URL on
+ * a single machine), shared by the runs of the tests. Every option combination runs as a new
+ * application, so without it each one generates its input again even if only options which do
+ * not affect the input (such as reduce-tasks or Java options) changed.
+ *
+ * Each dataset is stored under a hash of the parameters it was generated with. Once the cache
+ * holds more than maxBytes, the least recently used datasets are evicted.
+ */
+class InputDataCache(sc: SparkContext, location: String, maxBytes: Long) {
+  private val root = new Path(location)
+  private val fileSystem = root.getFileSystem(sc.hadoopConfiguration)
+
+  /** Seconds spent generating and storing the datasets which were not cached yet. */
+  var generationTime = 0.0
+
+  /**
+   * Return the dataset generated with `params`, reading it back with `load` from the directory
+   * it was stored in. If it is not cached yet, it is first stored with `save` (which should
+   * generate it and write it to the given directory).
+   */
+  def getOrCreate[T](params: Seq[Any], save: String => Unit, load: String => RDD[T]): RDD[T] = {
+    val key = Hashing.sha1().hashString(params.mkString(","), StandardCharsets.UTF_8).toString
+    val dir = new Path(root, key)
+    if (fileSystem.exists(new Path(dir, "_SUCCESS"))) {
+      println(s"Loading input data from $dir")
+    } else {
+      fileSystem.delete(dir, true)
+      // Write to a temporary directory first, so that concurrent runs never read partial data.
+      val tmp = new Path(root, key + ".tmp-" + sc.applicationId)
+      val start = System.currentTimeMillis()
+      save(tmp.toString)
+      generationTime += (System.currentTimeMillis() - start) / 1000.0
+      if (fileSystem.exists(dir)) {
+        // Another run stored the same dataset in the meantime.
+        fileSystem.delete(tmp, true)
+      } else {
+        fileSystem.rename(tmp, dir)
+      }
+      evict(key)
+    }
+    // Mark the dataset as recently used.
+    fileSystem.setTimes(dir, System.currentTimeMillis(), -1)
+    load(dir.toString)
+  }
+
+  /** Delete the least recently used datasets other than `keep` until maxBytes are cached. */
+  private def evict(keep: String) {
+    val entries = fileSystem.listStatus(root)
+      .filter(s => s.isDirectory && !s.getPath.getName.contains(".tmp-"))
+      .map(s => (s, fileSystem.getContentSummary(s.getPath).getLength))
+      .sortBy(_._1.getModificationTime)
+    var cachedBytes = entries.map(_._2).sum
+    for ((status, bytes) <- entries if cachedBytes > maxBytes && status.getPath.getName != keep) {
+      println(s"Evicting input data from ${status.getPath}")
+      fileSystem.delete(status.getPath, true)
+      cachedBytes -= bytes
+    }
+  }
+}
@@ -1,6 +1,7 @@
 package spark.perf
 
 import scala.collection.JavaConverters._
+import scala.collection.mutable.ArrayBuffer
 
 import joptsimple.{OptionSet, OptionParser}
 import com.google.common.hash.Hashing
@@ -33,6 +34,14 @@ abstract class KVDataTest(sc: SparkContext, dataType: String = "string") extends
   val HASH_RECORDS =     ("hash-records", "Use hashes instead of padded numbers for keys and values")
   val WAIT_FOR_EXIT =    ("wait-for-exit", "JVM will not exit until input is received from stdin")
   val SKEW =             ("skew", "Degree of data skewness")
+  val MAX_TRIALS =       ("max-trials",
+    "if > 0, run up to this many trials, stopping once the timings have converged")
+  val TARGET_CI =        ("target-ci",
+    "with max-trials, the target width of the median's confidence interval, in percent")
+  val INPUT_CACHE =      ("input-cache",
+    "directory caching generated input data across runs, or empty to always generate it")
+  val INPUT_CACHE_MAX_BYTES = ("input-cache-max-bytes",
+    "size above which the least recently used datasets are evicted from input-cache")
 
   val longOptions = Seq(NUM_RECORDS)
   val intOptions = Seq(NUM_TRIALS, INTER_TRIAL_WAIT, REDUCE_TASKS, KEY_LENGTH, VALUE_LENGTH, UNIQUE_KEYS,
@@ -57,14 +66,48 @@ abstract class KVDataTest(sc: SparkContext, dataType: String = "string") extends
   booleanOptions.map{case (opt, desc) =>
     parser.accepts(opt, desc)
   }
+  parser.accepts(MAX_TRIALS._1, MAX_TRIALS._2).withRequiredArg()
+    .ofType(classOf[java.lang.Integer]).defaultsTo(0)
+  parser.accepts(TARGET_CI._1, TARGET_CI._2).withRequiredArg()
+    .ofType(classOf[java.lang.Double]).defaultsTo(5.0)
+  parser.accepts(INPUT_CACHE._1, INPUT_CACHE._2).withRequiredArg()
+    .ofType(classOf[String]).defaultsTo("")
+  parser.accepts(INPUT_CACHE_MAX_BYTES._1, INPUT_CACHE_MAX_BYTES._2).withRequiredArg()
+    .ofType(classOf[java.lang.Long]).defaultsTo(100L << 30)
 
   var waitForExit = false
   var hashRecords = false
+  var detectedWarmupTrials: Option[Int] = None
+  var inputCache: Option[InputDataCache] = None
+  /** Seconds spent creating (generating or loading) and materializing the input data. */
+  var inputTime = 0.0
+
+  override def warmupTrials: Option[Int] = detectedWarmupTrials
+
+  override def inputMetrics: Map[String, Double] = inputCache match {
+    case Some(cache) =>
+      Map("inputGenerationTime" -> cache.generationTime,
+        "inputLoadTime" -> (inputTime - cache.generationTime))
+    case None => Map("inputGenerationTime" -> inputTime)
+  }
 
   override def initialize(args: Array[String]) = {
     optionSet = parser.parse(args.toSeq: _*)
     waitForExit = optionSet.has(WAIT_FOR_EXIT._1)
     hashRecords = optionSet.has(HASH_RECORDS._1)
+    val cacheLocation = optionSet.valueOf(INPUT_CACHE._1).asInstanceOf[String]
+    if (cacheLocation.nonEmpty) {
+      val maxBytes = optionSet.valueOf(INPUT_CACHE_MAX_BYTES._1).asInstanceOf[java.lang.Long]
+      inputCache = Some(new InputDataCache(sc, cacheLocation, maxBytes))
+    }
+  }
+
+  /** Create input data with `f`, adding the time it takes to inputTime. */
+  def timeInput[T](f: => T): T = {
+    val start = System.currentTimeMillis()
+    val result = f
+    inputTime += (System.currentTimeMillis() - start) / 1000.0
+    result
   }
 
   override def createInputData() = {
@@ -90,22 +133,25 @@ abstract class KVDataTest(sc: SparkContext, dataType: String = "string") extends
       case false => None
     }
 
-    rdd = dataType match {
+    rdd = timeInput { dataType match {
       case "string" =>
         DataGenerator.createKVStringDataSet(sc, numRecords, uniqueKeys, keyLength, uniqueValues,
-          valueLength, numPartitions, randomSeed, skew, persistenceType, storageLocation, hashFunction)
+          valueLength, numPartitions, randomSeed, skew, persistenceType, storageLocation, hashFunction,
+          inputCache)
       case "int" =>
         DataGenerator.createKVIntDataSet(sc, numRecords, uniqueKeys, uniqueValues,
-          numPartitions, randomSeed, skew, persistenceType, storageLocation)
+          numPartitions, randomSeed, skew, persistenceType, storageLocation, inputCache)
       case _ =>
         throw new IllegalArgumentException("Unknown data type: " + dataType)
-    }
+    }}
   }
 
   override def run(): (JValue, Seq[JValue]) = {
     val numTrials = optionSet.valueOf(NUM_TRIALS._1).asInstanceOf[Int]
     val interTrialWait: Int = optionSet.valueOf(INTER_TRIAL_WAIT._1).asInstanceOf[Int]
     val reduceTasks = optionSet.valueOf(REDUCE_TASKS._1).asInstanceOf[Int]
+    val maxTrials = optionSet.valueOf(MAX_TRIALS._1).asInstanceOf[Int]
+    val targetCI = optionSet.valueOf(TARGET_CI._1).asInstanceOf[Double]
 
     val options: Map[String, String] = optionSet.asMap().asScala.flatMap { case (spec, values) =>
       if (spec.options().size() == 1 && values.size() == 1) {
@@ -115,14 +161,24 @@ abstract class KVDataTest(sc: SparkContext, dataType: String = "string") extends
       }
     }.toMap
 
-    val results: Seq[JValue] = (1 to numTrials).map { t =>
+    val shuffleVolume = new ShuffleVolumeListener(sc)
+    val times = new ArrayBuffer[Double]()
+    val results = new ArrayBuffer[JValue]()
+    do {
+      shuffleVolume.reset()
       val start = System.currentTimeMillis()
       runTest(rdd, reduceTasks)
       val end = System.currentTimeMillis()
-      val time = (end - start).toDouble / 1000.0
+      times += (end - start).toDouble / 1000.0
+      val (shuffleWriteBytes, shuffleReadBytes) = shuffleVolume.shuffleBytes
+      results += ("time" -> times.last) ~ ("shuffleWriteBytes" -> shuffleWriteBytes) ~
+        ("shuffleReadBytes" -> shuffleReadBytes)
+      TrialReporter.report(times.length - 1, results.last)
       System.gc()
       Thread.sleep(interTrialWait * 1000)
-      "time" -> time : JValue
+    } while (!AdaptiveTrials.isDone(times, numTrials, maxTrials, targetCI))
+    if (maxTrials > 0) {
+      detectedWarmupTrials = Some(AdaptiveTrials.numWarmupTrials(times, targetCI))
     }
 
     if (waitForExit) {
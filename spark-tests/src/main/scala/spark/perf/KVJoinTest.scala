@@ -0,0 +1,157 @@
+package spark.perf
+
+import scala.collection.mutable.ArrayBuffer
+import scala.reflect.ClassTag
+import scala.util.Random
+
+import com.google.common.hash.Hashing
+
+import org.apache.spark.{HashPartitioner, SparkContext}
+import org.apache.spark.rdd.RDD
+import org.apache.spark.SparkContext._
+
+/**
+ * Parent class for tests which join the (key, value) dataset of [[KVDataTest]] (the left side)
+ * with a second, uniformly distributed dataset (the right side) of join-size-ratio times as many
+ * records. The right side's keys are drawn from a range 1 / join-key-overlap times as large as
+ * the left side's, so that about that fraction of them have a match.
+ */
+abstract class KVJoinTest(sc: SparkContext) extends KVDataTest(sc) {
+  val JOIN_SIZE_RATIO = ("join-size-ratio", "number of right side records per left side record")
+  val JOIN_KEY_OVERLAP = ("join-key-overlap",
+    "fraction of the right side's keys which are drawn from the left side's keys")
+  val JOIN_SALTS = ("join-salts", "number of tasks each hot key is split over by skew-join")
+
+  parser.accepts(JOIN_SIZE_RATIO._1, JOIN_SIZE_RATIO._2).withRequiredArg()
+    .ofType(classOf[java.lang.Double]).defaultsTo(0.1)
+  parser.accepts(JOIN_KEY_OVERLAP._1, JOIN_KEY_OVERLAP._2).withRequiredArg()
+    .ofType(classOf[java.lang.Double]).defaultsTo(1.0)
+  parser.accepts(JOIN_SALTS._1, JOIN_SALTS._2).withRequiredArg()
+    .ofType(classOf[java.lang.Integer]).defaultsTo(16)
+
+  var right: RDD[(String, String)] = _
+
+  override def createInputData() = {
+    super.createInputData()
+    val numRecords: Long = optionSet.valueOf(NUM_RECORDS._1).asInstanceOf[Long]
+    val uniqueKeys: Int = optionSet.valueOf(UNIQUE_KEYS._1).asInstanceOf[Int]
+    val keyLength: Int = optionSet.valueOf(KEY_LENGTH._1).asInstanceOf[Int]
+    val uniqueValues: Int = optionSet.valueOf(UNIQUE_VALUES._1).asInstanceOf[Int]
+    val valueLength: Int = optionSet.valueOf(VALUE_LENGTH._1).asInstanceOf[Int]
+    val numPartitions: Int = optionSet.valueOf(NUM_PARTITIONS._1).asInstanceOf[Int]
+    val randomSeed: Int = optionSet.valueOf(RANDOM_SEED._1).asInstanceOf[Int]
+    val persistenceType: String = optionSet.valueOf(PERSISTENCE_TYPE._1).asInstanceOf[String]
+    val storageLocation: String = optionSet.valueOf(STORAGE_LOCATION._1).asInstanceOf[String]
+    val sizeRatio = optionSet.valueOf(JOIN_SIZE_RATIO._1).asInstanceOf[Double]
+    val keyOverlap = optionSet.valueOf(JOIN_KEY_OVERLAP._1).asInstanceOf[Double]
+
+    if (keyOverlap <= 0 || keyOverlap > 1) throw new Exception(
+      "join-key-overlap must be in (0, 1], got %s".format(keyOverlap))
+    val rightUniqueKeys = (uniqueKeys / keyOverlap).toInt
+    if (rightUniqueKeys.toString.length > keyLength) throw new Exception(
+      "Can't pack %s unique right side keys into %s digits".format(rightUniqueKeys, keyLength))
+
+    val hashFunction = hashRecords match {
+      case true => Some(Hashing.goodFastHash(math.max(keyLength, valueLength) * 4))
+      case false => None
+    }
+    right = timeInput {
+      DataGenerator.createKVStringDataSet(sc, math.max(1L, (numRecords * sizeRatio).toLong),
+        rightUniqueKeys, keyLength, uniqueValues, valueLength, numPartitions, randomSeed + 1,
+        0, persistenceType, storageLocation + "-right", hashFunction, inputCache)
+    }
+  }
+
+  def left(rdd: RDD[_]): RDD[(String, String)] = rdd.asInstanceOf[RDD[(String, String)]]
+}
+
+object KVJoinTest {
+  /**
+   * Join two iterators sorted by key, returning every pair of records with equal keys.
+   */
+  def mergeJoin[K, V, W](left: Iterator[(K, V)], right: Iterator[(K, W)])
+      (implicit ord: Ordering[K]): Iterator[(K, (V, W))] = {
+    val rightIter = right.buffered
+    var groupKey: Option[K] = None
+    var group = new ArrayBuffer[W]()
+    left.flatMap { case (k, v) =>
+      if (groupKey.isEmpty || !ord.equiv(groupKey.get, k)) {
+        while (rightIter.hasNext && ord.lt(rightIter.head._1, k)) {
+          rightIter.next()
+        }
+        group = new ArrayBuffer[W]()
+        while (rightIter.hasNext && ord.equiv(rightIter.head._1, k)) {
+          group += rightIter.next()._2
+        }
+        groupKey = Some(k)
+      }
+      group.iterator.map(w => (k, (v, w)))
+    }
+  }
+
+  /** Join `left` with `right` by hash partitioning both and sorting each partition by key. */
+  def sortMergeJoin[K: Ordering : ClassTag, V: ClassTag, W: ClassTag](
+      left: RDD[(K, V)], right: RDD[(K, W)], numPartitions: Int): RDD[(K, (V, W))] = {
+    val partitioner = new HashPartitioner(numPartitions)
+    left.repartitionAndSortWithinPartitions(partitioner)
+      .zipPartitions(right.repartitionAndSortWithinPartitions(partitioner)) { (l, r) =>
+        mergeJoin(l, r)
+      }
+  }
+}
+
+/** Shuffles both sides by key and joins them with per-key hash tables (RDD.join). */
+class ShuffleHashJoin(sc: SparkContext) extends KVJoinTest(sc) {
+  override def runTest(rdd: RDD[_], reduceTasks: Int) {
+    left(rdd).join(right, reduceTasks).count()
+  }
+}
+
+/** Shuffles both sides by key, sorts each partition and merges them. */
+class SortMergeJoin(sc: SparkContext) extends KVJoinTest(sc) {
+  override def runTest(rdd: RDD[_], reduceTasks: Int) {
+    KVJoinTest.sortMergeJoin(left(rdd), right, reduceTasks).count()
+  }
+}
+
+/** Broadcasts the right side and joins it with the left side without a shuffle. */
+class BroadcastJoin(sc: SparkContext) extends KVJoinTest(sc) {
+  override def runTest(rdd: RDD[_], reduceTasks: Int) {
+    val table = right.collect().groupBy(_._1).map { case (k, kvs) => (k, kvs.map(_._2)) }
+    val broadcastTable = sc.broadcast(table)
+    left(rdd).flatMap { case (k, v) =>
+      broadcastTable.value.getOrElse(k, Array.empty[String]).map(w => (k, (v, w)))
+    }.count()
+    broadcastTable.destroy()
+  }
+}
+
+/**
+ * Joins like [[ShuffleHashJoin]], but splits the keys which hold more than a reduce task's share
+ * of the left side (found by sampling) over join-salts tasks, replicating their right side
+ * records to each of them. Meant to be run with a skewed left side (see the skew option).
+ */
+class SkewJoin(sc: SparkContext) extends KVJoinTest(sc) {
+  override def runTest(rdd: RDD[_], reduceTasks: Int) {
+    val numRecords = optionSet.valueOf(NUM_RECORDS._1).asInstanceOf[Long]
+    val numSalts = optionSet.valueOf(JOIN_SALTS._1).asInstanceOf[Int]
+    val sampleFraction = math.min(1.0, 100000.0 / numRecords)
+    val hotKeys = left(rdd).sample(false, sampleFraction, 42).map(_._1).countByValue()
+      .filter { case (_, count) => count / sampleFraction > numRecords / reduceTasks }
+      .keys.toSet
+    val broadcastHotKeys = sc.broadcast(hotKeys)
+    val saltedLeft = left(rdd).mapPartitionsWithIndex { (index, records) =>
+      val random = new Random(index)
+      records.map { case (k, v) =>
+        val salt = if (broadcastHotKeys.value.contains(k)) random.nextInt(numSalts) else 0
+        ((k, salt), v)
+      }
+    }
+    val saltedRight = right.flatMap { case (k, w) =>
+      val salts = if (broadcastHotKeys.value.contains(k)) 0 until numSalts else 0 until 1
+      salts.map(salt => ((k, salt), w))
+    }
+    saltedLeft.join(saltedRight, reduceTasks).count()
+    broadcastHotKeys.destroy()
+  }
+}
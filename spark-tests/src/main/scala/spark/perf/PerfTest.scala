@@ -35,4 +35,16 @@ trait PerfTest {
    * @return (options, list of per-run metrics (e.g. ("time" -> time))
    */
   def run(): (JValue, Seq[JValue])
+
+  /**
+   * When running an adaptive number of trials (see [[AdaptiveTrials]]), the number of leading
+   * results of the last run() which were detected as warm-up trials.
+   */
+  def warmupTrials: Option[Int] = None
+
+  /**
+   * Metrics of the creation of the input data, e.g. the seconds spent generating it
+   * ("inputGenerationTime") and loading it from a cache ("inputLoadTime").
+   */
+  def inputMetrics: Map[String, Double] = Map.empty
 }
@@ -1,6 +1,7 @@
 package spark.perf
 
 import scala.collection.JavaConverters._
+import scala.collection.mutable.ArrayBuffer
 
 import joptsimple.{OptionSet, OptionParser}
 import org.json4s.JsonDSL._
@@ -18,6 +19,10 @@ class SchedulerThroughputTest(sc: SparkContext) extends PerfTest {
   val NUM_JOBS = ("num-jobs", "number of jobs to run")
   val RANDOM_SEED = ("random-seed", "seed for random number generator")
   val CLOSURE_SIZE = ("closure-size", "task closure size (in bytes)")
+  val MAX_TRIALS = ("max-trials",
+    "if > 0, run up to this many trials, stopping once the timings have converged")
+  val TARGET_CI = ("target-ci",
+    "with max-trials, the target width of the median's confidence interval, in percent")
 
   val parser = new OptionParser()
   var optionSet: OptionSet = _
@@ -26,6 +31,14 @@ class SchedulerThroughputTest(sc: SparkContext) extends PerfTest {
     case (opt, desc) =>
       parser.accepts(opt, desc).withRequiredArg().ofType(classOf[Int]).required()
   }
+  parser.accepts(MAX_TRIALS._1, MAX_TRIALS._2).withRequiredArg()
+    .ofType(classOf[java.lang.Integer]).defaultsTo(0)
+  parser.accepts(TARGET_CI._1, TARGET_CI._2).withRequiredArg()
+    .ofType(classOf[java.lang.Double]).defaultsTo(5.0)
+
+  var detectedWarmupTrials: Option[Int] = None
+
+  override def warmupTrials: Option[Int] = detectedWarmupTrials
 
   def initialize(args: Array[String]) = {
     optionSet = parser.parse(args.toSeq: _*)
@@ -40,6 +53,8 @@ class SchedulerThroughputTest(sc: SparkContext) extends PerfTest {
     val numJobs = optionSet.valueOf(NUM_JOBS._1).asInstanceOf[Int]
     val randomSeed = optionSet.valueOf(RANDOM_SEED._1).asInstanceOf[Int]
     val closureSize = optionSet.valueOf(CLOSURE_SIZE._1).asInstanceOf[Int]
+    val maxTrials = optionSet.valueOf(MAX_TRIALS._1).asInstanceOf[Int]
+    val targetCI = optionSet.valueOf(TARGET_CI._1).asInstanceOf[Double]
 
     // Allows us to simulate large task closures; this consists of random bytes in order
     // to make it incompressible:
@@ -54,17 +69,22 @@ class SchedulerThroughputTest(sc: SparkContext) extends PerfTest {
       }
     }.toMap
 
-    val results: Seq[JValue] = (1 to numTrials).map { t =>
+    val times = new ArrayBuffer[Double]()
+    do {
       val start = System.currentTimeMillis()
       (1 to numJobs).foreach { _ =>
         sc.makeRDD(1 to numTasks, numTasks).mapPartitions(mapFunction).count()
       }
       val end = System.currentTimeMillis()
-      val time = (end - start).toDouble / 1000.0
+      times += (end - start).toDouble / 1000.0
+      TrialReporter.report(times.length - 1, ("time" -> times.last) : JValue)
       System.gc()
       Thread.sleep(interTrialWait * 1000)
-      ("time" -> time) : JValue
+    } while (!AdaptiveTrials.isDone(times, numTrials, maxTrials, targetCI))
+    if (maxTrials > 0) {
+      detectedWarmupTrials = Some(AdaptiveTrials.numWarmupTrials(times, targetCI))
     }
+    val results: Seq[JValue] = times.map(time => ("time" -> time) : JValue)
 
     (options, results)
   }
@@ -0,0 +1,35 @@
+package spark.perf
+
+import java.util.concurrent.atomic.AtomicLong
+
+import org.apache.spark.{SparkContext, SparkPerfListenerBus}
+import org.apache.spark.scheduler.{SparkListener, SparkListenerTaskEnd}
+
+/** Sums the shuffle bytes written and read by the tasks that end between resets. */
+class ShuffleVolumeListener(sc: SparkContext) extends SparkListener {
+  private val bytesWritten = new AtomicLong(0)
+  private val bytesRead = new AtomicLong(0)
+
+  sc.addSparkListener(this)
+
+  override def onTaskEnd(taskEnd: SparkListenerTaskEnd) {
+    val metrics = taskEnd.taskMetrics
+    if (metrics != null) {
+      bytesWritten.addAndGet(metrics.shuffleWriteMetrics.bytesWritten)
+      bytesRead.addAndGet(metrics.shuffleReadMetrics.totalBytesRead)
+    }
+  }
+
+  /** Start counting from zero, after the events of earlier jobs have been delivered. */
+  def reset(): Unit = {
+    SparkPerfListenerBus.waitUntilEmpty(sc)
+    bytesWritten.set(0)
+    bytesRead.set(0)
+  }
+
+  /** The (written, read) shuffle bytes of the jobs run since the last reset. */
+  def shuffleBytes: (Long, Long) = {
+    SparkPerfListenerBus.waitUntilEmpty(sc)
+    (bytesWritten.get, bytesRead.get)
+  }
+}
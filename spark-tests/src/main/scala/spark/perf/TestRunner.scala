@@ -33,6 +33,10 @@ object TestRunner {
       case "sort-by-key-int" => new SortByKeyInt(sc)
       case "count" => new Count(sc)
       case "count-with-filter" => new CountWithFilter(sc)
+      case "shuffle-hash-join" => new ShuffleHashJoin(sc)
+      case "sort-merge-join" => new SortMergeJoin(sc)
+      case "broadcast-join" => new BroadcastJoin(sc)
+      case "skew-join" => new SkewJoin(sc)
       case "scheduling-throughput" => new SchedulerThroughputTest(sc)
     }
     test.initialize(perfTestArgs)
@@ -56,7 +60,9 @@ object TestRunner {
       ("sparkConf" -> sc.getConf.getAll.toMap) ~
       ("sparkVersion" -> sc.version) ~
       ("systemProperties" -> System.getProperties.asScala.toMap) ~
-      ("results" -> results)
+      ("results" -> results) ~
+      ("warmupTrials" -> test.warmupTrials) ~
+      ("inputData" -> test.inputMetrics)
     println("results: " + compact(json))
 
     // Gracefully stop the SparkContext so that the application web UI can be preserved
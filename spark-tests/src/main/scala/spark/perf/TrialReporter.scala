@@ -0,0 +1,28 @@
+package spark.perf
+
+import java.io.{FileWriter, PrintWriter}
+
+import org.json4s.JsonDSL._
+import org.json4s.JsonAST._
+import org.json4s.jackson.JsonMethods._
+
+/**
+ * Reports the result of each trial as soon as it completes, as one JSON line appended to the
+ * file named by the SPARKPERF_TRIALS_FILE environment variable (set by the spark-perf harness).
+ * This lets the harness show progress and keep the completed trials of a test which dies before
+ * printing its final results. Does nothing when the variable is not set.
+ */
+object TrialReporter {
+  val TrialsFileEnvVar = "SPARKPERF_TRIALS_FILE"
+
+  private lazy val writer: Option[PrintWriter] =
+    sys.env.get(TrialsFileEnvVar).map(path => new PrintWriter(new FileWriter(path, true)))
+
+  /** Report the result of trial number `trial` (starting from 0). */
+  def report(trial: Int, result: JValue): Unit = synchronized {
+    writer.foreach { w =>
+      w.println(compact(render(("trial" -> trial) ~ ("result" -> result))))
+      w.flush()
+    }
+  }
+}